@@ -1,50 +1,733 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
 import os
+import uuid
 from dotenv import load_dotenv
 from services.llm_service import LLMService
 from services.vector_service import VectorService
+from services.metrics import REGISTRY, render_snapshots
+from services.ingestion import IngestionPipeline, check_chunking, ndjson_records, text_records
+from services.response_cache import SemanticResponseCache
+from services.health import DISABLED, FAILED as STORE_FAILED, HEALTH, READY
+from services.admission import AdmissionRejected
+from services.batch_chat import BatchChat, ndjson_questions
+from services.attribute_index import filters_key, validate_filters
+from services.embedding_cache import normalize_text
+from services.sessions import ConversationMemory, SessionStore, valid_session_id
+from services.single_flight import SingleFlight, StreamingSingleFlight
+from services.write_queue import FAILED, INDEXED, WriteBehindQueue
+from services.tracing import RequestTracingMiddleware, span
 
 load_dotenv()
 
-app = FastAPI(title="Personal AI Assistant (Jarvis)")
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("jarvis")
 
-# Initialize services
-llm_service = LLMService()
-vector_service = VectorService()
+# Services are created in the lifespan hook so importing the app stays cheap
+llm_service: LLMService = None
+vector_service: VectorService = None
+response_cache: SemanticResponseCache = None
+write_queue: WriteBehindQueue = None
+sessions: ConversationMemory = None
+
+# Candidates retrieved per question; the prompt builder keeps what fits its token budget
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+
+# Identical questions arriving together share one retrieval and one generation
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "true").lower() == "true"
+chat_flights = SingleFlight("chat")
+stream_flights = StreamingSingleFlight("chat_stream")
+
+# /chat/batch: questions embedded per encode call, the most accepted per request, and
+# generations run at once (defaults to LLM_MAX_IN_FLIGHT, which also caps it)
+CHAT_BATCH_EMBED_SIZE = int(os.getenv("CHAT_BATCH_EMBED_SIZE", "256"))
+CHAT_BATCH_MAX_QUESTIONS = int(os.getenv("CHAT_BATCH_MAX_QUESTIONS", "10000"))
+CHAT_BATCH_PARALLELISM = os.getenv("CHAT_BATCH_PARALLELISM")
+
+def _flight_key(message: str, filters: Optional[Dict] = None):
+    """Requests with equal keys get the same answer; a fresh object never matches when coalescing is off"""
+    if not REQUEST_COALESCING:
+        return object()
+    return (normalize_text(message), RETRIEVAL_TOP_K, filters_key(filters))
+
+async def _load_session(session_id: Optional[str]) -> Optional[Dict]:
+    """The chat's session so far (None for a stateless chat or a session's first turn)"""
+    if session_id is None:
+        return None
+    if not sessions:
+        raise HTTPException(status_code=400, detail="Sessions are disabled")
+    if not valid_session_id(session_id):
+        raise HTTPException(status_code=400, detail="Session ids are 1-128 letters, digits and _.:- characters")
+    return await sessions.get(session_id)
+
+async def _retrieve(query: str, query_embedding, filters: Optional[Dict], session: Optional[Dict] = None):
+    """Knowledge base passages for the question, plus relevant earlier turns of the session when recall is on"""
+    knowledge_filters = sessions.knowledge_filters(filters) if sessions else filters
+    context = await vector_service.search_similar(
+        query, top_k=RETRIEVAL_TOP_K, query_embedding=query_embedding, filters=knowledge_filters
+    )
+    if session and sessions.recall_enabled:
+        context += await sessions.recall(session["id"], query, query_embedding, session)
+    return context
+
+async def _require_vector_store(ready: bool = False):
+    """503 unless the knowledge base can be used; a store that failed to connect gets another try first.
+
+    With ``ready`` a store that is still connecting is refused too: only the write queue can hold writes for it,
+    and nothing can be searched or written through the ingestion pipeline before it is up.
+    """
+    state = HEALTH.state("vector_store")
+    if state == DISABLED:
+        raise HTTPException(status_code=503, detail="Vector database not configured")
+    if state == STORE_FAILED and not await vector_service.reconnect():
+        raise HTTPException(status_code=503, detail="Vector database unavailable",
+                            headers={"Retry-After": str(int(vector_service.reconnect_interval))})
+    if ready and HEALTH.state("vector_store") != READY:
+        raise HTTPException(status_code=503, detail="Vector database is still connecting", headers={"Retry-After": "1"})
+
+def _validated_filters(filters: Optional[Dict]) -> Optional[Dict]:
+    """Reject malformed metadata filters with a 400 instead of silently retrieving nothing"""
+    try:
+        return validate_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
+
+async def warmup():
+    """Load models and connect backends concurrently while the server already accepts traffic"""
+    await asyncio.gather(llm_service.warmup(), vector_service.warmup())
+    if HEALTH.is_ready():
+        print("✅ Jarvis is ready")
+
+def invalidate_indexed(documents):
+    """Cached answers for a source are stale once new knowledge for it is searchable"""
+    if response_cache:
+        response_cache.invalidate_sources({d["metadata"].get("source", "") for d in documents})
+
+def invalidate_followed(metadatas):
+    """The same, for knowledge another worker process wrote to the shared index"""
+    if response_cache:
+        response_cache.invalidate_sources({m.get("source", "") for m in metadatas})
+
+async def _push_metrics():
+    """Hand this worker's metrics to the embedding worker, which reports every worker's"""
+    worker = vector_service.embedding_worker
+    await vector_service._run_in(vector_service.index_executor, worker.push_metrics,
+                                 os.getenv("JARVIS_WORKER_ID", "0"), REGISTRY.snapshot())
+
+async def push_metrics_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await _push_metrics()
+        except Exception as e:
+            logger.warning("Pushing metrics to the embedding worker failed: %s", e)
+
+async def _all_workers_metrics() -> Optional[Dict[str, Dict]]:
+    """Under serve.py, the latest metrics of every process by worker id; None otherwise or if unreachable"""
+    if not vector_service or not vector_service.embedding_worker:
+        return None
+    try:
+        await _push_metrics()
+        return await vector_service._run_in(vector_service.index_executor, vector_service.embedding_worker.metrics)
+    except Exception as e:
+        logger.warning("Collecting metrics from the embedding worker failed, reporting this worker's only: %s", e)
+        return None
+
+def _worker_wal_path(path: Optional[str]) -> Optional[str]:
+    """Each serve.py worker keeps its own write-ahead log, found again by its number after a restart"""
+    worker_id = os.getenv("JARVIS_WORKER_ID")
+    if not path or worker_id is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker{worker_id}{extension}"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global llm_service, vector_service, response_cache, write_queue, sessions
+    # Optional services left over from an earlier run of the app must not outlive their settings
+    response_cache = write_queue = sessions = None
+    
+    # Constructors only read configuration; the slow work happens in warmup()
+    llm_service = LLMService()
+    vector_service = VectorService()
+    
+    # Near-duplicate questions reuse earlier answers instead of calling the LLM again
+    if os.getenv("RESPONSE_CACHE", "true").lower() == "true":
+        response_cache = SemanticResponseCache(
+            threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95")),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        )
+    
+    # /knowledge returns as soon as a document is logged; a worker batches the writes
+    if os.getenv("WRITE_QUEUE", "true").lower() == "true":
+        write_queue = WriteBehindQueue(
+            vector_service,
+            wal_path=_worker_wal_path(os.getenv("WRITE_QUEUE_WAL_PATH", "data/knowledge_wal.jsonl") or None),
+            batch_size=int(os.getenv("WRITE_QUEUE_BATCH_SIZE", "64")),
+            flush_interval_ms=float(os.getenv("WRITE_QUEUE_FLUSH_MS", "200")),
+            max_retries=int(os.getenv("WRITE_QUEUE_MAX_RETRIES", "8")),
+            fsync=os.getenv("WRITE_QUEUE_FSYNC", "true").lower() == "true",
+            on_indexed=invalidate_indexed,
+        )
+        await write_queue.start()
+    
+    # Chats that send a session_id get server-side conversation memory
+    expiry_task = None
+    if os.getenv("SESSIONS", "true").lower() == "true":
+        sessions = ConversationMemory(
+            SessionStore(
+                os.getenv("SESSION_STORE_PATH", "data/sessions.sqlite3") or None,
+                max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+                ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "86400")),
+            ),
+            llm_service,
+            vector_service,
+            write_queue,
+            window_turns=int(os.getenv("SESSION_WINDOW_TURNS", "6")),
+            summarize_batch=int(os.getenv("SESSION_SUMMARIZE_BATCH", "4")),
+            summary_tokens=int(os.getenv("SESSION_SUMMARY_TOKENS", "256")),
+            recall=os.getenv("SESSION_RECALL", "false").lower() == "true",
+            recall_top_k=int(os.getenv("SESSION_RECALL_TOP_K", "3")),
+        )
+        expiry_task = asyncio.create_task(sessions.expire_periodically())
+    
+    warmup_task = asyncio.create_task(warmup())
+    # One pinger is enough however many serve.py workers share the Ollama server
+    keep_warm_task = None
+    if llm_service.keep_warm_enabled and os.getenv("JARVIS_WORKER_ID", "0") == "0":
+        keep_warm_task = asyncio.create_task(llm_service.keep_warm())
+    # Under serve.py other workers write to the shared index too; pick their writes up as they land
+    follow_task = metrics_task = None
+    if vector_service.embedding_worker:
+        follow_task = asyncio.create_task(vector_service.follow_writes(
+            invalidate_followed, float(os.getenv("INDEX_REFRESH_SECONDS", "1"))
+        ))
+        # Any worker may answer a scrape, so each one's metrics are kept where all of them can report them
+        metrics_task = asyncio.create_task(push_metrics_periodically(float(os.getenv("METRICS_PUSH_SECONDS", "5"))))
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        if follow_task:
+            follow_task.cancel()
+            metrics_task.cancel()
+        if keep_warm_task:
+            keep_warm_task.cancel()
+        if sessions:
+            expiry_task.cancel()
+            await sessions.close()
+        if write_queue:
+            await write_queue.close()
+        vector_service.close()
+        await llm_service.close()
+
+app = FastAPI(title="Personal AI Assistant (Jarvis)", lifespan=lifespan)
+app.add_middleware(RequestTracingMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    """Overload answers fast with a hint of when to retry instead of hanging"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """Await ``coro``, cancelling it (and any queued or running generation) if the client goes away"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
 
 class ChatRequest(BaseModel):
     message: str
+    # Metadata filter for retrieval, e.g. {"source": "handbook.md"}
+    filters: Optional[Dict[str, Any]] = None
+    # Continue a conversation: the server remembers earlier turns under this id
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
     sources: list = []
+    cached: bool = False
+    prompt_tokens: Optional[int] = None
+    session_id: Optional[str] = None
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_response: Response, raw_request: Request):
     try:
-        # Search for relevant context
-        context = await vector_service.search_similar(request.message)
+        filters = _validated_filters(request.filters)
+        session = await _load_session(request.session_id)
+        history = sessions.history(session) if sessions else None
+        scope = filters_key(filters)
         
-        # Generate response using LLM
-        response = await llm_service.generate_response(request.message, context)
+        cached = None
+        if history:
+            # A follow-up's answer depends on the conversation, so the answer cache is no use;
+            # retrieval searches with the previous question too, which carries the topic
+            query = sessions.retrieval_query(request.message, session)
+            query_embedding = await vector_service.embed(query)
+        else:
+            query = request.message
+            # The query embedding is shared by the answer cache and retrieval
+            query_embedding = await vector_service.embed(request.message)
+            with span("response_cache"):
+                cached = response_cache.lookup(query_embedding, scope) if response_cache else None
+        if cached:
+            if request.session_id:
+                await sessions.record(request.session_id, request.message, cached["response"])
+            http_response.headers["X-Cache"] = "HIT"
+            return ChatResponse(response=cached["response"], sources=cached["sources"], cached=True,
+                                session_id=request.session_id)
+        
+        async def answer():
+            # Taken before retrieving: an answer built on knowledge invalidated meanwhile is not cached
+            epoch = response_cache.epoch() if response_cache else None
+            # Search for relevant context
+            context = await _retrieve(query, query_embedding, filters, session)
+            prompt = llm_service.build_prompt(request.message, context, history)
+            
+            # Generate response using LLM; failures become a friendly reply that is never cached or remembered
+            generated = True
+            try:
+                response = await llm_service.complete(request.message, prompt=prompt)
+                if response_cache and not history:
+                    response_cache.store(request.message, query_embedding, response, prompt.sources, scope, epoch)
+            except AdmissionRejected:
+                raise
+            except Exception as e:
+                logger.exception("LLM generation failed")
+                response = llm_service.error_message(e)
+                generated = False
+            chat_response = ChatResponse(response=response, sources=prompt.sources, prompt_tokens=prompt.prompt_tokens)
+            return chat_response, generated
         
-        return ChatResponse(
-            response=response,
-            sources=[doc.get("source", "") for doc in context]
+        # Concurrent duplicates await the leader's answer; the work stops once every client has left.
+        # Follow-ups are never shared: each depends on its own conversation
+        key = object() if history else _flight_key(request.message, filters)
+        chat_response, generated = await _cancel_on_disconnect(raw_request, chat_flights.do(key, answer))
+        if request.session_id:
+            if generated:
+                await sessions.record(request.session_id, request.message, chat_response.response)
+            chat_response = chat_response.model_copy(update={"session_id": request.session_id})
+        http_response.headers["X-Cache"] = "MISS"
+        return chat_response
+    except (AdmissionRejected, HTTPException):
+        raise
+    except Exception as e:
+        logger.exception("Request failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    # Retrieve and take a generation slot before streaming starts so errors still surface as a status code
+    filters = _validated_filters(request.filters)
+    session = await _load_session(request.session_id)
+    history = sessions.history(session) if sessions else None
+    scope = filters_key(filters)
+    cached = None
+    try:
+        if history:
+            query = sessions.retrieval_query(request.message, session)
+            query_embedding = await vector_service.embed(query)
+        else:
+            query = request.message
+            query_embedding = await vector_service.embed(request.message)
+            with span("response_cache"):
+                cached = response_cache.lookup(query_embedding, scope) if response_cache else None
+    except Exception as e:
+        logger.exception("Request failed")
+        raise HTTPException(status_code=500, detail=str(e))
+    session_details = {"session_id": request.session_id} if request.session_id else {}
+    
+    async def cached_events():
+        yield _sse_event("token", {"token": cached["response"]})
+        if request.session_id:
+            await sessions.record(request.session_id, request.message, cached["response"])
+        yield _sse_event("done", {"sources": cached["sources"], "cached": True, **session_details})
+    
+    if cached:
+        return StreamingResponse(
+            cached_events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": "HIT"},
         )
+    
+    async def produce(broadcast):
+        """Leader: retrieve, generate and publish tokens for every client asking the same question"""
+        epoch = response_cache.epoch() if response_cache else None
+        context = await _retrieve(query, query_embedding, filters, session)
+        prompt = llm_service.build_prompt(request.message, context, history)
+        # Hold a generation slot before answering so overload is a 429/503, not a broken stream
+        reservation = await llm_service.reserve()
+        broadcast.open(prompt.sources, prompt_tokens=prompt.prompt_tokens)
+        tokens = []
+        try:
+            async for token in llm_service.stream_completion(request.message, reservation=reservation, prompt=prompt):
+                tokens.append(token)
+                broadcast.publish(token)
+        except Exception as e:
+            logger.exception("LLM streaming failed")
+            # Reported to every reader as an "error" event, not as part of the answer
+            broadcast.details.update(failed=True, error=llm_service.error_message(e))
+            return
+        finally:
+            reservation.release()
+        if response_cache and not history:
+            response_cache.store(request.message, query_embedding, "".join(tokens), prompt.sources, scope, epoch)
+    
+    # Follow-ups are never shared: each depends on its own conversation
+    key = object() if history else _flight_key(request.message, filters)
+    subscription = stream_flights.subscribe(key, produce)
+    try:
+        broadcast = await subscription.ready()
+    except AdmissionRejected:
+        subscription.release()
+        raise
     except Exception as e:
+        subscription.release()
+        logger.exception("Request failed")
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        subscription.release()
+        raise
+    
+    async def events():
+        try:
+            tokens = []
+            async for token in broadcast.read():
+                tokens.append(token)
+                yield _sse_event("token", {"token": token})
+            # Remembered before "done", so a follow-up sent straight away already sees this turn
+            if request.session_id and not broadcast.details.get("failed"):
+                await sessions.record(request.session_id, request.message, "".join(tokens))
+            details = dict(broadcast.details)
+            error = details.pop("error", None)
+            if error:
+                yield _sse_event("error", {"error": error})
+            yield _sse_event("done", {"sources": broadcast.sources, "cached": False, **details,
+                                      **session_details})
+        finally:
+            subscription.release()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": "MISS",
+        },
+        # Starlette cancels the body iterator when the client disconnects;
+        # this also lets go of the stream if the body never started
+        background=BackgroundTask(subscription.release),
+    )
+
+class RequestBodyStreamingResponse(StreamingResponse):
+    """A streamed response whose body iterator is still reading the request.
+
+    StreamingResponse watches ``receive`` for a disconnect while it sends, which would
+    swallow the rest of the request body. This one leaves ``receive`` to the iterator
+    until ``body_read`` is set, and only then watches for the client going away.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+    
+    async def __call__(self, scope, receive, send):
+        async def listen():
+            await self.body_read.wait()
+            await self.listen_for_disconnect(receive)
+        
+        streaming = asyncio.create_task(self.stream_response(send))
+        listening = asyncio.create_task(listen())
+        try:
+            await asyncio.wait({streaming, listening}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, listening):
+                task.cancel()
+            await asyncio.gather(streaming, listening, return_exceptions=True)
+        if streaming.done() and not streaming.cancelled() and streaming.exception() is not None:
+            # A client that hangs up mid-upload simply ends the batch
+            if not isinstance(streaming.exception(), ClientDisconnect):
+                raise streaming.exception()
+        if self.background is not None:
+            await self.background()
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request, parallelism: Optional[int] = None, cache: bool = False):
+    """Answer NDJSON questions ({"message", "id", "filters"} per line) for evaluation or bulk use.
+
+    Questions are read while earlier ones are answered. Results stream back as NDJSON in
+    completion order, each with its input ``index`` and per-stage timings, followed by a
+    ``{"summary": ...}`` line. Every question is generated afresh unless ``cache=true``
+    lets answers come from, and go into, the answer cache.
+    """
+    body_read = asyncio.Event()
+    
+    async def questions():
+        try:
+            count = 0
+            async for question in ndjson_questions(request.stream()):
+                count += 1
+                if count > CHAT_BATCH_MAX_QUESTIONS:
+                    # The status line is long gone, so the cut-off is reported in the stream
+                    yield {"id": None, "error": f"At most {CHAT_BATCH_MAX_QUESTIONS} questions per batch; "
+                                                "the rest were not read"}
+                    return
+                if sessions and "error" not in question:
+                    question["filters"] = sessions.knowledge_filters(question["filters"])
+                yield question
+        finally:
+            body_read.set()
+    
+    # Generations beyond the admission limit would only sit in the shared queue
+    capacity = llm_service.admission.max_in_flight
+    parallelism = min(parallelism or int(CHAT_BATCH_PARALLELISM or capacity), capacity)
+    batch = BatchChat(
+        vector_service,
+        llm_service,
+        response_cache if cache else None,
+        top_k=RETRIEVAL_TOP_K,
+        embed_batch_size=CHAT_BATCH_EMBED_SIZE,
+        parallelism=parallelism,
+    )
+    
+    async def lines():
+        async for result in batch.run(questions()):
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": {**batch.summary(), "parallelism": parallelism}}) + "\n"
+    
+    return RequestBodyStreamingResponse(lines(), body_read, media_type="application/x-ndjson")
 
 @app.post("/knowledge")
-async def add_knowledge(text: str, source: str = "user_input"):
+async def add_knowledge(http_response: Response, text: str, source: str = "user_input",
+                        wait: bool = False, timeout: float = 10.0,
+                        metadata: Optional[Dict[str, Any]] = Body(None)):
+    """Queue a document for indexing; with ``wait`` the reply comes once it is searchable.
+
+    An optional JSON body adds metadata fields that searches can filter on.
+    """
+    await _require_vector_store(ready=not write_queue)
+    metadata = {**(metadata or {}), "source": source}
+    try:
+        if not write_queue:
+            doc_id = await vector_service.add_document(text, metadata)
+            if response_cache:
+                response_cache.invalidate_sources([source])
+            return {"message": "Knowledge added successfully", "id": doc_id}
+        
+        doc_id = (await write_queue.submit([text], [metadata]))[0]
+        status = await write_queue.wait(doc_id, timeout) if wait else write_queue.status(doc_id)
+    except Exception as e:
+        logger.exception("Request failed")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if status["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=f"Indexing failed: {status.get('error')}")
+    if status["status"] == INDEXED:
+        return {"message": "Knowledge added successfully", **status}
+    http_response.status_code = 202
+    return {"message": "Knowledge queued for indexing", **status}
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+
+@app.post("/knowledge/search")
+async def search_knowledge(request: SearchRequest):
+    """Retrieve documents without generating an answer, optionally filtered by metadata"""
+    await _require_vector_store(ready=True)
+    filters = _validated_filters(request.filters)
+    if sessions:
+        filters = sessions.knowledge_filters(filters)
+    documents = await vector_service.search_similar(request.query, top_k=request.top_k, filters=filters)
+    return {"documents": documents}
+
+@app.post("/sessions")
+async def create_session():
+    """Start a conversation; pass the returned ``session_id`` with each /chat or /chat/stream message"""
+    if not sessions:
+        raise HTTPException(status_code=404, detail="Sessions are disabled")
+    session = await sessions.create(uuid.uuid4().hex)
+    return sessions.describe(session)
+
+@app.get("/sessions")
+async def session_stats():
+    """Session store totals: how many sessions and the bytes of conversation state they hold"""
+    if not sessions:
+        raise HTTPException(status_code=404, detail="Sessions are disabled")
+    return sessions.stats()
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """A session's summary, recent turns, memory use and the history tokens it adds to each prompt"""
+    session = await _load_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return sessions.describe(session)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget a conversation, including any of its turns indexed for recall"""
+    await _load_session(session_id)
+    if not await sessions.forget(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return {"message": "Session deleted"}
+
+@app.get("/knowledge/{doc_id}/status")
+async def knowledge_status(doc_id: str, wait: bool = False, timeout: float = 10.0):
+    """Indexing status of a document accepted by /knowledge; ``wait`` blocks until it is searchable"""
+    if not write_queue:
+        raise HTTPException(status_code=404, detail="Write-behind indexing is disabled")
+    status = await write_queue.wait(doc_id, timeout) if wait else write_queue.status(doc_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown document id")
+    return status
+
+NDJSON_TYPES = {"application/x-ndjson", "application/jsonl", "application/x-jsonlines", "application/json"}
+UPLOAD_READ_BYTES = 1024 * 1024
+
+def _bulk_format(content_type: Optional[str], filename: str = "") -> Optional[str]:
+    """"ndjson" or "text" for a body or uploaded file, None for anything else"""
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        return "ndjson"
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in NDJSON_TYPES:
+        return "ndjson"
+    if media_type.startswith("text/") or media_type in ("", "application/octet-stream"):
+        return "text"
+    return None
+
+async def _upload_pieces(upload: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        piece = await upload.read(UPLOAD_READ_BYTES)
+        if not piece:
+            return
+        yield piece
+
+def _bulk_records(pieces: AsyncIterator[bytes], fmt: str, source: str, chunk_size: int, chunk_overlap: int):
+    if fmt == "ndjson":
+        return ndjson_records(pieces, source)
+    return text_records(pieces, source, chunk_size, chunk_overlap)
+
+async def _upload_records(uploads: List[Tuple[UploadFile, str]], source: Optional[str],
+                          chunk_size: int, chunk_overlap: int) -> AsyncIterator[Dict]:
+    """Each uploaded file in turn; a file is its own source unless the request names one"""
+    for upload, fmt in uploads:
+        records = _bulk_records(_upload_pieces(upload), fmt, source or upload.filename or "bulk_upload",
+                                chunk_size, chunk_overlap)
+        async for record in records:
+            yield record
+
+@app.post("/knowledge/bulk")
+async def add_knowledge_bulk(request: Request, source: Optional[str] = None,
+                             chunk_size: int = 1000, chunk_overlap: int = 200, sync: bool = False):
+    """Stream NDJSON records ({"text", "source", "metadata"} per line) or a plain-text file into the knowledge base.
+
+    The body is the file itself, or a ``multipart/form-data`` upload of one or more files. Unchanged
+    chunks are skipped; with ``sync`` the upload replaces its sources, deleting chunks it no longer contains.
+    """
+    await _require_vector_store(ready=True)
+    try:
+        check_chunking(chunk_size, chunk_overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    content_type = request.headers.get("content-type", "")
+    form = None
+    if content_type.lower().startswith("multipart/form-data"):
+        # Uploaded files are spooled to temporary files while the form is parsed, then read in pieces
+        form = await request.form()
+        uploads = []
+        for _, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                fmt = _bulk_format(value.content_type, value.filename or "")
+                if fmt is None:
+                    await form.close()
+                    raise HTTPException(status_code=415,
+                                        detail=f"Unsupported file type {value.content_type} ({value.filename}); "
+                                               f"upload NDJSON or plain text")
+                uploads.append((value, fmt))
+        if not uploads:
+            await form.close()
+            raise HTTPException(status_code=400, detail="The upload contains no files")
+        records = _upload_records(uploads, source, chunk_size, chunk_overlap)
+    else:
+        fmt = _bulk_format(content_type)
+        if fmt is None:
+            raise HTTPException(status_code=415,
+                                detail=f"Unsupported content type {content_type}; send NDJSON, plain text or a "
+                                       f"multipart/form-data upload")
+        records = _bulk_records(request.stream(), fmt, source or "bulk_upload", chunk_size, chunk_overlap)
+    
+    pipeline = IngestionPipeline(vector_service, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     try:
-        await vector_service.add_document(text, {"source": source})
-        return {"message": "Knowledge added successfully"}
+        stats = await pipeline.run(records, sync=sync)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
     except Exception as e:
+        logger.exception("Request failed")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Even a partially applied upload can change answers for these sources
+        if response_cache:
+            response_cache.invalidate_sources(pipeline.sources)
+        if form is not None:
+            await form.close()
+    return {"message": "Knowledge added successfully", **stats.to_dict()}
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(http_response: Response):
+    """Readiness: every component has finished warming up (or is not configured)"""
+    ready = HEALTH.is_ready()
+    if not ready:
+        http_response.status_code = 503
+    return {"ready": ready, "components": HEALTH.snapshot()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint; under serve.py every process's metrics, labelled by ``worker``"""
+    snapshots = await _all_workers_metrics()
+    text = render_snapshots(snapshots) if snapshots else REGISTRY.render_prometheus()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def get_stats():
+    snapshots = await _all_workers_metrics()
+    return {"workers": snapshots} if snapshots else REGISTRY.snapshot()
 
 @app.get("/", response_class=HTMLResponse)
 async def get_chat_interface():
@@ -70,6 +753,19 @@ async def get_chat_interface():
         <button onclick="sendMessage()">Send</button>
         
         <script>
+            // One conversation per browser tab, so follow-up questions have context
+            let sessionId = sessionStorage.getItem('jarvis-session');
+            
+            async function currentSession() {
+                if (!sessionId) {
+                    const response = await fetch('/sessions', { method: 'POST' });
+                    if (!response.ok) return null;
+                    sessionId = (await response.json()).session_id;
+                    sessionStorage.setItem('jarvis-session', sessionId);
+                }
+                return sessionId;
+            }
+            
             async function sendMessage() {
                 const input = document.getElementById('message-input');
                 const message = input.value.trim();
@@ -78,16 +774,47 @@ async def get_chat_interface():
                 addMessage(message, 'user');
                 input.value = '';
                 
+                const reply = addMessage('', 'assistant');
                 try {
-                    const response = await fetch('/chat', {
+                    const session_id = await currentSession();
+                    const response = await fetch('/chat/stream', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ message })
+                        body: JSON.stringify(session_id ? { message, session_id } : { message })
                     });
-                    const data = await response.json();
-                    addMessage(data.response, 'assistant');
+                    if (!response.ok) throw new Error(response.statusText);
+                    
+                    // Render tokens as Server-Sent Events arrive
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        const frames = buffer.split('\\n\\n');
+                        buffer = frames.pop();
+                        for (const frame of frames) handleEvent(frame, reply);
+                    }
                 } catch (error) {
-                    addMessage('Sorry, I encountered an error.', 'assistant');
+                    reply.textContent = 'Sorry, I encountered an error.';
+                }
+            }
+            
+            function handleEvent(frame, reply) {
+                let event = 'message', data = '';
+                for (const line of frame.split('\\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (!data) return;
+                const payload = JSON.parse(data);
+                if (event === 'token') {
+                    reply.textContent += payload.token;
+                    const container = document.getElementById('chat-container');
+                    container.scrollTop = container.scrollHeight;
+                } else if (event === 'error') {
+                    reply.textContent = payload.error || 'Sorry, I encountered an error.';
                 }
             }
             
@@ -98,6 +825,7 @@ async def get_chat_interface():
                 div.textContent = text;
                 container.appendChild(div);
                 container.scrollTop = container.scrollHeight;
+                return div;
             }
             
             function handleKeyPress(event) {
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Batch question answering against a running Jarvis server
+
+Sends a JSONL/NDJSON file of questions ({"message", "id", "filters"} per line,
+or a bare JSON string) to /chat/batch and writes the answers as NDJSON, in the
+order they complete, each with its input ``index`` and per-stage timings:
+
+    python ask.py questions.jsonl --output answers.jsonl
+    python ask.py questions.jsonl --cache    # reuse answers from the answer cache
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import httpx
+from dotenv import load_dotenv
+
+# The file is sent as it is read; Jarvis starts answering before the upload ends
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+
+def run(args) -> int:
+    params = {"cache": "true" if args.cache else "false"}
+    if args.parallelism:
+        params["parallelism"] = args.parallelism
+    source = sys.stdin.buffer if args.questions == "-" else open(args.questions, "rb")
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    # Answers can take a long time to start arriving; only connecting is bounded
+    timeout = httpx.Timeout(None, connect=10.0)
+    summary = None
+    failed = 0
+    try:
+        with httpx.Client(base_url=args.url, timeout=timeout) as client:
+            with client.stream("POST", "/chat/batch", params=params, content=iter(lambda: source.read(UPLOAD_CHUNK_BYTES), b""),
+                               headers={"Content-Type": "application/x-ndjson"}) as response:
+                if response.status_code != 200:
+                    response.read()
+                    print(f"❌ {response.status_code}: {response.text}", file=sys.stderr)
+                    return 1
+                done = 0
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    if "summary" in result:
+                        summary = result["summary"]
+                        continue
+                    output.write(line + "\n")
+                    done += 1
+                    failed += "error" in result
+                    if args.progress_every and done % args.progress_every == 0:
+                        print(f"💬 {done} answered ({failed} failed)", file=sys.stderr)
+    except httpx.HTTPError as e:
+        print(f"❌ Could not reach Jarvis at {args.url}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    if summary is None:
+        print("❌ The batch ended before it finished", file=sys.stderr)
+        return 1
+    print(f"✅ {summary['questions']} questions in {summary['seconds']:.1f}s "
+          f"({summary['questions_per_second']:.1f}/sec): {summary['answered']} answered, "
+          f"{summary['cached']} from cache, {summary['failed']} failed", file=sys.stderr)
+    return 0 if not summary["failed"] else 2
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Answer a file of questions through Jarvis")
+    parser.add_argument("questions", help="JSONL/NDJSON file of questions ('-' for stdin)")
+    parser.add_argument("--url", default=os.getenv("JARVIS_URL", "http://127.0.0.1:8000"), help="Jarvis server")
+    parser.add_argument("--output", help="Write answers here instead of stdout")
+    parser.add_argument("--parallelism", type=int, help="Concurrent generations (at most LLM_MAX_IN_FLIGHT)")
+    parser.add_argument("--cache", action="store_true", help="Reuse cached answers instead of generating every one")
+    parser.add_argument("--progress-every", type=int, default=100, help="Report progress every N answers")
+    args = parser.parse_args()
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
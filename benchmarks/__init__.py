@@ -0,0 +1 @@
+# Benchmarks and deterministic local stand-ins for Ollama and Pinecone
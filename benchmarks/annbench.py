@@ -0,0 +1,100 @@
+"""
+Recall and latency of the local IVF index against an exact scan
+
+    python -m benchmarks.annbench --size 1000000 --output ann.json
+
+Builds a local index of clustered synthetic vectors (see
+``benchmarks.quantbench``), trains the IVF lists, then for each ``nprobe``
+reports recall@k against the exact top k and query latency percentiles.
+Queries are also timed while the lists are being retrained in the
+background, to show that retraining does not block search.
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.microbench import time_calls_each
+from benchmarks.quantbench import clustered_vectors, recall
+from benchmarks.results import emit, summarize_latencies
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+
+
+def search_ids(index: LocalVectorIndex, queries: np.ndarray, top_k: int, **options):
+    results: List[List[str]] = []
+    timings = time_calls_each(
+        lambda query: results.append(
+            [m.id for m in index.query(query, top_k=top_k, include_metadata=False, **options).matches]
+        ),
+        queries,
+    )
+    return results, timings
+
+
+def bench(args) -> Dict:
+    rng = np.random.default_rng(42)
+    centres = rng.standard_normal((args.clusters, EMBEDDING_DIMENSION)).astype(np.float32)
+    queries = clustered_vectors(np.random.default_rng(1), centres, args.queries, args.spread)
+    results: Dict = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Training is started explicitly below so the build and training times are separate
+        index = LocalVectorIndex(directory, storage=args.storage, ann="ivf", ivf_lists=args.lists,
+                                 ivf_train_size=args.size + 1)
+        started = time.perf_counter()
+        data_rng = np.random.default_rng(0)
+        for start in range(0, args.size, args.batch):
+            vectors = clustered_vectors(data_rng, centres, min(args.batch, args.size - start), args.spread)
+            index.upsert([(f"doc-{start + i}", vector, {}) for i, vector in enumerate(vectors)])
+        results["build_seconds"] = round(time.perf_counter() - started, 1)
+
+        started = time.perf_counter()
+        index.rebuild_ann(wait=True)
+        results["train_seconds"] = round(time.perf_counter() - started, 1)
+        results["index"] = index.describe_index_stats()
+
+        truth, timings = search_ids(index, queries, args.top_k, exact=True)
+        results["exact"] = summarize_latencies(timings)
+        results["ivf"] = {}
+        for nprobe in args.nprobe:
+            found, timings = search_ids(index, queries, args.top_k, nprobe=nprobe)
+            results["ivf"][str(nprobe)] = {**summarize_latencies(timings), "recall": recall(found, truth, args.top_k)}
+
+        # Searches while the lists are rebuilt from scratch on another thread
+        retrain = threading.Thread(target=index.rebuild_ann, kwargs={"wait": True})
+        retrain.start()
+        timings = []
+        while retrain.is_alive():
+            timings.extend(search_ids(index, queries[:20], args.top_k)[1])
+        retrain.join()
+        results["during_retrain"] = summarize_latencies(timings)
+        index.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local IVF index against exact search")
+    parser.add_argument("--size", type=int, default=1000000, help="Vectors in the index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--lists", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--storage", default="float32", help="Local index storage mode")
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--spread", type=float, default=1.0,
+                        help="Noise around each cluster centre; higher makes neighbours harder to find")
+    parser.add_argument("--batch", type=int, default=50000, help="Vectors per upsert while building")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = {"benchmark": "annbench", "size": args.size, "top_k": args.top_k, "storage": args.storage}
+    results.update(bench(args))
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
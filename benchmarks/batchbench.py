@@ -0,0 +1,122 @@
+"""
+Wall-clock time of answering a question set serially versus through /chat/batch
+
+    python -m benchmarks.batchbench --questions 1000 --parallelism 8 --output batch.json
+
+Starts the fake Ollama server and Jarvis (Pinecone stand-in, FakeEncoder) as
+subprocesses, fills the index with a few hundred facts, then answers the same
+number of distinct questions twice: one ``POST /chat`` at a time, the way an
+evaluation script loops over questions, and as one ``POST /chat/batch``.
+The answer cache is off so both runs generate every answer. The fake Ollama
+server serves generations concurrently, like Ollama with OLLAMA_NUM_PARALLEL
+set, and LLM_MAX_IN_FLIGHT is raised to ``--parallelism`` to match.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.results import emit, summarize_latencies
+from benchmarks.run import wait_until_ready
+
+
+def questions(prefix: str, count: int) -> List[Dict]:
+    return [{"id": f"{prefix}-{i}", "message": f"({prefix}) How much does benchmark item {i} weigh?"}
+            for i in range(count)]
+
+
+def run_serial(client: httpx.Client, items: List[Dict]) -> Dict:
+    latencies = []
+    failed = 0
+    started = time.perf_counter()
+    for item in items:
+        request_started = time.perf_counter()
+        response = client.post("/chat", json={"message": item["message"]})
+        latencies.append(time.perf_counter() - request_started)
+        failed += response.status_code != 200
+    wall = time.perf_counter() - started
+    return {"wall_seconds": round(wall, 3), "questions_per_sec": round(len(items) / wall, 2),
+            "failed": failed, "latency": summarize_latencies(latencies)}
+
+
+def run_batch(client: httpx.Client, items: List[Dict], parallelism: int) -> Dict:
+    body = "".join(json.dumps(item) + "\n" for item in items)
+    results, summary = [], None
+    started = time.perf_counter()
+    first_result = None
+    with client.stream("POST", "/chat/batch", params={"parallelism": parallelism, "cache": "false"},
+                       content=body, headers={"Content-Type": "application/x-ndjson"}) as response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            if "summary" in result:
+                summary = result["summary"]
+            else:
+                first_result = first_result or time.perf_counter() - started
+                results.append(result)
+    wall = time.perf_counter() - started
+    stages = {}
+    for stage in ("embed_ms", "retrieve_ms", "queue_ms", "generate_ms", "total_ms"):
+        values = [r["timings"][stage] / 1000.0 for r in results if stage in r.get("timings", {})]
+        stages[stage.replace("_ms", "")] = summarize_latencies(values)
+    return {"wall_seconds": round(wall, 3), "questions_per_sec": round(len(results) / wall, 2),
+            "first_result_seconds": round(first_result or 0.0, 3),
+            "failed": sum(1 for r in results if "error" in r), "stages": stages, "summary": summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial /chat with /chat/batch")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--parallelism", type=int, default=8, help="Concurrent generations for the batch run")
+    parser.add_argument("--ttft-ms", type=float, default=100.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=100.0)
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=20.0)
+    parser.add_argument("--encode-ms-per-text", type=float, default=2.0, help="FakeEncoder compute cost")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, OLLAMA_HOST=f"http://127.0.0.1:{args.ollama_port}", OPENAI_API_KEY="",
+               EMBEDDING_CACHE_PATH="", RESPONSE_CACHE="false", WRITE_QUEUE="false",
+               LLM_MAX_IN_FLIGHT=str(args.parallelism), LLM_MAX_QUEUE=str(max(32, args.parallelism * 4)))
+    fake_ollama = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(args.ollama_port),
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-sec", str(args.tokens_per_sec), "--tokens", str(args.tokens),
+    ], env=env)
+    server = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.server", "--port", str(args.port), "--fake-embeddings",
+        "--pinecone-latency-ms", str(args.pinecone_latency_ms), "--encode-ms-per-text", str(args.encode_ms_per_text),
+    ], env=env, stdout=subprocess.DEVNULL)
+
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.ollama_port}/api/version")
+        url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(f"{url}/readyz")
+        with httpx.Client(base_url=url, timeout=httpx.Timeout(None, connect=10.0)) as client:
+            facts = "".join(json.dumps({"text": f"Benchmark item {i} weighs {i % 97} kg.", "source": "batchbench"}) + "\n"
+                            for i in range(500))
+            client.post("/knowledge/bulk", content=facts, headers={"Content-Type": "application/x-ndjson"})
+            runs = {
+                "serial": run_serial(client, questions("serial", args.questions)),
+                "batch": run_batch(client, questions("batch", args.questions), args.parallelism),
+            }
+        runs["speedup"] = round(runs["serial"]["wall_seconds"] / runs["batch"]["wall_seconds"], 2)
+        config = {k: v for k, v in vars(args).items() if k != "output"}
+        emit({"benchmark": "batch", "config": config, "runs": runs}, args.output)
+    finally:
+        for process in (server, fake_ollama):
+            process.terminate()
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
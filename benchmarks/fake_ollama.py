@@ -0,0 +1,121 @@
+"""
+Deterministic fake Ollama server for benchmarks
+
+Implements enough of the Ollama HTTP API (/api/generate, /api/tags,
+/api/version) for LLMService, with a configurable time to first token and
+token rate:
+
+    python -m benchmarks.fake_ollama --port 11435 --ttft-ms 200 --tokens-per-sec 40
+
+With ``--load-ms`` the model unloads like Ollama's does once a request's
+``keep_alive`` (default 5 minutes) has passed, and the next request waits for
+it to load again and reports that in ``load_duration``.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services.llm_clients import duration_seconds
+
+DEFAULT_KEEP_ALIVE_SECONDS = 300.0
+
+
+def create_app(ttft_ms: float = 200.0, tokens_per_sec: float = 40.0, tokens: int = 64,
+               model: str = "llama2", load_ms: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    app.state.generations = 0
+    app.state.loads = 0
+    app.state.loaded_until = 0.0
+
+    async def load(keep_alive) -> int:
+        """Load the model if it has expired; returns the load time in nanoseconds"""
+        now = time.monotonic()
+        load_ns = 0
+        if load_ms and now >= app.state.loaded_until:
+            app.state.loads += 1
+            await asyncio.sleep(load_ms / 1000.0)
+            load_ns = int(load_ms * 1e6)
+        seconds = DEFAULT_KEEP_ALIVE_SECONDS if keep_alive is None else duration_seconds(keep_alive)
+        app.state.loaded_until = float("inf") if seconds < 0 else time.monotonic() + seconds
+        return load_ns
+
+    def base(prompt_tokens: int, done: bool) -> dict:
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": done,
+            "prompt_eval_count": prompt_tokens if done else None,
+            "eval_count": tokens if done else None,
+        }
+
+    async def generate_tokens(count: int):
+        await asyncio.sleep(ttft_ms / 1000.0)
+        interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+        for i in range(count):
+            if i and interval:
+                await asyncio.sleep(interval)
+            yield f"token{i} "
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        prompt = body.get("prompt") or ""
+        prompt_tokens = len(prompt.split())
+        app.state.generations += 1
+
+        # An empty prompt only loads the model, like the real server
+        count = tokens if prompt else 0
+        load_duration = await load(body.get("keep_alive"))
+
+        if body.get("stream", True):
+            async def lines():
+                started = time.perf_counter()
+                async for token in generate_tokens(count):
+                    yield json.dumps({**base(prompt_tokens, False), "response": token}) + "\n"
+                final = {**base(prompt_tokens, True), "response": "", "load_duration": load_duration,
+                         "total_duration": int((time.perf_counter() - started) * 1e9)}
+                yield json.dumps(final) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        text = "".join([token async for token in generate_tokens(count)])
+        return JSONResponse({**base(prompt_tokens, True), "response": text, "load_duration": load_duration})
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": f"{model}:latest", "model": f"{model}:latest"}]}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/stats")
+    async def stats():
+        return {"generations": app.state.generations, "loads": app.state.loads}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="Delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="Token rate after the first token")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens generated per request")
+    parser.add_argument("--model", default="llama2")
+    parser.add_argument("--load-ms", type=float, default=0.0, help="Model load time after it was unloaded")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.ttft_ms, args.tokens_per_sec, args.tokens, args.model, args.load_ms),
+                host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
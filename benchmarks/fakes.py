@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.local_index import EMBEDDING_DIMENSION, Match, QueryResult
+
+
+class FakeEncoder:
+    """Deterministic stand-in for SentenceTransformer.
+
+    Each text maps to a pseudo-random unit vector seeded by its hash, so runs
+    are reproducible without downloading a model. ``seconds_per_text`` adds a
+    fixed compute cost per text to mimic encoding time.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, seconds_per_text: float = 0.0):
+        self.dimension = dimension
+        self.seconds_per_text = seconds_per_text
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        single = isinstance(texts, str)
+        items = [texts] if single else list(texts)
+        if self.seconds_per_text:
+            time.sleep(self.seconds_per_text * len(items))
+        matrix = np.stack([self._vector(text) for text in items]) if items else np.zeros((0, self.dimension), np.float32)
+        return matrix[0] if single else matrix
+
+
+class FakePineconeIndex:
+    """In-memory stand-in for the Pinecone ``Index`` API.
+
+    Supports ``upsert``, ``query``, ``fetch``, ``list``, ``delete`` and
+    ``describe_index_stats`` with brute-force cosine scoring, plus a fixed
+    simulated network latency per call so the hosted code path can be
+    measured without an account.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, latency_ms: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency_ms / 1000.0
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict] = []
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors, **kwargs):
+        self._wait()
+        with self._lock:
+            new_rows = []
+            for item in vectors:
+                if isinstance(item, dict):
+                    doc_id, values, metadata = item["id"], item["values"], item.get("metadata") or {}
+                else:
+                    doc_id, values = item[0], item[1]
+                    metadata = item[2] if len(item) > 2 else {}
+                vector = np.asarray(values, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) or 1.0)
+                row = self._rows.get(doc_id)
+                if row is None:
+                    self._rows[doc_id] = len(self._ids)
+                    new_rows.append(vector)
+                    self._metadata.append(dict(metadata))
+                    self._ids.append(doc_id)
+                else:
+                    self._vectors[row] = vector
+                    self._metadata[row] = dict(metadata)
+            if new_rows:
+                self._vectors = np.vstack([self._vectors, np.stack(new_rows)])
+                self._alive = np.concatenate([self._alive, np.ones(len(new_rows), dtype=bool)])
+        return {"upserted_count": len(new_rows)}
+
+    def query(self, vector, top_k: int = 10, include_metadata: bool = True, **kwargs) -> QueryResult:
+        self._wait()
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            vectors, alive, ids, metadata = self._vectors, self._alive, self._ids, self._metadata
+            if not len(ids):
+                return QueryResult()
+            scores = vectors @ query
+            scores[~alive] = -np.inf
+            k = min(top_k, len(ids))
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(-scores[top])]
+            return QueryResult(matches=[
+                Match(id=ids[i], score=float(scores[i]), metadata=dict(metadata[i]) if include_metadata else {})
+                for i in top if alive[i]
+            ])
+
+    def fetch(self, ids: List[str], **kwargs) -> Dict:
+        self._wait()
+        with self._lock:
+            found = {}
+            for doc_id in ids:
+                row = self._rows.get(doc_id)
+                if row is not None:
+                    found[doc_id] = {"id": doc_id, "values": self._vectors[row].tolist(), "metadata": dict(self._metadata[row])}
+        return {"vectors": found}
+
+    def list(self, prefix: str = "", limit: int = 100, **kwargs):
+        """Pages of at most ``limit`` ids, one simulated request per page"""
+        with self._lock:
+            ids = [doc_id for doc_id in self._ids if doc_id is not None and doc_id.startswith(prefix or "")]
+        for start in range(0, len(ids), limit):
+            self._wait()
+            yield ids[start:start + limit]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        self._wait()
+        with self._lock:
+            for doc_id in ids or []:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self._ids[row] = None
+                    self._alive[row] = False
+        return {}
+
+    def describe_index_stats(self) -> Dict:
+        return {"dimension": self.dimension, "total_vector_count": len(self._rows)}
@@ -0,0 +1,127 @@
+"""
+Load generator for a running Jarvis server
+
+Drives /chat, /chat/stream, /knowledge or /knowledge/search at a target
+concurrency and reports latency percentiles, requests/sec and how much
+requests overlapped:
+
+    python -m benchmarks.loadgen --url http://127.0.0.1:8001 --scenario chat --concurrency 16 --requests 200
+
+``overlap`` is the summed request latency divided by wall-clock time. It
+approaches ``concurrency`` when requests run in parallel and stays near 1
+when the server serializes them.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.results import emit, summarize_latencies
+
+SCENARIOS = ("chat", "stream", "knowledge", "search")
+
+
+def make_payload(scenario: str, i: int, unique: bool) -> Dict:
+    # Unique questions defeat the answer cache; repeated ones measure it
+    n = i if unique else i % 10
+    if scenario == "knowledge":
+        return {"params": {"text": f"Benchmark fact number {i}: item {i} weighs {i % 97} kg.", "source": "loadgen"}}
+    if scenario == "search":
+        return {"json": {"query": f"How much does benchmark item {n} weigh?", "top_k": 3}}
+    return {"json": {"message": f"({scenario}) How much does benchmark item {n} weigh?"}}
+
+
+async def one_request(client: httpx.AsyncClient, scenario: str, payload: Dict) -> Dict:
+    started = time.perf_counter()
+    if scenario == "stream":
+        first_token = None
+        async with client.stream("POST", "/chat/stream", **payload) as response:
+            async for line in response.aiter_lines():
+                if first_token is None and line.startswith("event: token"):
+                    first_token = time.perf_counter() - started
+            status = response.status_code
+        return {"status": status, "latency": time.perf_counter() - started, "ttft": first_token}
+
+    path = {"chat": "/chat", "knowledge": "/knowledge", "search": "/knowledge/search"}[scenario]
+    response = await client.post(path, **payload)
+    return {
+        "status": response.status_code,
+        "latency": time.perf_counter() - started,
+        "cache": response.headers.get("x-cache"),
+    }
+
+
+async def run_load(url: str, scenario: str, concurrency: int, requests: int, unique: bool,
+                   timeout: float) -> Dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results: List[Dict] = []
+    counter = iter(range(requests))
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            for i in counter:
+                try:
+                    results.append(await one_request(client, scenario, make_payload(scenario, i, unique)))
+                except httpx.HTTPError as e:
+                    results.append({"status": type(e).__name__, "latency": None})
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+
+    # /knowledge answers 202 once a document is queued for write-behind indexing
+    ok = [r for r in results if r["status"] in (200, 202)]
+    latencies = [r["latency"] for r in ok]
+    summary = {
+        "scenario": scenario,
+        "url": url,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "requests_per_sec": round(len(ok) / wall, 2) if wall else 0.0,
+        "overlap": round(sum(latencies) / wall, 2) if wall else 0.0,
+        "latency": summarize_latencies(latencies),
+    }
+    ttfts = [r["ttft"] for r in ok if r.get("ttft") is not None]
+    if ttfts:
+        summary["time_to_first_token"] = summarize_latencies(ttfts)
+    hits = sum(1 for r in ok if r.get("cache") == "HIT")
+    if scenario == "chat":
+        summary["cache_hits"] = hits
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    summary["statuses"] = statuses
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against a Jarvis server")
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--repeat-questions", action="store_true",
+                        help="Cycle through 10 questions so the answer cache can hit")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    async def run_all():
+        runs = []
+        for scenario in args.scenario or SCENARIOS:
+            runs.append(await run_load(args.url, scenario, args.concurrency, args.requests,
+                                       not args.repeat_questions, args.timeout))
+        return runs
+
+    emit({"benchmark": "loadgen", "runs": asyncio.run(run_all())}, args.output)
+
+
+if __name__ == "__main__":
+    main()
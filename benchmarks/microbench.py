@@ -0,0 +1,177 @@
+"""
+Micro-benchmarks for VectorService embedding and search
+
+    python -m benchmarks.microbench --sizes 1000 10000 100000 --output micro.json
+    python -m benchmarks.microbench --fake-embeddings   # no model download needed
+
+Embedding timings use the real all-MiniLM-L6-v2 model unless
+--fake-embeddings is given. Search timings cover the local memory-mapped
+index and the in-memory Pinecone stand-in, each with vector-only and hybrid
+(vector + BM25 fused) retrieval, plus the BM25 index on its own. Query
+embeddings are precomputed, so only retrieval is timed.
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.fakes import FakeEncoder, FakePineconeIndex
+from benchmarks.results import emit, summarize_latencies
+from services.lexical_index import LexicalIndex
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.vector_service import VectorService
+
+TEXT = "Jarvis keeps a knowledge base of notes, documents and previous conversations for retrieval."
+
+
+def make_service(index, fake_embeddings: bool) -> VectorService:
+    service = VectorService(index=index)
+    if fake_embeddings:
+        service._embedding_model = FakeEncoder()
+    return service
+
+
+def time_calls(func, repeats: int) -> List[float]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def time_calls_each(func, arguments: List) -> List[float]:
+    timings = []
+    for argument in arguments:
+        started = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_embedding(service: VectorService, repeats: int, batch_sizes: List[int]) -> Dict:
+    service.embedding_model.encode("warmup")
+    single = time_calls(lambda: service._generate_embedding(TEXT), repeats)
+    results = {"single": summarize_latencies(single), "batched": {}}
+    for size in batch_sizes:
+        texts = [f"{TEXT} ({i})" for i in range(size)]
+        timings = time_calls(lambda: service._generate_embeddings(texts), max(3, repeats // 10))
+        results["batched"][str(size)] = {
+            **summarize_latencies(timings),
+            "texts_per_sec": round(size / float(np.median(timings)), 1),
+        }
+    return results
+
+
+VOCABULARY_SIZE = 20000
+
+
+def synthetic_text(rng, doc: int, words: int = 60) -> str:
+    """Zipf-distributed words plus an error code, roughly like real notes"""
+    terms = " ".join(f"w{w}" for w in rng.zipf(1.2, words) % VOCABULARY_SIZE)
+    return f"{terms} ERR_{doc % 5000:04d}"
+
+
+def fill_index(index, size: int, seed: int = 0, batch: int = 10000, lexical_index: LexicalIndex = None):
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, batch):
+        count = min(batch, size - start)
+        vectors = rng.standard_normal((count, EMBEDDING_DIMENSION)).astype(np.float32)
+        records = [
+            (f"doc-{start + i}", vectors[i], {"text": synthetic_text(rng, start + i), "source": "bench"})
+            for i in range(count)
+        ]
+        index.upsert(records)
+        if lexical_index is not None:
+            lexical_index.add((doc_id, metadata) for doc_id, _, metadata in records)
+
+
+def make_queries(count: int, seed: int = 1) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [
+        f"{' '.join(f'w{w}' for w in rng.zipf(1.2, 4) % VOCABULARY_SIZE)} ERR_{int(rng.integers(5000)):04d}"
+        for _ in range(count)
+    ]
+
+
+async def bench_search(service: VectorService, queries: np.ndarray, texts: List[str], top_k: int) -> Dict:
+    timings = []
+    for query, text in zip(queries, texts):
+        started = time.perf_counter()
+        await service.search_similar(text, top_k=top_k, query_embedding=query)
+        timings.append(time.perf_counter() - started)
+    return summarize_latencies(timings)
+
+
+def bench_keyword(sizes: List[int], texts: List[str], top_k: int) -> Dict:
+    """BM25 build throughput and query latency without any vector store"""
+    results = {}
+    for size in sizes:
+        rng = np.random.default_rng(0)
+        lexical_index = LexicalIndex()
+        started = time.perf_counter()
+        lexical_index.add((f"doc-{i}", {"text": synthetic_text(rng, i)}) for i in range(size))
+        build_seconds = time.perf_counter() - started
+        timings = time_calls_each(lambda text: lexical_index.search(text, top_k), texts)
+        results[str(size)] = {
+            **summarize_latencies(timings),
+            "docs_indexed_per_sec": round(size / build_seconds, 1),
+            **lexical_index.stats(),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark embedding and similarity search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Corpus sizes")
+    parser.add_argument("--backends", nargs="+", default=["local", "fake-pinecone"],
+                        choices=["local", "fake-pinecone"])
+    parser.add_argument("--queries", type=int, default=200, help="Queries per corpus size")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=100, help="Single-text embedding repetitions")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--fake-embeddings", action="store_true", help="Use the deterministic FakeEncoder")
+    parser.add_argument("--skip-embedding", action="store_true")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = {"benchmark": "microbench", "fake_embeddings": args.fake_embeddings, "top_k": args.top_k}
+    if not args.skip_embedding:
+        results["embedding"] = bench_embedding(
+            make_service(FakePineconeIndex(), args.fake_embeddings), args.repeats, args.batch_sizes
+        )
+
+    queries = np.random.default_rng(1).standard_normal((args.queries, EMBEDDING_DIMENSION)).astype(np.float32)
+    texts = make_queries(args.queries)
+    results["search"] = {}
+    for backend in args.backends:
+        results["search"][backend] = {"vector": {}, "hybrid": {}}
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                if backend == "local":
+                    index = LocalVectorIndex(directory)
+                else:
+                    index = FakePineconeIndex()
+                lexical_index = LexicalIndex()
+                fill_index(index, size, lexical_index=lexical_index)
+                service = make_service(index, args.fake_embeddings)
+                service.lexical_index = None
+                results["search"][backend]["vector"][str(size)] = asyncio.run(
+                    bench_search(service, queries, texts, args.top_k)
+                )
+                service.lexical_index = lexical_index
+                results["search"][backend]["hybrid"][str(size)] = asyncio.run(
+                    bench_search(service, queries, texts, args.top_k)
+                )
+                service.close()
+    results["keyword"] = bench_keyword(args.sizes, texts, args.top_k)
+
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Recall, memory and latency of the local index storage modes
+
+    python -m benchmarks.quantbench --sizes 10000 100000 --output quant.json
+
+Vectors are drawn around a few thousand cluster centres, which is closer to
+real sentence embeddings than uniform noise (quantizers have structure to
+exploit, and neighbours are not all equidistant). Every mode is compared
+against the exact float32 results: recall@k is the fraction of the true
+top k that the mode returns. Quantized modes are measured without re-rank
+and with an exact re-rank of ``top_k * rerank`` candidates. ``scan_mb`` is
+the size of what a query scans, i.e. what has to stay in memory.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.microbench import time_calls_each
+from benchmarks.results import emit, summarize_latencies
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.quantization import STORAGE_MODES
+
+
+def clustered_vectors(rng, centres: np.ndarray, count: int, spread: float = 0.6) -> np.ndarray:
+    assignment = rng.integers(len(centres), size=count)
+    noise = rng.standard_normal((count, centres.shape[1])).astype(np.float32)
+    return centres[assignment] + spread * noise
+
+
+def build(directory: str, storage: str, size: int, centres: np.ndarray, train_size: int, batch: int = 10000):
+    index = LocalVectorIndex(directory, storage=storage, pq_train_size=train_size)
+    rng = np.random.default_rng(0)
+    for start in range(0, size, batch):
+        vectors = clustered_vectors(rng, centres, min(batch, size - start))
+        index.upsert([(f"doc-{start + i}", vector, {}) for i, vector in enumerate(vectors)])
+    # Product quantization trains in the background; measure the trained index
+    index.train_quantizer(wait=True)
+    index.flush()
+    return index
+
+
+def disk_megabytes(directory: str) -> float:
+    total = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return round(total / 1e6, 1)
+
+
+def search_ids(index: LocalVectorIndex, queries: np.ndarray, top_k: int):
+    results = []
+    timings = time_calls_each(
+        lambda query: results.append([m.id for m in index.query(query, top_k=top_k, include_metadata=False).matches]),
+        queries,
+    )
+    return results, timings
+
+
+def recall(results: List[List[str]], truth: List[List[str]], top_k: int) -> float:
+    return round(float(np.mean([len(set(r) & set(t)) / top_k for r, t in zip(results, truth)])), 4)
+
+
+def bench_size(size: int, queries: np.ndarray, centres: np.ndarray, top_k: int, rerank: int,
+               train_size: int) -> Dict:
+    results = {}
+    truth = None
+    for storage in STORAGE_MODES:
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            index = build(directory, storage, size, centres, min(train_size, size))
+            build_seconds = time.perf_counter() - started
+            stats = index.describe_index_stats()
+            base = {
+                "build_seconds": round(build_seconds, 2),
+                "bytes_per_vector": stats["bytes_per_vector"],
+                "scan_mb": round(stats["bytes_per_vector"] * size / 1e6, 1),
+                "disk_mb": disk_megabytes(directory),
+            }
+            if storage == "float32":
+                truth, timings = search_ids(index, queries, top_k)
+                results[storage] = {**base, **summarize_latencies(timings), "recall": 1.0}
+            else:
+                for factor in (0, rerank):
+                    index.rerank = factor
+                    found, timings = search_ids(index, queries, top_k)
+                    label = f"{storage}+rerank{factor}" if factor else storage
+                    results[label] = {**base, **summarize_latencies(timings), "recall": recall(found, truth, top_k)}
+            index.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare local index storage modes against float32")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Corpus sizes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=10, help="Re-rank depth as a multiple of top-k")
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--pq-train-size", type=int, default=10000)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    centres = rng.standard_normal((args.clusters, EMBEDDING_DIMENSION)).astype(np.float32)
+    queries = clustered_vectors(np.random.default_rng(1), centres, args.queries)
+
+    results = {"benchmark": "quantbench", "top_k": args.top_k, "rerank": args.rerank, "sizes": {}}
+    for size in args.sizes:
+        results["sizes"][str(size)] = bench_size(
+            size, queries, centres, args.top_k, args.rerank, args.pq_train_size
+        )
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+import platform
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def summarize_latencies(latencies: List[float]) -> Dict:
+    """p50/p95/p99/mean/max in milliseconds"""
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies) * 1000.0
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def environment() -> Dict:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def emit(results: Dict, output: Optional[str] = None):
+    """Print results as JSON and optionally write them to a file for run-to-run comparison"""
+    payload = json.dumps({"environment": environment(), **results}, indent=2)
+    print(payload)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
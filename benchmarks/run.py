@@ -0,0 +1,81 @@
+"""
+One-shot reproducible load test
+
+Starts the fake Ollama server and Jarvis (with the Pinecone stand-in) as
+subprocesses, waits for /readyz, runs every load-generator scenario and writes
+one JSON report:
+
+    python -m benchmarks.run --concurrency 16 --requests 200 --output bench.json
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.loadgen import SCENARIOS, run_load
+from benchmarks.results import emit
+
+
+def wait_until_ready(url: str, timeout: float = 120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the full offline load test")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=20.0)
+    parser.add_argument("--real-embeddings", action="store_true", help="Load all-MiniLM-L6-v2 instead of the FakeEncoder")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, OLLAMA_HOST=f"http://127.0.0.1:{args.ollama_port}", OPENAI_API_KEY="",
+               EMBEDDING_CACHE_PATH="")
+    fake_ollama = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(args.ollama_port),
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-sec", str(args.tokens_per_sec), "--tokens", str(args.tokens),
+    ], env=env)
+    server_args = [sys.executable, "-m", "benchmarks.server", "--port", str(args.port),
+                   "--pinecone-latency-ms", str(args.pinecone_latency_ms)]
+    if not args.real_embeddings:
+        server_args.append("--fake-embeddings")
+    server = subprocess.Popen(server_args, env=env, stdout=subprocess.DEVNULL)
+
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.ollama_port}/api/version")
+        url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(f"{url}/readyz")
+
+        async def run_all():
+            return [await run_load(url, scenario, args.concurrency, args.requests, True, 120.0)
+                    for scenario in SCENARIOS]
+
+        runs = asyncio.run(run_all())
+        config = {k: v for k, v in vars(args).items() if k != "output"}
+        emit({"benchmark": "load", "config": config, "runs": runs}, args.output)
+    finally:
+        for process in (server, fake_ollama):
+            process.terminate()
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Search throughput and memory of multi-process serving by worker count
+
+    python -m benchmarks.scalebench --workers 1 2 4 8 --documents 100000 --output scale.json
+
+Fills a local index with synthetic documents, then for each worker count
+runs ``serve.py`` on it (one embedding worker with the FakeEncoder plus N API
+workers, answering against the fake Ollama server), drives /knowledge/search
+and reports requests/sec next to each process's memory. ``pss_mb`` is the
+proportional set size: pages shared between processes (the memory-mapped
+index, the page-cached metadata logs) are split between them, so it shows
+what each extra API worker really costs, where ``rss_mb`` counts shared
+pages in full for every process.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+from benchmarks.fakes import FakeEncoder
+from benchmarks.loadgen import run_load
+from benchmarks.results import emit
+from benchmarks.run import wait_until_ready
+
+
+def fake_vector_service(encode_ms_per_text: float = 0.0):
+    """Service factory for the embedding worker: a VectorService on the FakeEncoder"""
+    from services.vector_service import VectorService
+
+    service = VectorService()
+    service._embedding_model = FakeEncoder(seconds_per_text=encode_ms_per_text / 1000.0)
+    return service
+
+
+def fill(documents: int, batch: int = 5000):
+    """Index ``documents`` synthetic facts through the configured local stores"""
+    service = fake_vector_service()
+    service.connect()
+    encoder = service._embedding_model
+
+    async def upsert_all():
+        for start in range(0, documents, batch):
+            texts = [f"Benchmark fact number {i}: item {i} weighs {i % 97} kg."
+                     for i in range(start, min(start + batch, documents))]
+            metadatas = [{"source": f"scalebench-{i % 100}"} for i in range(start, start + len(texts))]
+            await service.upsert_embeddings(texts, encoder.encode(texts), metadatas)
+
+    asyncio.run(upsert_all())
+    service.close()
+
+
+def process_tree(pid: int) -> List[int]:
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return [pid] + [descendant for child in children for descendant in process_tree(child)]
+
+
+def memory_megabytes(pid: int) -> Dict:
+    """Resident and proportional set size of one process, from /proc (Linux only)"""
+    sizes = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                sizes[f"{name.lower()}_mb"] = round(int(value.split()[0]) / 1024, 1)
+    return sizes
+
+
+def measure(server: subprocess.Popen, socket_path: str) -> Dict:
+    from services.embedding_worker import EmbeddingWorkerClient
+
+    client = EmbeddingWorkerClient(socket_path, timeout=10.0)
+    embedding_pid = client.ping()["pid"]
+    client.close()
+    processes = {"supervisor": memory_megabytes(server.pid), "api_workers": [], "helpers": []}
+    for pid in process_tree(server.pid)[1:]:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            command = f.read()
+        if pid == embedding_pid:
+            processes["embedding_worker"] = memory_megabytes(pid)
+        elif b"spawn_main" in command:
+            processes["api_workers"].append(memory_megabytes(pid))
+        else:
+            # multiprocessing's resource tracker
+            processes["helpers"].append(memory_megabytes(pid))
+    every = ([processes["supervisor"], processes.get("embedding_worker", {})]
+             + processes["api_workers"] + processes["helpers"])
+    processes["total_pss_mb"] = round(sum(entry.get("pss_mb", 0.0) for entry in every), 1)
+    processes["total_rss_mb"] = round(sum(entry.get("rss_mb", 0.0) for entry in every), 1)
+    return processes
+
+
+def bench(args) -> List[Dict]:
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ, VECTOR_BACKEND="local", LOCAL_INDEX_STORAGE=args.storage,
+            LOCAL_INDEX_PATH=os.path.join(directory, "vectors"),
+            LEXICAL_INDEX_PATH=os.path.join(directory, "lexical"),
+            WRITE_QUEUE_WAL_PATH=os.path.join(directory, "wal.jsonl"),
+            EMBEDDING_CACHE_PATH="", OPENAI_API_KEY="", LOG_LEVEL="WARNING",
+            OLLAMA_HOST=f"http://127.0.0.1:{args.ollama_port}",
+        )
+        os.environ.update(env)
+        fill(args.documents)
+
+        fake_ollama = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(args.ollama_port)],
+                                       env=env, stdout=subprocess.DEVNULL)
+        try:
+            for workers in args.workers:
+                socket_path = os.path.join(directory, "embedding_worker.sock")
+                server = subprocess.Popen([
+                    sys.executable, "-m", "benchmarks.scalebench", "--serve", str(workers),
+                    "--port", str(args.port), "--socket", socket_path,
+                    "--encode-ms-per-text", str(args.encode_ms_per_text),
+                ], env=env, stdout=subprocess.DEVNULL)
+                try:
+                    url = f"http://127.0.0.1:{args.port}"
+                    wait_until_ready(f"{url}/readyz")
+                    # Every worker warms up separately; a short unmeasured run gets them all past it
+                    asyncio.run(run_load(url, "search", args.concurrency, args.concurrency * 4, True, 120.0))
+                    summary = asyncio.run(run_load(url, "search", args.concurrency, args.requests, True, 120.0))
+                    runs.append({"workers": workers, **summary, "memory": measure(server, socket_path)})
+                finally:
+                    server.terminate()
+                    server.wait(timeout=60)
+        finally:
+            fake_ollama.terminate()
+            fake_ollama.wait(timeout=10)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search throughput and memory by API worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--documents", type=int, default=50000)
+    parser.add_argument("--storage", default="float32", help="LOCAL_INDEX_STORAGE for the index")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--encode-ms-per-text", type=float, default=0.0, help="FakeEncoder compute cost")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    # Internal: how the benchmark starts each server under test
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--socket", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        from serve import serve
+
+        serve(args.serve, "127.0.0.1", args.port, args.socket,
+              service_factory=functools.partial(fake_vector_service, args.encode_ms_per_text), log_level="warning")
+        return
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "serve", "socket")}
+    emit({"benchmark": "scale", "config": config, "runs": bench(args)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
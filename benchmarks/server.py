@@ -0,0 +1,48 @@
+"""
+Run the Jarvis app against local stand-ins
+
+Uses the in-memory FakePineconeIndex (with simulated latency) instead of
+Pinecone and, optionally, the deterministic FakeEncoder instead of the
+SentenceTransformer. Point OLLAMA_HOST at benchmarks.fake_ollama for a
+fully offline setup:
+
+    OLLAMA_HOST=http://127.0.0.1:11435 python -m benchmarks.server --fake-embeddings
+"""
+
+import argparse
+
+import app as jarvis
+from benchmarks.fakes import FakeEncoder, FakePineconeIndex
+from services.vector_service import VectorService
+
+
+def install_fakes(pinecone_latency_ms: float = 20.0, fake_embeddings: bool = False,
+                  encode_ms_per_text: float = 0.0):
+    """Make the app's lifespan build its VectorService on top of the stand-ins"""
+
+    def create_vector_service():
+        service = VectorService(index=FakePineconeIndex(latency_ms=pinecone_latency_ms))
+        if fake_embeddings:
+            service._embedding_model = FakeEncoder(seconds_per_text=encode_ms_per_text / 1000.0)
+        return service
+
+    jarvis.VectorService = create_vector_service
+    return jarvis.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Jarvis with benchmark stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=20.0, help="Simulated Pinecone round-trip")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Use the deterministic FakeEncoder")
+    parser.add_argument("--encode-ms-per-text", type=float, default=0.0, help="FakeEncoder compute cost")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(install_fakes(args.pinecone_latency_ms, args.fake_embeddings, args.encode_ms_per_text),
+                host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
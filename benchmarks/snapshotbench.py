@@ -0,0 +1,119 @@
+"""
+Knowledge base snapshot export and restore throughput
+
+    python -m benchmarks.snapshotbench --documents 1000000 --output snapshot.json
+
+Builds a local index of synthetic documents, exports it (float32 and
+float16 vectors), verifies the file, and restores it into a fresh local
+index and into the in-memory Pinecone stand-in with simulated latency.
+Restores go through ``VectorService`` exactly as ``snapshot.py import``
+does, keyword index and manifest included, and never touch the encoder.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+from benchmarks.fakes import FakePineconeIndex
+from benchmarks.results import emit
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.snapshot import export_snapshot, import_snapshot, verify_snapshot
+from services.vector_service import VectorService
+
+WORDS = ("jarvis", "knowledge", "vector", "snapshot", "restore", "index", "meeting", "notes", "release", "budget")
+
+
+def build_source(directory: str, documents: int, batch: int = 10000) -> VectorService:
+    index = LocalVectorIndex(directory)
+    rng = np.random.default_rng(0)
+    for start in range(0, documents, batch):
+        count = min(batch, documents - start)
+        vectors = rng.standard_normal((count, EMBEDDING_DIMENSION)).astype(np.float32)
+        words = rng.integers(len(WORDS), size=(count, 40))
+        index.upsert([
+            (f"doc-{start + i}", vector, {
+                "source": f"notes/{(start + i) % 1000}.md", "chunk": start + i,
+                "text": " ".join(WORDS[w] for w in words[i]),
+            })
+            for i, vector in enumerate(vectors)
+        ])
+    index.flush()
+    return VectorService(index=index)
+
+
+def bench_export(service: VectorService, path: str, dtype: str) -> Dict:
+    with open(path, "wb") as f:
+        stats = export_snapshot(service, f, dtype=dtype)
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        verify_snapshot(f)
+    return {
+        "seconds": stats["seconds"],
+        "documents_per_second": round(stats["documents"] / stats["seconds"], 1),
+        "file_mb": round(stats["bytes"] / 1e6, 1),
+        "bytes_per_document": round(stats["bytes"] / stats["documents"], 1),
+        "verify_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def bench_import(service: VectorService, path: str, upsert_batch_size: int, parallel: int) -> Dict:
+    with open(path, "rb") as f:
+        stats = await import_snapshot(service, f, upsert_batch_size=upsert_batch_size, max_parallel_upserts=parallel)
+    if hasattr(service.index, "flush"):
+        service.index.flush()
+    return {key: stats[key] for key in ("restored", "seconds", "documents_per_second")}
+
+
+async def run(args) -> Dict:
+    results = {"benchmark": "snapshotbench", "documents": args.documents, "export": {}, "import": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        source = build_source(os.path.join(directory, "source"), args.documents)
+        results["build_seconds"] = round(time.perf_counter() - started, 2)
+
+        for dtype in ("float32", "float16"):
+            path = os.path.join(directory, f"{dtype}.jsnap")
+            results["export"][dtype] = bench_export(source, path, dtype)
+        source.close()
+
+        path = os.path.join(directory, "float32.jsnap")
+        local = VectorService(index=LocalVectorIndex(os.path.join(directory, "restored")))
+        results["import"]["local"] = await bench_import(local, path, args.local_batch_size, 1)
+        local.close()
+
+        # The stand-in copies its matrix on every upsert, so it restores a prefix of the snapshot at most
+        pinecone_path = path
+        if args.pinecone_documents < args.documents:
+            pinecone_path = os.path.join(directory, "pinecone.jsnap")
+            prefix = build_source(os.path.join(directory, "prefix"), args.pinecone_documents)
+            bench_export(prefix, pinecone_path, "float32")
+            prefix.close()
+        pinecone = VectorService(index=FakePineconeIndex(latency_ms=args.pinecone_latency_ms))
+        results["import"]["pinecone"] = {
+            "latency_ms": args.pinecone_latency_ms, "parallel": args.parallel,
+            **await bench_import(pinecone, pinecone_path, 100, args.parallel),
+        }
+        pinecone.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure snapshot export and restore throughput")
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--local-batch-size", type=int, default=5000, help="Vectors per local index upsert")
+    parser.add_argument("--pinecone-documents", type=int, default=50000,
+                        help="Documents restored into the Pinecone stand-in")
+    parser.add_argument("--pinecone-latency-ms", type=float, default=20.0)
+    parser.add_argument("--parallel", type=int, default=8, help="Concurrent Pinecone upserts")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+    emit(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Bulk knowledge ingestion for Jarvis AI Assistant
+
+Loads JSONL/NDJSON records ({"text", "source", "metadata"} per line) and plain
+text files straight into the vector store, without going through the API.
+
+    python ingest.py corpus.jsonl notes/ --chunk-size 1000 --chunk-overlap 200
+    python ingest.py notes/ --sync    # re-index only what changed, drop what was removed
+
+Chunks that are already indexed are skipped without re-embedding. With --sync
+the inputs are treated as the current state of their sources: chunks that
+disappeared from a file or export are deleted, and so are files removed from
+a given directory. Keep --chunk-size/--chunk-overlap the same between syncs,
+or every chunk counts as changed.
+"""
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from services.health import FAILED, HEALTH
+from services.ingestion import IngestionPipeline, TextChunker, check_chunking, parse_record
+
+RECORD_EXTENSIONS = (".jsonl", ".ndjson")
+READ_SIZE = 64 * 1024
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+async def iter_records(paths, chunk_size, chunk_overlap):
+    """Yield ingestion records from every input file, reading each in small pieces"""
+    for path in iter_files(paths):
+        if path.endswith(RECORD_EXTENSIONS):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = parse_record(line, default_source=path)
+                    if record:
+                        yield record
+            continue
+
+        chunker = TextChunker(chunk_size, chunk_overlap)
+        count = 0
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            while True:
+                piece = f.read(READ_SIZE)
+                chunks = chunker.feed(piece) if piece else chunker.finish()
+                for chunk in chunks:
+                    yield {"text": chunk, "metadata": {"source": path, "chunk": count}, "continues": count > 0}
+                    count += 1
+                if not piece:
+                    break
+
+
+def report_progress(stats):
+    print(f"📥 {stats.documents} documents, {stats.chunks} chunks ({stats.documents_per_second:.1f} docs/sec)")
+
+
+async def run(args):
+    from services.vector_service import VectorService
+
+    vector_service = VectorService()
+    await vector_service.warmup()
+    if not vector_service.index:
+        # A store that failed to open (e.g. a local index another process is writing) said why already
+        if HEALTH.state("vector_store") != FAILED:
+            print("❌ No vector database configured - set VECTOR_BACKEND or PINECONE_API_KEY in .env")
+        return 1
+
+    pipeline = IngestionPipeline(
+        vector_service,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        max_parallel_upserts=args.parallel,
+        progress=report_progress,
+        progress_every=args.progress_every,
+    )
+    # Sources of files under a synced directory start with the directory path
+    prune_prefixes = [os.path.join(path, "") for path in args.paths if os.path.isdir(path)] if args.sync else []
+    stats = await pipeline.run(
+        iter_records(args.paths, args.chunk_size, args.chunk_overlap),
+        sync=args.sync,
+        prune_prefixes=prune_prefixes,
+    )
+
+    if hasattr(vector_service.index, "flush"):
+        vector_service.index.flush()
+    print(f"✅ Ingested {stats.documents} documents ({stats.chunks} chunks) in {stats.elapsed:.1f}s "
+          f"- {stats.documents_per_second:.1f} docs/sec")
+    print(f"   {stats.unchanged} chunks unchanged, {stats.deleted} removed")
+    vector_service.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load knowledge into Jarvis")
+    parser.add_argument("paths", nargs="+", help="JSONL/NDJSON files, text files or directories")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Maximum characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="Characters shared by neighbouring chunks")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded per encode call")
+    parser.add_argument("--upsert-batch-size", type=int, default=100, help="Vectors per upsert request")
+    parser.add_argument("--parallel", type=int, default=4, help="Concurrent upsert requests")
+    parser.add_argument("--progress-every", type=int, default=1000, help="Report progress every N documents")
+    parser.add_argument("--sync", action="store_true",
+                        help="Delete indexed chunks that are no longer in the inputs (incremental re-index)")
+    args = parser.parse_args()
+    try:
+        check_chunking(args.chunk_size, args.chunk_overlap)
+    except ValueError as e:
+        parser.error(str(e))
+
+    load_dotenv()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
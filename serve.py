@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Multi-process serving for Jarvis AI Assistant
+
+    python serve.py --workers 4 --port 8000
+
+Starts one embedding worker process and N API worker processes sharing the
+listening socket. Only the embedding worker loads the SentenceTransformer
+and writes to the local stores; API workers send it texts to encode and
+documents to write over a Unix socket, batched across workers, and open the
+local vector and keyword indexes read-only through memory maps. N workers
+therefore cost roughly one model plus N small Python processes instead of N
+models. Processes that exit unexpectedly are restarted.
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+from dotenv import load_dotenv
+
+# A process that dies sooner than this after starting waits before it is restarted
+RESTART_BACKOFF_SECONDS = 5.0
+
+
+def api_worker(config, sock, worker_id: int):
+    """Child process entry point: one uvicorn server on the shared socket"""
+    import uvicorn
+    # Selects this worker's own write-ahead log (see app.py)
+    os.environ["JARVIS_WORKER_ID"] = str(worker_id)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(workers: int, host: str, port: int, socket_path: str, service_factory=None, log_level: str = "info"):
+    """Run the embedding worker and ``workers`` API workers until interrupted"""
+    import uvicorn
+    from services.embedding_worker import run as run_embedding_worker
+
+    socket_path = os.path.abspath(socket_path)
+    # Spawned rather than forked: nothing (torch above all) is inherited half-initialised
+    context = multiprocessing.get_context("spawn")
+    config = uvicorn.Config("app:app", host=host, port=port, log_level=log_level)
+    sock = config.bind_socket()
+    # Inherited by the API workers; the embedding worker removes it from its own environment
+    os.environ["EMBEDDING_WORKER_SOCKET"] = socket_path
+
+    def start(key):
+        if key == "embedding":
+            process = context.Process(target=run_embedding_worker, args=(socket_path, service_factory),
+                                      name="embedding-worker")
+        else:
+            process = context.Process(target=api_worker, args=(config, sock, key), name=f"api-worker-{key}")
+        process.start()
+        started[key] = time.monotonic()
+        return process
+
+    started = {}
+    processes = {"embedding": start("embedding")}
+    for worker_id in range(workers):
+        processes[worker_id] = start(worker_id)
+    print(f"🚀 Serving on http://{host}:{port} with {workers} API workers and one embedding worker")
+
+    stopping = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.append(True))
+    while not stopping:
+        time.sleep(0.5)
+        for key, process in list(processes.items()):
+            if process.is_alive() or stopping:
+                continue
+            if time.monotonic() - started[key] < RESTART_BACKOFF_SECONDS:
+                continue
+            print(f"⚠️  {process.name} exited with code {process.exitcode}; restarting it")
+            processes[key] = start(key)
+
+    # API workers drain first, while the embedding worker can still answer them
+    shutdown_order = [key for key in processes if key != "embedding"] + ["embedding"]
+    for key in shutdown_order:
+        process = processes[key]
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+    sock.close()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve Jarvis with several API worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="API worker processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_WORKER_SOCKET_PATH", "data/embedding_worker.sock"),
+                        help="Unix socket the API workers reach the embedding worker on")
+    args = parser.parse_args()
+    serve(args.workers, args.host, args.port, args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import List, Optional, Tuple
+
+from services.metrics import REGISTRY
+
+# Lower value is served first
+INTERACTIVE = 0
+BATCH = 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "jarvis_llm_queue_depth", "Requests waiting for an LLM generation slot", ["backend"]
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "jarvis_llm_in_flight", "LLM generations currently running", ["backend"]
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "jarvis_llm_queue_wait_seconds", "Time spent waiting for an LLM generation slot", ["backend", "priority"]
+)
+REJECTIONS = REGISTRY.counter(
+    "jarvis_llm_rejections_total", "LLM requests turned away by admission control", ["backend", "reason"]
+)
+
+
+def configured_max_in_flight() -> int:
+    """``LLM_MAX_IN_FLIGHT``: OpenAI serves many generations at once, Ollama effectively one per model"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    use_openai = bool(api_key and api_key != "your_openai_api_key_here")
+    return int(os.getenv("LLM_MAX_IN_FLIGHT", "8" if use_openai else "1"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get a generation slot; maps to an HTTP error with Retry-After"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionRejected):
+    status_code = 429
+
+
+class QueueTimeout(AdmissionRejected):
+    status_code = 503
+
+
+class Reservation:
+    """A held generation slot; release() is idempotent"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.perf_counter()
+        self._released = False
+        self.lease = None
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            if self.lease is not None:
+                self.lease.release()
+            self._controller._release(time.perf_counter() - self._started)
+
+
+class AdmissionController:
+    """Bounded, prioritized admission to a backend that can only run a few generations at once.
+
+    At most ``max_in_flight`` reservations are held at a time. Further callers
+    wait in a priority queue of at most ``max_queue`` entries (interactive
+    ahead of batch, FIFO within a priority). A full queue fails fast with
+    ``QueueFull``, and a caller still waiting after ``queue_timeout`` seconds
+    gets ``QueueTimeout``. Both carry a Retry-After estimate derived from
+    recent generation times.
+
+    With ``shared_slots`` (a ``SlotLeases``, when several processes share
+    one backend) a granted caller also leases one of the slots all
+    processes draw from, within the same ``queue_timeout``, so the limit
+    holds across processes and not just within this one.
+    """
+
+    def __init__(self, backend: str, max_in_flight: int = 1, max_queue: int = 32, queue_timeout: float = 30.0,
+                 shared_slots=None):
+        self.backend = backend
+        self.shared_slots = shared_slots
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._avg_service_seconds = 1.0
+        self._depth = QUEUE_DEPTH.labels(backend=backend)
+        self._running = IN_FLIGHT.labels(backend=backend)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def retry_after(self) -> int:
+        """Seconds until a new request could plausibly be served"""
+        backlog = self.queue_depth + self._in_flight
+        return max(1, math.ceil(self._avg_service_seconds * backlog / self.max_in_flight))
+
+    async def reserve(self, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> Reservation:
+        """Wait for a generation slot"""
+        started = time.perf_counter()
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+
+        timeout = timeout if timeout is not None else self.queue_timeout
+        if self._in_flight < self.max_in_flight and not self.queue_depth:
+            self._grant()
+        else:
+            await self._wait_for_slot(priority, timeout)
+        reservation = Reservation(self)
+        if self.shared_slots is not None:
+            await self._lease(reservation, timeout - (time.perf_counter() - started))
+
+        QUEUE_WAIT.labels(backend=self.backend, priority=priority_name).observe(time.perf_counter() - started)
+        return reservation
+
+    async def _wait_for_slot(self, priority: int, timeout: float):
+        if self.queue_depth >= self.max_queue:
+            REJECTIONS.labels(backend=self.backend, reason="queue_full").inc()
+            raise QueueFull(f"{self.backend} queue is full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._depth.set(self.queue_depth)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                REJECTIONS.labels(backend=self.backend, reason="queue_timeout").inc()
+                raise QueueTimeout(f"Timed out waiting for {self.backend}", self.retry_after())
+        except asyncio.CancelledError:
+            # The client went away while queued; hand the slot on if it was just granted
+            if self._abandon(future):
+                self._release(None)
+            raise
+        finally:
+            self._depth.set(self.queue_depth)
+
+    async def _lease(self, reservation: Reservation, timeout: float):
+        """Take one of the slots shared with other processes; the local slot goes back if that fails"""
+        try:
+            reservation.lease = await self.shared_slots.acquire(max(0.0, timeout))
+        except asyncio.TimeoutError:
+            self._release(None)
+            REJECTIONS.labels(backend=self.backend, reason="queue_timeout").inc()
+            raise QueueTimeout(f"Timed out waiting for {self.backend}", self.retry_after())
+        except OSError as e:
+            self._release(None)
+            REJECTIONS.labels(backend=self.backend, reason="unavailable").inc()
+            raise QueueTimeout(f"Shared {self.backend} slots unavailable: {e}", self.retry_after())
+        except BaseException:
+            self._release(None)
+            raise
+
+    def _abandon(self, future: asyncio.Future) -> bool:
+        """Withdraw a waiter; returns True if it had already been granted a slot"""
+        if future.done() and not future.cancelled():
+            return True
+        future.cancel()
+        return False
+
+    def _grant(self):
+        self._in_flight += 1
+        self._running.set(self._in_flight)
+
+    def _release(self, service_seconds: Optional[float]):
+        if service_seconds is not None:
+            # Exponential moving average feeds the Retry-After estimate
+            self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * service_seconds
+        self._in_flight -= 1
+        self._running.set(self._in_flight)
+
+        while self._waiters and self._in_flight < self.max_in_flight:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._grant()
+                future.set_result(True)
+        self._depth.set(self.queue_depth)
@@ -0,0 +1,149 @@
+import json
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Chunk text is unique per document, so a posting list for it would only cost memory
+UNINDEXED_FIELDS = frozenset({"text"})
+
+COMPARISONS = ("$eq", "$ne", "$in", "$nin")
+COMBINATORS = ("$and", "$or")
+
+
+def validate_filters(filters: Optional[Dict]) -> Optional[Dict]:
+    """Check a Pinecone-style metadata filter; returns None when there is nothing to filter on.
+
+    Supported: ``{"field": value}``, ``{"field": {"$eq" | "$ne" | "$in" | "$nin": ...}}``
+    and ``{"$and" | "$or": [filter, ...]}``. Several fields in one object must all match.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    for key, condition in filters.items():
+        if key in COMBINATORS:
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} expects a non-empty list of filters")
+            for part in condition:
+                if not isinstance(part, dict) or not part:
+                    raise ValueError(f"{key} expects a non-empty list of filters")
+                validate_filters(part)
+            continue
+        if key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator {key!r}")
+        if key in UNINDEXED_FIELDS:
+            raise ValueError(f"Cannot filter on {key!r}")
+        operators = condition if isinstance(condition, dict) else {"$eq": condition}
+        if not operators:
+            raise ValueError(f"Empty condition for {key!r}")
+        for operator, value in operators.items():
+            if operator not in COMPARISONS:
+                raise ValueError(f"Unsupported filter operator {operator!r}, expected one of {', '.join(COMPARISONS)}")
+            values = value if operator in ("$in", "$nin") else [value]
+            if operator in ("$in", "$nin") and not isinstance(value, list):
+                raise ValueError(f"{operator} expects a list")
+            for item in values:
+                if not _scalar(item):
+                    raise ValueError(f"Filter values must be strings, numbers or booleans, got {item!r}")
+    return filters
+
+
+def filters_key(filters: Optional[Dict]) -> Optional[str]:
+    """Canonical form of a filter, so equal filters compare equal (cache and coalescing keys)"""
+    return json.dumps(filters, sort_keys=True, separators=(",", ":")) if filters else None
+
+
+def _scalar(value) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def _value_key(value) -> str:
+    # Numbers compare as numbers (1 == 1.0) but never equal booleans or strings
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = float(value)
+    return json.dumps(value)
+
+
+def _attributes(metadata: Dict) -> Iterable[Tuple[str, str]]:
+    """``(field, value)`` pairs of a metadata dict; list values contribute each element"""
+    for key, value in (metadata or {}).items():
+        if key in UNINDEXED_FIELDS:
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            if _scalar(item):
+                yield key, _value_key(item)
+
+
+class AttributeIndex:
+    """Posting lists of row numbers per metadata ``(field, value)`` pair.
+
+    A filter is answered from the postings as a boolean row mask before any
+    vector is scored, so a selective filter costs a few array lookups rather
+    than a scan of the whole index. Rows whose metadata changes are moved
+    between postings with ``update``; deleted rows may stay listed, so
+    callers combine the mask with their own liveness mask.
+
+    Not thread-safe by itself: the owning index calls it with its lock held.
+    """
+
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], array] = {}
+
+    def add(self, row: int, metadata: Dict):
+        self._append(row, set(_attributes(metadata)))
+
+    def update(self, row: int, old: Optional[Dict], new: Dict):
+        """Re-list ``row`` after its metadata changed from ``old`` to ``new``"""
+        before, after = set(_attributes(old or {})), set(_attributes(new))
+        for attribute in before - after:
+            rows = np.frombuffer(self._postings[attribute], dtype=np.int64)
+            kept = array("q")
+            kept.frombytes(rows[rows != row].tobytes())
+            if kept:
+                self._postings[attribute] = kept
+            else:
+                del self._postings[attribute]
+        self._append(row, after - before)
+
+    def _append(self, row: int, attributes):
+        for attribute in attributes:
+            postings = self._postings.get(attribute)
+            if postings is None:
+                postings = self._postings[attribute] = array("q")
+            postings.append(row)
+
+    def select(self, filters: Dict, size: int) -> np.ndarray:
+        """Boolean mask over the first ``size`` rows of those matching ``filters``"""
+        mask = np.ones(size, dtype=bool)
+        for key, condition in filters.items():
+            if key == "$and":
+                for part in condition:
+                    mask &= self.select(part, size)
+            elif key == "$or":
+                either = np.zeros(size, dtype=bool)
+                for part in condition:
+                    either |= self.select(part, size)
+                mask &= either
+            else:
+                operators = condition if isinstance(condition, dict) else {"$eq": condition}
+                for operator, value in operators.items():
+                    listed = self._rows(key, value if operator in ("$in", "$nin") else [value], size)
+                    mask &= ~listed if operator in ("$ne", "$nin") else listed
+        return mask
+
+    def _rows(self, key: str, values: List, size: int) -> np.ndarray:
+        mask = np.zeros(size, dtype=bool)
+        for value in values:
+            postings = self._postings.get((key, _value_key(value)))
+            if postings:
+                rows = np.frombuffer(postings, dtype=np.int64)
+                mask[rows[rows < size]] = True
+        return mask
+
+    def stats(self) -> Dict:
+        return {
+            "fields": len({key for key, _ in self._postings}),
+            "values": len(self._postings),
+            "postings": sum(len(rows) for rows in self._postings.values()),
+        }
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from services.admission import BATCH, AdmissionRejected
+from services.attribute_index import filters_key, validate_filters
+from services.ingestion import ndjson_lines
+from services.metrics import REGISTRY
+
+logger = logging.getLogger("jarvis.batch_chat")
+
+BATCH_QUESTIONS = REGISTRY.counter(
+    "jarvis_batch_questions_total", "Questions answered through /chat/batch", ["outcome"]
+)
+
+
+def parse_question(line: str) -> Optional[Dict]:
+    """Turn one NDJSON line into a question, or None for blank lines"""
+    line = line.strip()
+    if not line:
+        return None
+    data = json.loads(line)
+    if isinstance(data, str):
+        data = {"message": data}
+    if not isinstance(data, dict) or not isinstance(data.get("message"), str):
+        raise ValueError("each question needs a 'message' field")
+    return {"id": data.get("id"), "message": data["message"], "filters": validate_filters(data.get("filters"))}
+
+
+async def ndjson_questions(pieces: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    """Parse a streamed NDJSON body into questions; a malformed line becomes an item with an ``error``"""
+    async for line in ndjson_lines(pieces):
+        try:
+            question = parse_question(line)
+        except ValueError as e:
+            question = {"id": None, "error": f"Invalid question: {e}"}
+        if question:
+            yield question
+
+
+class BatchChat:
+    """Answers a stream of questions by running the stages of /chat wide instead of one at a time.
+
+    Questions are taken as they arrive, up to ``embed_batch_size`` at a
+    time, and each group is embedded with one batched encode. Every question
+    then checks the answer cache and retrieves its context concurrently with
+    the others, and generations run ``parallelism`` at a time at batch priority, so
+    interactive chats still go ahead of them. A generation turned away by
+    admission control waits for the Retry-After it was given and tries
+    again instead of failing.
+
+    Results are yielded in completion order, each with its ``index`` in the
+    input and per-stage timings. At most ``max_pending`` questions are in
+    progress at once, so memory stays bounded however long the input is.
+    """
+
+    def __init__(self, vector_service, llm_service, response_cache=None, top_k: int = 8,
+                 embed_batch_size: int = 256, parallelism: int = 4, max_pending: int = 1024):
+        self.vector_service = vector_service
+        self.llm_service = llm_service
+        self.response_cache = response_cache
+        self.top_k = top_k
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.parallelism = max(1, parallelism)
+        # A whole group must fit, or the reader would wait on itself
+        self.max_pending = max(max_pending, self.embed_batch_size)
+        self.stats = {"questions": 0, "answered": 0, "cached": 0, "failed": 0}
+        self._started = None
+        self._generating = None
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            **self.stats,
+            "seconds": round(elapsed, 3),
+            "questions_per_second": round(self.stats["questions"] / elapsed, 2) if elapsed else 0.0,
+        }
+
+    async def run(self, questions: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+        self._started = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        incoming: asyncio.Queue = asyncio.Queue()
+        pending = asyncio.Semaphore(self.max_pending)
+        self._generating = asyncio.Semaphore(self.parallelism)
+        tasks = set()
+
+        def finish(result: Dict, timings: Dict, read_at: float):
+            timings["total_ms"] = _ms(time.perf_counter() - read_at)
+            result["timings"] = timings
+            outcome = "failed" if "error" in result else "cached" if result.get("cached") else "answered"
+            self.stats["questions"] += 1
+            self.stats[outcome] += 1
+            BATCH_QUESTIONS.labels(outcome=outcome).inc()
+            results.put_nowait(result)
+            pending.release()
+
+        async def answer(index: int, question: Dict, embedding, timings: Dict, read_at: float):
+            result = {"index": index, "id": question["id"]}
+            try:
+                result.update(await self._answer(question["message"], question["filters"], embedding, timings))
+            except Exception as e:
+                logger.warning("Batch question %d failed: %s", index, e)
+                result["error"] = str(e) or type(e).__name__
+            finish(result, timings, read_at)
+
+        def spawn(coro):
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        async def start(group: List):
+            valid = [(index, question, read_at) for index, question, read_at in group if "error" not in question]
+            for index, question, read_at in group:
+                if "error" in question:
+                    finish({"index": index, "id": question["id"], "error": question["error"]}, {}, read_at)
+            if not valid:
+                return
+            # One encode call for the whole group instead of one per question
+            started = time.perf_counter()
+            try:
+                embeddings = await self.vector_service.embed_many([question["message"] for _, question, _ in valid])
+            except Exception as e:
+                logger.warning("Embedding a batch of %d questions failed: %s", len(valid), e)
+                for index, question, read_at in valid:
+                    finish({"index": index, "id": question["id"], "error": f"Embedding failed: {e}"}, {}, read_at)
+                return
+            embed_ms = _ms(time.perf_counter() - started)
+            for (index, question, read_at), embedding in zip(valid, embeddings):
+                spawn(answer(index, question, embedding, {"embed_ms": embed_ms}, read_at))
+
+        async def feed():
+            try:
+                async for question in questions:
+                    await pending.acquire()
+                    incoming.put_nowait((question, time.perf_counter()))
+            finally:
+                incoming.put_nowait(None)
+
+        async def read():
+            feeder = asyncio.create_task(feed())
+            try:
+                index = 0
+                finished = False
+                while not finished:
+                    # Whatever has arrived is embedded together, so a slow upload is answered as it comes
+                    group = []
+                    item = await incoming.get()
+                    while True:
+                        if item is None:
+                            finished = True
+                            break
+                        group.append((index, *item))
+                        index += 1
+                        if len(group) >= self.embed_batch_size or incoming.empty():
+                            break
+                        item = incoming.get_nowait()
+                    if group:
+                        await start(group)
+                # Surfaces an error from reading the input, if that is what ended it
+                await feeder
+                await asyncio.gather(*list(tasks))
+            finally:
+                feeder.cancel()
+                results.put_nowait(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+            # Surfaces an error from reading the input, if that is what ended the run
+            await reader
+        finally:
+            reader.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    async def _answer(self, message: str, filters: Optional[Dict], embedding, timings: Dict) -> Dict:
+        scope = filters_key(filters)
+        cached = self.response_cache.lookup(embedding, scope) if self.response_cache else None
+        if cached:
+            return {"response": cached["response"], "sources": cached["sources"], "cached": True}
+
+        epoch = self.response_cache.epoch() if self.response_cache else None
+        started = time.perf_counter()
+        context = await self.vector_service.search_similar(
+            message, top_k=self.top_k, query_embedding=embedding, filters=filters
+        )
+        timings["retrieve_ms"] = _ms(time.perf_counter() - started)
+        prompt = self.llm_service.build_prompt(message, context)
+        started = time.perf_counter()
+        async with self._generating:
+            reservation = await self._reserve()
+            timings["queue_ms"] = _ms(time.perf_counter() - started)
+            started = time.perf_counter()
+            response = await self.llm_service.complete(message, reservation=reservation, prompt=prompt)
+            timings["generate_ms"] = _ms(time.perf_counter() - started)
+        if self.response_cache:
+            self.response_cache.store(message, embedding, response, prompt.sources, scope, epoch)
+        return {"response": response, "sources": prompt.sources, "cached": False,
+                "prompt_tokens": prompt.prompt_tokens}
+
+    async def _reserve(self):
+        """A generation slot at batch priority; a rejected question waits as advised and queues again"""
+        while True:
+            try:
+                return await self.llm_service.reserve(BATCH)
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 3)
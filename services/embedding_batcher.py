@@ -0,0 +1,101 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Callable, List, Optional, Tuple
+
+from services.metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram(
+    "jarvis_embedding_batch_size",
+    "Number of texts encoded per SentenceTransformer call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "jarvis_embedding_queue_wait_seconds",
+    "Time an embedding request waited before its batch started encoding",
+)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batched encodes.
+
+    Callers await ``embed(text)``; a collector task gathers queued texts until
+    ``max_batch_size`` is reached or ``max_wait_ms`` has passed since the first
+    one arrived, then runs ``encode_batch(texts)`` once on ``executor`` and
+    resolves each caller's future with its own row.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], List], executor: Executor,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, max_concurrent_batches: int = 1):
+        self.encode_batch = encode_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_collector(self):
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+    async def embed(self, text: str):
+        """Queue one text and wait for its embedding"""
+        self._ensure_collector()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Bound the number of batches encoding at once; extra requests keep queueing
+            await self._slots.acquire()
+            loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        try:
+            started = time.perf_counter()
+            live = [item for item in batch if not item[1].done()]
+            if not live:
+                return
+            for _, _, enqueued in live:
+                QUEUE_WAIT.observe(started - enqueued)
+            BATCH_SIZE.observe(len(live))
+
+            loop = asyncio.get_running_loop()
+            try:
+                rows = await loop.run_in_executor(self.executor, self.encode_batch, [text for text, _, _ in live])
+            except Exception as e:
+                for _, future, _ in live:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future, _), row in zip(live, rows):
+                if not future.done():
+                    future.set_result(row)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
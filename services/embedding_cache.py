@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from services.metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter(
+    "jarvis_embedding_cache_hits_total", "Embedding cache hits", ["tier"]
+)
+CACHE_MISSES = REGISTRY.counter(
+    "jarvis_embedding_cache_misses_total", "Embedding cache misses"
+)
+CACHE_EVICTIONS = REGISTRY.counter(
+    "jarvis_embedding_cache_evictions_total", "Embeddings evicted from the in-memory cache"
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "jarvis_embedding_cache_bytes", "Bytes held by the in-memory embedding cache"
+)
+
+# Rough per-entry bookkeeping cost (key string, OrderedDict node, ndarray header)
+ENTRY_OVERHEAD_BYTES = 250
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC, trimmed, single-spaced"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with an in-memory LRU over SQLite.
+
+    Keys are ``sha256(model_name + normalized text)``, so the same text always
+    maps to the same vector and a model change never returns stale vectors.
+    The memory tier is bounded by bytes, not entry count; the disk tier is
+    optional and survives restarts.
+
+    The tiers are used separately so callers on an event loop only touch
+    memory there: ``cached`` and ``remember`` are in-memory and cheap,
+    ``load`` and ``save`` hit SQLite (one statement per call, however many
+    texts) and belong on a worker thread.
+    """
+
+    def __init__(self, model_name: str, max_bytes: int = 64 * 1024 * 1024, path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+    def key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def cached(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """The in-memory embedding of each text (shared, read-only float32 arrays), None where there is none"""
+        keys = [self.key(text) for text in texts]
+        found = []
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                found.append(vector)
+        hits = sum(vector is not None for vector in found)
+        if hits:
+            CACHE_HITS.labels(tier="memory").inc(hits)
+        if self._db is None and hits < len(found):
+            CACHE_MISSES.inc(len(found) - hits)
+        return found
+
+    def load(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look texts up in the SQLite tier, promoting hits to memory. Blocking"""
+        keys = [self.key(text) for text in texts]
+        rows = {}
+        with self._lock:
+            if self._db is not None:
+                # Well under SQLite's limit on bound parameters per statement
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    rows.update(self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                    ).fetchall())
+        found = []
+        for key in keys:
+            vector = None
+            if key in rows:
+                vector = np.frombuffer(rows[key], dtype=np.float32)
+                self._remember(key, vector)
+            found.append(vector)
+        hits = len(rows)
+        if hits:
+            CACHE_HITS.labels(tier="disk").inc(hits)
+        if hits < len(keys):
+            CACHE_MISSES.inc(len(keys) - hits)
+        return found
+
+    def remember(self, texts: Sequence[str], embeddings: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """Keep embeddings in memory; returns the stored copies, for ``save``"""
+        stored = []
+        for text, embedding in zip(texts, embeddings):
+            # A copy, so a row of a batch does not keep the whole batch alive
+            vector = np.array(embedding, dtype=np.float32)
+            vector.flags.writeable = False
+            self._remember(self.key(text), vector)
+            stored.append(vector)
+        return stored
+
+    def save(self, texts: Sequence[str], embeddings: Sequence[np.ndarray]):
+        """Write embeddings to the SQLite tier in one transaction. Blocking"""
+        rows = [(self.key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+                for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            if self._db is None or not rows:
+                return
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        size = vector.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes + ENTRY_OVERHEAD_BYTES
+            self._entries[key] = vector
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+                CACHE_EVICTIONS.inc()
+            CACHE_BYTES.set(self._bytes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
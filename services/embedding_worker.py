@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger("jarvis.embedding_worker")
+
+# Every message is one frame: header length, payload length, JSON header, raw payload (float32 rows)
+FRAME = struct.Struct("!II")
+
+
+def _pack(header: Dict, payload: bytes = b"") -> bytes:
+    encoded = json.dumps(header).encode("utf-8")
+    return FRAME.pack(len(encoded), len(payload)) + encoded + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[Dict, bytes]:
+    header_length, payload_length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    header = json.loads(await reader.readexactly(header_length))
+    payload = await reader.readexactly(payload_length) if payload_length else b""
+    return header, payload
+
+
+def _receive(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            raise ConnectionError("Embedding worker closed the connection")
+        received += count
+    return buffer
+
+
+class EmbeddingWorker:
+    """Shares one ``VectorService`` with every API worker process over a Unix socket.
+
+    This process is the only one that loads the SentenceTransformer and the
+    only writer of the local stores (vector index, keyword index, manifest);
+    API workers send it texts to encode and documents to write, and open
+    the stores read-only themselves. Connections are served concurrently,
+    so single-text encodes from different workers meet in the service's
+    ``EmbeddingBatcher`` and are encoded together.
+
+    It also holds what has to be shared across API workers: the
+    ``llm_slots`` generation slots, leased one per connection (see
+    ``SlotLeases``), so every worker together stays within
+    ``LLM_MAX_IN_FLIGHT``, and the latest metrics each worker pushed, so
+    ``/metrics`` can report all of them whichever worker answers.
+    """
+
+    def __init__(self, vector_service, socket_path: str, llm_slots: int = 1):
+        self.vector_service = vector_service
+        self.socket_path = socket_path
+        self.llm_slots = asyncio.Semaphore(max(1, llm_slots))
+        self.metrics: Dict[str, Dict] = {}
+
+    async def serve(self):
+        # The socket only appears once the model is loaded and the stores are open
+        await self.vector_service.warmup()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"✅ Embedding worker listening on {self.socket_path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            self.vector_service.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    header, payload = await _read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if header.get("op") == "lease":
+                    await self._lease(reader, writer)
+                    break
+                try:
+                    reply, data = await self._dispatch(header, payload)
+                    reply["ok"] = True
+                except Exception as e:
+                    logger.warning("Embedding worker request %s failed: %s", header.get("op"), e)
+                    reply, data = {"ok": False, "error": str(e)}, b""
+                writer.write(_pack(reply, data))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _lease(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Hold one generation slot for as long as the client keeps this connection open.
+
+        A worker that exits or crashes closes its connections, so its slots
+        come back without any cleanup on its side.
+        """
+        acquired = asyncio.ensure_future(self.llm_slots.acquire())
+        closed = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({acquired, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not acquired.done():
+                # The client stopped waiting (timeout or cancellation) before a slot came free
+                acquired.cancel()
+        if acquired.cancelled():
+            closed.cancel()
+            return
+        try:
+            if not closed.done():
+                writer.write(_pack({"ok": True}))
+                await writer.drain()
+                await closed
+        except ConnectionError:
+            pass
+        finally:
+            closed.cancel()
+            self.llm_slots.release()
+
+    async def _dispatch(self, header: Dict, payload: bytes) -> Tuple[Dict, bytes]:
+        service = self.vector_service
+        op = header.get("op")
+        if op == "ping":
+            return {"pid": os.getpid(), "model": service.embedding_model_name}, b""
+        if op == "encode":
+            texts = header["texts"]
+            if len(texts) == 1:
+                matrix = (await service.embed(texts[0]))[None, :]
+            else:
+                matrix = await service.embed_many(texts)
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            return {"shape": list(matrix.shape)}, matrix.tobytes()
+        if op == "upsert":
+            if not service.index:
+                raise RuntimeError("Vector database not configured")
+            ids = header["ids"]
+            matrix = np.frombuffer(payload, dtype=np.float32).reshape(len(ids), -1)
+            vectors = [(doc_id, service._backend_vector(row), metadata)
+                       for doc_id, row, metadata in zip(ids, matrix, header["metadatas"])]
+            await service._run_in(service.index_executor, service._upsert, vectors)
+            return {"upserted_count": len(vectors)}, b""
+        if op == "delete":
+            await service.delete_documents(header["ids"])
+            return {}, b""
+        if op == "push_metrics":
+            self.metrics[str(header["worker"])] = header["snapshot"]
+            return {}, b""
+        if op == "metrics":
+            return {"workers": {**self.metrics, "embedding": REGISTRY.snapshot()}}, b""
+        raise ValueError(f"Unknown embedding worker operation {op!r}")
+
+
+class EmbeddingWorkerClient:
+    """Blocking client for ``EmbeddingWorker``, used from the service's thread pools.
+
+    Each concurrent call takes its own pooled connection, so calls from
+    several threads are in flight at once and the worker can batch them.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _call(self, header: Dict, payload: bytes = b"") -> Tuple[Dict, bytearray]:
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        if sock is None:
+            sock = self._connect()
+        try:
+            sock.sendall(_pack(header, payload))
+            header_length, payload_length = FRAME.unpack(_receive(sock, FRAME.size))
+            reply = json.loads(_receive(sock, header_length))
+            data = _receive(sock, payload_length)
+        except BaseException:
+            # A half-read reply would desynchronise the connection for the next caller
+            sock.close()
+            raise
+        with self._lock:
+            self._idle.append(sock)
+        if not reply.get("ok"):
+            raise RuntimeError(f"Embedding worker error: {reply.get('error')}")
+        return reply, data
+
+    def ping(self) -> Dict:
+        return self._call({"op": "ping"})[0]
+
+    def wait_ready(self, timeout: float):
+        """Block until the worker answers; it only listens once the model is loaded"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.ping()
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Embedding worker at {self.socket_path} not ready after {timeout:.0f}s")
+                time.sleep(0.2)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        reply, data = self._call({"op": "encode", "texts": list(texts)})
+        return np.frombuffer(data, dtype=np.float32).reshape(reply["shape"])
+
+    def upsert(self, vectors: List):
+        """Write ``(id, values, metadata)`` tuples through the worker, the only writer of the stores"""
+        matrix = np.stack([np.asarray(values, dtype=np.float32) for _, values, _ in vectors])
+        self._call(
+            {"op": "upsert", "ids": [doc_id for doc_id, _, _ in vectors],
+             "metadatas": [metadata for _, _, metadata in vectors]},
+            matrix.tobytes(),
+        )
+
+    def delete(self, ids: List[str]):
+        self._call({"op": "delete", "ids": list(ids)})
+
+    def push_metrics(self, worker: str, snapshot: Dict):
+        self._call({"op": "push_metrics", "worker": worker, "snapshot": snapshot})
+
+    def metrics(self) -> Dict[str, Dict]:
+        """The latest metrics snapshot of every process, by worker id (``embedding`` for this one)"""
+        return self._call({"op": "metrics"})[0]["workers"]
+
+    def close(self):
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle = []
+
+
+class SlotLeases:
+    """Generation slots shared by every API worker, leased from the embedding worker.
+
+    Each lease is a connection of its own that is held open while the
+    generation runs; closing it gives the slot back. Used by
+    ``AdmissionController`` on top of the worker's own queue.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    async def acquire(self, timeout: float) -> "SlotLease":
+        """Wait up to ``timeout`` seconds for a slot; raises ``asyncio.TimeoutError`` or ``OSError``"""
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(_pack({"op": "lease"}))
+            await writer.drain()
+            header, _ = await asyncio.wait_for(_read_frame(reader), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if not header.get("ok"):
+            writer.close()
+            raise ConnectionError(f"Embedding worker refused a generation slot: {header.get('error')}")
+        return SlotLease(writer)
+
+
+class SlotLease:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+
+    def release(self):
+        self._writer.close()
+
+
+def run(socket_path: str, service_factory: Optional[Callable] = None):
+    """Process entry point: load the model, open the stores read-write and serve API workers"""
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    # This process is the owner the API workers talk to, not one of them
+    os.environ.pop("EMBEDDING_WORKER_SOCKET", None)
+    if service_factory is None:
+        from services.vector_service import VectorService
+        service_factory = VectorService
+    from services.admission import configured_max_in_flight
+    asyncio.run(EmbeddingWorker(service_factory(), socket_path, llm_slots=configured_max_in_flight()).serve())
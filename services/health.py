@@ -0,0 +1,42 @@
+import threading
+import time
+from typing import Dict, Optional
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"  # optional component that is not configured
+
+# States that do not hold back readiness
+SERVING_STATES = (READY, DISABLED)
+
+
+class HealthRegistry:
+    """Tracks the startup state of each component for the health probes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict] = {}
+
+    def set(self, component: str, state: str, detail: Optional[str] = None):
+        with self._lock:
+            self._components[component] = {"state": state, "detail": detail, "since": time.time()}
+
+    def state(self, component: str) -> Optional[str]:
+        with self._lock:
+            entry = self._components.get(component)
+            return entry["state"] if entry else None
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return bool(self._components) and all(
+                entry["state"] in SERVING_STATES for entry in self._components.values()
+            )
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._components.items()}
+
+
+HEALTH = HealthRegistry()
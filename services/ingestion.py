@@ -0,0 +1,312 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from services.manifest import document_id
+from services.metrics import REGISTRY
+
+INGESTED_DOCUMENTS = REGISTRY.counter(
+    "jarvis_ingested_documents_total", "Documents consumed by the bulk ingestion pipeline"
+)
+INGESTED_CHUNKS = REGISTRY.counter(
+    "jarvis_ingested_chunks_total", "Chunks embedded and upserted by the bulk ingestion pipeline"
+)
+SKIPPED_CHUNKS = REGISTRY.counter(
+    "jarvis_ingest_unchanged_chunks_total", "Chunks skipped because identical content was already indexed"
+)
+DELETED_CHUNKS = REGISTRY.counter(
+    "jarvis_ingest_deleted_chunks_total", "Indexed chunks removed by incremental sync"
+)
+
+
+def check_chunking(chunk_size: int, chunk_overlap: int):
+    """Raise ValueError for settings the chunker cannot work with"""
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    # Overlap must stay below the earliest cut point or chunking cannot advance
+    if not 0 <= chunk_overlap < chunk_size // 2:
+        raise ValueError(f"chunk_overlap must be at least 0 and less than half of chunk_size ({chunk_size // 2})")
+
+
+class TextChunker:
+    """Incremental splitter producing overlapping chunks of at most ``chunk_size`` characters.
+
+    Text is fed piece by piece (e.g. file reads or request body chunks), so a
+    document never has to be held in memory in full. Cuts prefer whitespace in
+    the second half of a chunk, and each chunk repeats up to ``chunk_overlap``
+    characters from the end of the previous one.
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        check_chunking(chunk_size, chunk_overlap)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._buffer = ""
+        self._fresh = 0  # buffer offset where not-yet-emitted text starts
+
+    def feed(self, piece: str) -> List[str]:
+        self._buffer += piece
+        chunks = []
+        while len(self._buffer) > self.chunk_size:
+            window = self._buffer[:self.chunk_size]
+            cut = max(window.rfind(" ", self.chunk_size // 2), window.rfind("\n", self.chunk_size // 2))
+            if cut <= 0:
+                cut = self.chunk_size
+            chunk = self._buffer[:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+
+            start = cut - self.chunk_overlap
+            if self.chunk_overlap:
+                # Start the overlap on a word boundary
+                space = self._buffer.find(" ", start, cut)
+                if space != -1:
+                    start = space + 1
+            self._buffer = self._buffer[start:]
+            self._fresh = cut - start
+        return chunks
+
+    def finish(self) -> List[str]:
+        tail = self._buffer
+        fresh = tail[self._fresh:]
+        self._buffer, self._fresh = "", 0
+        if not fresh.strip():
+            return []
+        return [tail.strip()]
+
+
+def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """Split one in-memory document into overlapping chunks"""
+    chunker = TextChunker(chunk_size, chunk_overlap)
+    return chunker.feed(text) + chunker.finish()
+
+
+def parse_record(line: str, default_source: str) -> Optional[Dict]:
+    """Turn one NDJSON line into an ingestion record, or None for blank lines"""
+    line = line.strip()
+    if not line:
+        return None
+    data = json.loads(line)
+    if isinstance(data, str):
+        data = {"text": data}
+    if not isinstance(data, dict) or "text" not in data:
+        raise ValueError("each record needs a 'text' field")
+    metadata = dict(data.get("metadata") or {})
+    metadata.setdefault("source", data.get("source", default_source))
+    return {"text": data["text"], "metadata": metadata}
+
+
+async def ndjson_lines(pieces: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a streamed NDJSON/JSONL body into lines as they arrive"""
+    buffer = b""
+    async for piece in pieces:
+        buffer += piece
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8")
+    yield buffer.decode("utf-8")
+
+
+async def ndjson_records(pieces: AsyncIterator[bytes], default_source: str) -> AsyncIterator[Dict]:
+    """Parse a streamed NDJSON/JSONL body into records"""
+    async for line in ndjson_lines(pieces):
+        record = parse_record(line, default_source)
+        if record:
+            yield record
+
+
+async def text_records(pieces: AsyncIterator[bytes], source: str, chunk_size: int,
+                       chunk_overlap: int) -> AsyncIterator[Dict]:
+    """Chunk a streamed plain-text document into records as it arrives"""
+    chunker = TextChunker(chunk_size, chunk_overlap)
+    count = 0
+    async for piece in pieces:
+        for chunk in chunker.feed(piece.decode("utf-8", errors="ignore")):
+            yield {"text": chunk, "metadata": {"source": source, "chunk": count}, "continues": count > 0}
+            count += 1
+    for chunk in chunker.finish():
+        yield {"text": chunk, "metadata": {"source": source, "chunk": count}, "continues": count > 0}
+        count += 1
+
+
+class IngestionStats:
+    def __init__(self):
+        self.documents = 0
+        self.chunks = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def documents_per_second(self) -> float:
+        elapsed = self.elapsed or (time.perf_counter() - self.started)
+        return self.documents / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "unchanged": self.unchanged,
+            "deleted": self.deleted,
+            "seconds": round(self.elapsed, 3),
+            "documents_per_second": round(self.documents_per_second, 2),
+        }
+
+
+class IngestionPipeline:
+    """Streams records into the vector store in large batches.
+
+    Records (``{"text", "metadata"}``) are chunked, collected into batches of
+    ``batch_size`` chunks, embedded with one batched encode per batch and
+    upserted in slices of ``upsert_batch_size`` with at most
+    ``max_parallel_upserts`` requests in flight. Only one embedding batch plus
+    the in-flight upserts are held in memory, whatever the input size.
+
+    Chunk ids are derived from source and content, so chunks that are
+    already indexed are skipped before embedding, and chunks whose metadata
+    alone changed are rewritten with their stored vectors. With ``sync`` the input is
+    treated as the full current state of every source it mentions: indexed
+    chunks of those sources that no longer appear are deleted, as are all
+    chunks of indexed sources under ``prune_prefixes`` that were not seen.
+    """
+
+    def __init__(self, vector_service, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 batch_size: int = 256, upsert_batch_size: int = 100, max_parallel_upserts: int = 4,
+                 progress: Optional[Callable[[IngestionStats], None]] = None, progress_every: int = 1000):
+        self.vector_service = vector_service
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.max_parallel_upserts = max_parallel_upserts
+        self.progress = progress
+        self.progress_every = progress_every
+        self.sources = set()  # every source seen, so callers can invalidate caches
+
+    async def run(self, records: AsyncIterator[Dict], sync: bool = False,
+                  prune_prefixes: Iterable[str] = ()) -> IngestionStats:
+        stats = IngestionStats()
+        seen: Dict[str, set] = {}  # source -> chunk ids in the input, for sync
+        ids: List[str] = []
+        slots = asyncio.Semaphore(self.max_parallel_upserts)
+        pending = set()
+        errors: List[Exception] = []
+        texts: List[str] = []
+        metadatas: List[Dict] = []
+        next_report = self.progress_every
+
+        async def upsert(batch_texts, batch_metadatas, embeddings, batch_ids):
+            try:
+                await self.vector_service.upsert_embeddings(batch_texts, embeddings, batch_metadatas, ids=batch_ids)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        async def flush():
+            if not texts:
+                return
+            # A repeat within the batch replaces the earlier copy, so the last metadata win
+            latest = {doc_id: i for i, doc_id in enumerate(ids)}
+            unchanged, changed = await self.vector_service.indexed_ids(
+                list(latest), [metadatas[i] for i in latest.values()]
+            )
+            # Unchanged chunks skip embedding and writing; chunks whose metadata changed keep their vector
+            batch_texts, batch_metadatas, batch_ids = [], [], []
+            for doc_id, i in latest.items():
+                if doc_id in unchanged:
+                    continue
+                batch_texts.append(texts[i])
+                batch_metadatas.append(metadatas[i])
+                batch_ids.append(doc_id)
+            stats.unchanged += len(texts) - len(batch_texts)
+            SKIPPED_CHUNKS.inc(len(texts) - len(batch_texts))
+            texts.clear()
+            metadatas.clear()
+            ids.clear()
+            if not batch_texts:
+                return
+
+            embeddings = await self.vector_service.embed_documents(batch_texts, batch_ids, changed)
+            for start in range(0, len(batch_texts), self.upsert_batch_size):
+                stop = start + self.upsert_batch_size
+                await slots.acquire()
+                task = asyncio.ensure_future(upsert(
+                    batch_texts[start:stop], batch_metadatas[start:stop], embeddings[start:stop], batch_ids[start:stop]
+                ))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            stats.chunks += len(batch_texts)
+            INGESTED_CHUNKS.inc(len(batch_texts))
+            # Surface upsert failures as soon as they happen
+            if errors:
+                raise errors[0]
+
+        try:
+            async for record in records:
+                if not record.get("continues"):
+                    stats.documents += 1
+                    INGESTED_DOCUMENTS.inc()
+                    self.sources.add((record.get("metadata") or {}).get("source", "unknown"))
+                for index, chunk in enumerate(chunk_text(record["text"], self.chunk_size, self.chunk_overlap)):
+                    metadata = dict(record.get("metadata") or {})
+                    if index:
+                        metadata["chunk"] = metadata.get("chunk", 0) + index
+                    doc_id = document_id(metadata.get("source", ""), chunk)
+                    if sync:
+                        seen.setdefault(metadata.get("source", ""), set()).add(doc_id)
+                    texts.append(chunk)
+                    metadatas.append(metadata)
+                    ids.append(doc_id)
+                    if len(texts) >= self.batch_size:
+                        await flush()
+
+                if self.progress and stats.documents >= next_report:
+                    next_report += self.progress_every
+                    self.progress(stats)
+
+            await flush()
+            if pending:
+                await asyncio.gather(*pending)
+            if errors:
+                raise errors[0]
+            if sync:
+                stats.deleted = await self._delete_stale(seen, prune_prefixes)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        stats.elapsed = time.perf_counter() - stats.started
+        return stats
+
+
+    async def _delete_stale(self, seen: Dict[str, set], prune_prefixes: Iterable[str]) -> int:
+        """Delete indexed chunks that the synced input no longer contains"""
+        manifest = self.vector_service.manifest
+        if manifest is None:
+            return 0
+
+        def find_stale():
+            sources = set(seen)
+            for prefix in prune_prefixes:
+                sources.update(manifest.sources(prefix))
+            stale = []
+            for source in sources:
+                stale.extend(manifest.ids_for_source(source) - seen.get(source, set()))
+            return sources, stale
+
+        # Manifest queries are SQLite: keep them off the event loop
+        sources, stale = await self.vector_service._run_in(self.vector_service.index_executor, find_stale)
+        self.sources.update(sources)
+        await self.vector_service.delete_documents(stale)
+        DELETED_CHUNKS.inc(len(stale))
+        return len(stale)
+
+
+async def iterate(items: Iterable) -> AsyncIterator:
+    """Adapt a synchronous iterable to the pipeline's async input"""
+    for item in items:
+        yield item
@@ -0,0 +1,192 @@
+import json
+import os
+from array import array
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.quantization import kmeans, nearest_centroid
+
+# Fewer points per list than this and k-means centroids are mostly noise
+MIN_POINTS_PER_LIST = 39
+
+
+class InvertedFileIndex:
+    """IVF coarse quantizer: k-means centroids plus one list of row numbers per centroid.
+
+    A query probes the ``nprobe`` lists whose centroids are closest and only
+    those rows are scored, so search cost grows with ``rows * nprobe /
+    lists`` instead of with the whole index. Lists are ``array('q')`` and
+    grow as rows are assigned; the per-row assignment (list number + 1, 0
+    for unassigned) is a memory-mapped file, so the lists are rebuilt from
+    it on open without re-assigning anything.
+
+    Not thread-safe by itself: ``LocalVectorIndex`` calls it with its lock
+    held, and builds replacement centroids off to the side (``train`` and
+    ``assign_all`` touch no shared state) before swapping them in with
+    ``install``. Read-only copies in other processes notice the swap through
+    ``reload`` (``ivf.json`` is replaced last) and add rows the writer has
+    assigned since with ``follow``.
+    """
+
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGNMENTS_FILE = "ivf_assignments.i32"
+    INFO_FILE = "ivf.json"
+
+    def __init__(self, path: str, lists: int = 1024, nprobe: int = 16, read_only: bool = False):
+        self.path = path
+        self.target_lists = max(1, lists)
+        self.nprobe = max(1, nprobe)
+        self.read_only = read_only
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._assignments: Optional[np.memmap] = None
+        self._lists: List[array] = []
+        self._centroids_path = os.path.join(path, self.CENTROIDS_FILE)
+        self._assignments_path = os.path.join(path, self.ASSIGNMENTS_FILE)
+        self._info_path = os.path.join(path, self.INFO_FILE)
+        self._version = None
+
+        if os.path.exists(self._centroids_path) and os.path.exists(self._assignments_path):
+            self.centroids = np.load(self._centroids_path)
+            self._read_info()
+
+    def _read_info(self):
+        if os.path.exists(self._info_path):
+            self._version = os.stat(self._info_path).st_ino
+            with open(self._info_path, "r", encoding="utf-8") as f:
+                self.trained_on = json.load(f).get("trained_on", 0)
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def resize(self, capacity: int):
+        if self.read_only:
+            if os.path.exists(self._assignments_path):
+                self._assignments = np.memmap(self._assignments_path, dtype=np.int32, mode="r")
+            return
+        if self._assignments is not None:
+            self._assignments.flush()
+        with open(self._assignments_path, "ab") as f:
+            f.truncate(capacity * 4)
+        self._assignments = np.memmap(self._assignments_path, dtype=np.int32, mode="r+", shape=(capacity,))
+
+    def reload(self) -> bool:
+        """Read-only copies: load centroids the writer has (re)trained since; True if they changed"""
+        if not os.path.exists(self._info_path) or os.stat(self._info_path).st_ino == self._version:
+            return False
+        self.centroids = np.load(self._centroids_path)
+        self._read_info()
+        self.resize(0)
+        return True
+
+    def follow(self, rows: List[int]):
+        """Read-only copies: list rows by the assignment the writer gave them"""
+        if len(self._assignments) <= max(rows):
+            self.resize(0)
+        for row in rows:
+            assigned = int(self._assignments[row])
+            # Beyond the lists we know of means the writer is mid-swap; the reload that follows re-lists it
+            if 0 < assigned <= len(self._lists):
+                self._lists[assigned - 1].append(row)
+
+    def load_lists(self, count: int, alive: np.ndarray) -> np.ndarray:
+        """Rebuild the lists from the stored assignments; returns live rows that have none yet"""
+        assignments = np.asarray(self._assignments[:count])
+        self._lists = _group(assignments, len(self.centroids))
+        return np.flatnonzero((assignments == 0) & alive[:count])
+
+    def assign(self, rows, matrix: np.ndarray):
+        """Put freshly written rows in the list of their nearest centroid"""
+        nearest = nearest_centroid(matrix, self.centroids) + 1
+        for row, assigned in zip(rows, nearest):
+            if self._assignments[row] != assigned:
+                # A row that moved lists leaves a stale entry behind; probes skip it
+                self._assignments[row] = assigned
+                self._lists[assigned - 1].append(row)
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Rows in the ``nprobe`` lists closest to ``query``, in row order"""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        closeness = 2.0 * (self.centroids @ query) - (self.centroids * self.centroids).sum(axis=1)
+        probed = np.argpartition(closeness, -nprobe)[-nprobe:]
+        # Copies out of the zero-copy views, so the lists may grow again once the caller unlocks
+        rows = [np.frombuffer(self._lists[l], dtype=np.int64) for l in probed]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        lengths = [len(r) for r in rows]
+        rows = np.concatenate(rows)
+        current = self._assignments[rows] == np.repeat(probed + 1, lengths)
+        # Read-only copies may list a row twice after following an overwrite
+        return np.unique(rows[current])
+
+    def flush(self):
+        if self._assignments is not None and not self.read_only:
+            self._assignments.flush()
+
+    # Retraining happens outside the index lock: train + assign_all on a snapshot, then install
+
+    def train(self, sample: np.ndarray, iterations: int = 10, seed: int = 0) -> np.ndarray:
+        lists = max(1, min(self.target_lists, len(sample) // MIN_POINTS_PER_LIST))
+        return kmeans(np.ascontiguousarray(sample, dtype=np.float32), lists, iterations, np.random.default_rng(seed))
+
+    @staticmethod
+    def assign_all(vectors: np.ndarray, count: int, centroids: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+        assignments = np.zeros(count, dtype=np.int32)
+        for start in range(0, count, block_rows):
+            stop = min(start + block_rows, count)
+            assignments[start:stop] = nearest_centroid(np.asarray(vectors[start:stop]), centroids) + 1
+        return assignments
+
+    def install(self, centroids: np.ndarray, assignments: np.ndarray, capacity: int, trained_on: int):
+        """Swap in new centroids and assignments, replacing the files atomically"""
+        temporary = self._assignments_path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.truncate(capacity * 4)
+        staged = np.memmap(temporary, dtype=np.int32, mode="r+", shape=(capacity,))
+        staged[:len(assignments)] = assignments
+        staged.flush()
+        del staged
+        if self._assignments is not None:
+            self._assignments.flush()
+        os.replace(temporary, self._assignments_path)
+        self._assignments = np.memmap(self._assignments_path, dtype=np.int32, mode="r+", shape=(capacity,))
+
+        with open(self._centroids_path + ".tmp", "wb") as f:
+            np.save(f, centroids)
+        os.replace(self._centroids_path + ".tmp", self._centroids_path)
+        # Replaced last: followers take a new info file to mean new centroids and assignments
+        with open(self._info_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"trained_on": trained_on, "lists": len(centroids)}, f)
+        os.replace(self._info_path + ".tmp", self._info_path)
+        self._version = os.stat(self._info_path).st_ino
+
+        self.centroids = centroids
+        self.trained_on = trained_on
+        self._lists = _group(assignments, len(centroids))
+
+    def stats(self) -> Dict:
+        if not self.ready:
+            return {"type": "ivf", "trained": False}
+        sizes = [len(l) for l in self._lists]
+        return {
+            "type": "ivf",
+            "trained": True,
+            "lists": len(self.centroids),
+            "nprobe": self.nprobe,
+            "trained_on": self.trained_on,
+            "largest_list": max(sizes, default=0),
+        }
+
+
+def _group(assignments: np.ndarray, lists: int) -> List[array]:
+    """One array of row numbers per list from a row -> list + 1 assignment vector"""
+    order = np.argsort(assignments, kind="stable")
+    bounds = np.searchsorted(assignments[order], np.arange(1, lists + 2))
+    grouped = []
+    for l in range(lists):
+        rows = array("q")
+        rows.frombytes(order[bounds[l]:bounds[l + 1]].astype(np.int64).tobytes())
+        grouped.append(rows)
+    return grouped
@@ -0,0 +1,232 @@
+import math
+import os
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from services.attribute_index import AttributeIndex
+from services.local_index import Match
+from services.record_log import RecordLog
+
+# Identifiers such as ERR_CONN_REFUSED, v1.2.3 or user-42 stay whole
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[_\-.:/][0-9a-z]+)*")
+PART_SEPARATORS = re.compile(r"[_\-.:/]")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his how i if in into is it its
+me my of on or our she so that the their them then there these they this to was we
+were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers also contribute their parts"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if PART_SEPARATORS.search(token):
+            terms.extend(part for part in PART_SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+class LexicalIndex:
+    """Incremental BM25 inverted index kept next to the vector store.
+
+    Each term maps to two compact ``array('I')`` posting lists (document
+    numbers in insertion order and term frequencies), so scoring a query
+    term is a handful of vectorised numpy operations over zero-copy views.
+    Overwritten and deleted documents are tombstoned rather than removed
+    from the postings. Metadata fields get posting lists too (see
+    ``services.attribute_index``), so a search ``filters`` restricts which
+    documents are scored.
+
+    With a ``path`` the index persists as an append-only ``documents.jsonl``
+    log that is replayed on open, and metadata is read back from the log
+    rather than kept in memory; without one it lives in memory only. A
+    ``read_only`` index follows another process's log with ``refresh``.
+    """
+
+    DOCUMENTS_FILE = "documents.jsonl"
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._term_ids: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_freqs: List[array] = []
+        self._doc_lengths = array("I")
+        self._ids: List[Optional[str]] = []
+        # Metadata by document number: log positions with a path, the dicts themselves without
+        self._offsets = array("q")
+        self._lengths = array("I")
+        self._metadata: List[Optional[Dict]] = []
+        self._id_to_doc: Dict[str, int] = {}
+        self._alive = bytearray()
+        self._live_length = 0
+        self._attributes = AttributeIndex()
+        self._log = None
+
+        if path:
+            if not read_only:
+                os.makedirs(path, exist_ok=True)
+            self._log = RecordLog(os.path.join(path, self.DOCUMENTS_FILE), read_only)
+            self._replay()
+            if not read_only:
+                self._log.start_appending()
+
+    def _replay(self) -> List[Dict]:
+        """Apply logged writes not seen yet; returns the metadata of every document they touched"""
+        touched = []
+        for offset, length, record in self._log.read_new():
+            if record.get("deleted"):
+                doc = self._id_to_doc.get(record["id"])
+                if doc is not None:
+                    touched.append(self._metadata_of(doc))
+                    self._remove(record["id"])
+            else:
+                metadata = record.get("metadata", {})
+                self._add(record["id"], metadata, (offset, length))
+                touched.append(metadata)
+        return touched
+
+    def refresh(self) -> List[Dict]:
+        """Read-only index: pick up what the writer logged since the last call"""
+        with self._lock:
+            return self._replay() if self._log else []
+
+    def _metadata_of(self, doc: int) -> Dict:
+        if self._log is None:
+            return dict(self._metadata[doc])
+        return self._log.read_at(self._offsets[doc], self._lengths[doc]).get("metadata", {})
+
+    def __len__(self) -> int:
+        return len(self._id_to_doc)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._id_to_doc
+
+    def _add(self, doc_id: str, metadata: Dict, position=None):
+        self._remove(doc_id)
+        doc = len(self._ids)
+        frequencies: Dict[int, int] = {}
+        terms = tokenize(metadata.get("text", ""))
+        for term in terms:
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self._postings_docs)
+                self._postings_docs.append(array("I"))
+                self._postings_freqs.append(array("I"))
+            frequencies[term_id] = frequencies.get(term_id, 0) + 1
+        for term_id, frequency in frequencies.items():
+            self._postings_docs[term_id].append(doc)
+            self._postings_freqs[term_id].append(frequency)
+
+        self._attributes.add(doc, metadata)
+        self._ids.append(doc_id)
+        if position is None:
+            self._metadata.append(metadata)
+        else:
+            self._offsets.append(position[0])
+            self._lengths.append(position[1])
+        self._doc_lengths.append(len(terms))
+        self._alive.append(1)
+        self._id_to_doc[doc_id] = doc
+        self._live_length += len(terms)
+
+    def _remove(self, doc_id: str):
+        doc = self._id_to_doc.pop(doc_id, None)
+        if doc is not None:
+            self._alive[doc] = 0
+            if self._log is None:
+                self._metadata[doc] = None
+            self._live_length -= self._doc_lengths[doc]
+
+    def add(self, documents: Iterable) -> int:
+        """Index ``(id, metadata)`` pairs; the text is taken from ``metadata["text"]``"""
+        documents = [(doc_id, dict(metadata or {})) for doc_id, metadata in documents]
+        with self._lock:
+            if self.read_only:
+                raise RuntimeError("The keyword index is opened read-only")
+            positions = [None] * len(documents)
+            if self._log:
+                positions = self._log.append([{"id": doc_id, "metadata": metadata} for doc_id, metadata in documents])
+            for (doc_id, metadata), position in zip(documents, positions):
+                self._add(doc_id, metadata, position)
+        return len(documents)
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            if self.read_only:
+                raise RuntimeError("The keyword index is opened read-only")
+            deleted = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in self._id_to_doc]
+            if self._log and deleted:
+                self._log.append([{"id": doc_id, "deleted": True} for doc_id in deleted])
+            for doc_id in deleted:
+                self._remove(doc_id)
+
+    def _score(self, terms: Iterable[str], filters: Optional[Dict] = None) -> np.ndarray:
+        """BM25 score of every document number; call with the lock held.
+
+        The zero-copy views over the posting arrays must be gone before the
+        lock is released, since an array cannot grow while a view exists, so
+        they are confined to this frame.
+        """
+        live = len(self._id_to_doc)
+        lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+        # Length normalisation per document, shared by every query term
+        norm = self.k1 * (1.0 - self.b + self.b * lengths / (self._live_length / live or 1.0))
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+        allowed = self._attributes.select(filters, len(self._ids)) if filters else None
+        for term in terms:
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+            docs = np.frombuffer(self._postings_docs[term_id], dtype=np.uint32)
+            freqs = np.frombuffer(self._postings_freqs[term_id], dtype=np.uint32).astype(np.float32)
+            idf = math.log(1.0 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+            if allowed is not None:
+                # IDF stays corpus-wide; only the documents scored are restricted
+                keep = allowed[docs]
+                docs, freqs = docs[keep], freqs[keep]
+            scores[docs] += idf * freqs * (self.k1 + 1.0) / (freqs + norm[docs])
+        scores[np.frombuffer(self._alive, dtype=np.uint8) == 0] = 0.0
+        return scores
+
+    def search(self, query: str, top_k: int = 10, filters: Optional[Dict] = None) -> List[Match]:
+        """Return the ``top_k`` live documents with the highest BM25 score, among those matching ``filters``"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._id_to_doc or top_k <= 0:
+                return []
+            scores = self._score(terms, filters)
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [
+                Match(id=self._ids[doc], score=float(scores[doc]), metadata=self._metadata_of(doc))
+                for doc in candidates
+            ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "documents": len(self._id_to_doc),
+                "terms": len(self._term_ids),
+                "postings": sum(len(p) for p in self._postings_docs),
+                "metadata_index": self._attributes.stats(),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
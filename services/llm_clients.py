@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import random
+import re
+from datetime import datetime, time as clock
+from typing import Awaitable, Callable, Optional, Union
+
+import httpx
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger("jarvis.llm_clients")
+
+LLM_RETRIES = REGISTRY.counter(
+    "jarvis_llm_retries_total", "LLM backend calls retried after a transient failure", ["backend", "reason"]
+)
+
+# Overloaded or restarting servers; anything else (bad request, missing model) fails straight away
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Failures that happen before a request reached the model, so retrying cannot run it twice.
+# RemoteProtocolError is what reusing a keep-alive connection the server already closed looks like.
+RETRYABLE_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout,
+                    httpx.RemoteProtocolError)
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def http_timeout(connect: float, read: float) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=connect)
+
+
+def http_limits(max_connections: int, keepalive_expiry: float = 60.0) -> httpx.Limits:
+    """A pool that keeps every connection it may need alive between requests"""
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                        keepalive_expiry=keepalive_expiry)
+
+
+def retry_reason(e: Exception) -> Optional[str]:
+    """Why ``e`` is worth retrying, or None when it is not"""
+    if isinstance(e, RETRYABLE_ERRORS):
+        return type(e).__name__
+    status = getattr(e, "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return str(status)
+    return None
+
+
+async def with_retries(call: Callable[[], Awaitable], backend: str, attempts: int = 3,
+                       backoff: float = 0.5, backoff_max: float = 8.0):
+    """Await ``call()``, retrying transient failures with exponential backoff and full jitter.
+
+    Jitter spreads out the retries of requests that failed together (a
+    restarting server, a dropped pool), so they do not all come back at once.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            attempt += 1
+            reason = retry_reason(e)
+            if reason is None or attempt >= attempts:
+                raise
+            LLM_RETRIES.labels(backend=backend, reason=reason).inc()
+            delay = random.uniform(0, min(backoff_max, backoff * 2 ** (attempt - 1)))
+            logger.warning("%s call failed (attempt %d of %d), retrying in %.2fs: %s",
+                           backend, attempt, attempts, delay, e)
+            await asyncio.sleep(delay)
+
+
+def keep_alive_value(value: Optional[str]) -> Union[None, float, str]:
+    """OLLAMA_KEEP_ALIVE as Ollama takes it: seconds as a number ("-1" keeps the model loaded), else a duration"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def duration_seconds(value: Union[None, float, str]) -> Optional[float]:
+    """Seconds in a keep-alive value such as 300, "30m" or "1h30m"; negative means forever"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.lstrip("-"):
+        raise ValueError(f"Unrecognised duration {value!r}")
+    seconds = sum(float(number) * {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit] for number, unit in parts)
+    return -seconds if value.startswith("-") else seconds
+
+
+class BusinessHours:
+    """A daily time window on some days of the week, e.g. ``08:00-18:00`` on ``mon-fri``.
+
+    Days are a comma-separated list of names and ranges (``mon-fri,sun``).
+    A window whose end is before its start runs past midnight; an empty
+    window means all day.
+    """
+
+    def __init__(self, hours: str = "", days: str = "mon-sun"):
+        self.start, self.end = None, None
+        if hours:
+            start, _, end = hours.partition("-")
+            self.start, self.end = _parse_clock(start), _parse_clock(end)
+        self.days = set()
+        for part in (days or "mon-sun").lower().split(","):
+            first, _, last = part.strip().partition("-")
+            begin, finish = DAYS.index(first[:3]), DAYS.index((last or first)[:3])
+            self.days.update(DAYS[(begin + i) % 7] for i in range((finish - begin) % 7 + 1))
+
+    def contains(self, moment: datetime) -> bool:
+        if self.start is None:
+            return DAYS[moment.weekday()] in self.days
+        now = moment.time()
+        if self.start <= self.end:
+            return DAYS[moment.weekday()] in self.days and self.start <= now < self.end
+        # Overnight window: the early hours belong to the previous day's shift
+        if now >= self.start:
+            return DAYS[moment.weekday()] in self.days
+        return now < self.end and DAYS[(moment.weekday() - 1) % 7] in self.days
+
+    def __str__(self) -> str:
+        hours = f"{self.start:%H:%M}-{self.end:%H:%M}" if self.start is not None else "all day"
+        return f"{hours} on {','.join(day for day in DAYS if day in self.days)}"
+
+
+def _parse_clock(value: str) -> clock:
+    hour, _, minute = value.strip().partition(":")
+    return clock(int(hour) % 24, int(minute or 0))
@@ -1,6 +1,35 @@
+import asyncio
+import logging
 import ollama
 import os
-from typing import List, Dict
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Dict
+from services.admission import (INTERACTIVE, AdmissionController, AdmissionRejected, Reservation,
+                                configured_max_in_flight)
+from services.embedding_worker import SlotLeases
+from services.health import HEALTH, FAILED, PENDING, READY, WARMING
+from services.llm_clients import (BusinessHours, duration_seconds, http_limits, http_timeout, keep_alive_value,
+                                  with_retries)
+from services.metrics import REGISTRY
+from services.prompt_builder import BuiltPrompt, PromptBuilder, TokenCounter
+from services.tracing import annotate, span
+
+LLM_TOKENS = REGISTRY.counter(
+    "jarvis_llm_tokens_total", "Tokens sent to (in) and generated by (out) the LLM", ["direction"]
+)
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "jarvis_llm_time_to_first_token_seconds", "Delay between sending a streamed prompt and its first token"
+)
+COLD_LOADS = REGISTRY.counter(
+    "jarvis_llm_cold_loads_total", "Ollama requests that had to load the model first", ["trigger"]
+)
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "jarvis_llm_model_load_seconds", "Time Ollama spent loading the model for a request that found it unloaded",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+
+logger = logging.getLogger("jarvis.llm")
 
 class LLMService:
     def __init__(self):
@@ -8,71 +37,339 @@ class LLMService:
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.use_openai = bool(self.openai_api_key and self.openai_api_key != "your_openai_api_key_here")
         
+        # Ollama effectively runs one generation per model at a time, so by
+        # default queue behind a single slot instead of piling requests onto it.
+        # Under serve.py the workers also lease from slots the embedding worker
+        # holds for all of them, so the limit is per backend, not per process
+        worker_socket = os.getenv("EMBEDDING_WORKER_SOCKET")
+        self.admission = AdmissionController(
+            "openai" if self.use_openai else "ollama",
+            max_in_flight=configured_max_in_flight(),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30")),
+            shared_slots=SlotLeases(worker_socket) if worker_socket else None,
+        )
+        self.generation_timeout = float(os.getenv("LLM_GENERATION_TIMEOUT_SECONDS", "120"))
+        
+        # One pooled keep-alive client per backend: connections are reused
+        # instead of paying a TCP (and TLS) handshake per request, connecting
+        # gives up quickly when the backend is down, and transient failures
+        # are retried with jittered backoff
+        timeout = http_timeout(
+            connect=float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5")),
+            read=float(os.getenv("LLM_READ_TIMEOUT_SECONDS", str(self.generation_timeout))),
+        )
+        # Generation slots plus warmup and keep-warm pings
+        limits = http_limits(self.admission.max_in_flight + 2)
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.retry_backoff = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+        
         if self.use_openai:
             try:
                 import openai
-                self.openai_client = openai.OpenAI(api_key=self.openai_api_key)
+                # Async client so generation never blocks the event loop; the SDK
+                # retries itself (with jitter, honouring Retry-After)
+                self.openai_client = openai.AsyncOpenAI(
+                    api_key=self.openai_api_key,
+                    http_client=openai.DefaultAsyncHttpxClient(limits=limits),
+                    timeout=timeout,
+                    max_retries=self.max_retries,
+                )
                 print("✅ Using OpenAI API")
             except ImportError:
                 print("❌ OpenAI package not installed. Install with: pip install openai")
                 self.use_openai = False
-        else:
-            # Test Ollama connection
-            try:
-                print(f"🔄 Testing Ollama connection with model: {self.model}")
-                # Test if Ollama is running and model is available
-                response = ollama.generate(
-                    model=self.model,
-                    prompt="Hello",
-                    options={"max_tokens": 1}
-                )
-                print(f"✅ Ollama connected successfully with {self.model} model")
-            except Exception as e:
-                print(f"❌ Ollama connection failed: {str(e)}")
-                print("💡 Make sure Ollama is installed and running")
-                print(f"💡 Run: ollama pull {self.model}")
-                print("💡 Or add OPENAI_API_KEY to your .env file to use OpenAI instead")
         
-    async def generate_response(self, query: str, context: List[Dict] = None) -> str:
-        """Generate response using local LLaMA model via Ollama or OpenAI"""
+        if not self.use_openai:
+            self.ollama_host = os.getenv("OLLAMA_HOST")
+            self.ollama_client = ollama.AsyncClient(host=self.ollama_host, timeout=timeout, limits=limits)
+        
+        HEALTH.set("llm", READY if self.use_openai else PENDING)
+        
+        # How long Ollama keeps the model loaded after each request (its default is 5 minutes)
+        self.keep_alive = keep_alive_value(os.getenv("OLLAMA_KEEP_ALIVE"))
+        # Loads slower than this mean the model had been unloaded: a cold start for whoever asked
+        self.cold_load_seconds = float(os.getenv("OLLAMA_COLD_LOAD_MS", "500")) / 1000.0
+        # Keep-warm: ping the model often enough during business hours that it never unloads
+        self.keep_warm_enabled = not self.use_openai and os.getenv("OLLAMA_KEEP_WARM", "true").lower() == "true"
+        self.keep_warm_hours = BusinessHours(
+            os.getenv("OLLAMA_KEEP_WARM_HOURS", "08:00-18:00"), os.getenv("OLLAMA_KEEP_WARM_DAYS", "mon-fri")
+        )
+        self.keep_warm_interval = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL_SECONDS", "120"))
+        
+        # Retrieved passages are packed into a token budget instead of pasted in whole
+        tokenizer = os.getenv("PROMPT_TOKENIZER", "cl100k_base" if self.use_openai else "")
+        self.prompt_builder = PromptBuilder(
+            TokenCounter(tokenizer or None),
+            context_tokens=int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500")),
+            max_passage_tokens=int(os.getenv("PROMPT_MAX_PASSAGE_TOKENS", "512")),
+            min_relative_score=float(os.getenv("PROMPT_MIN_RELATIVE_SCORE", "0.3")),
+            diversity=float(os.getenv("PROMPT_DIVERSITY", "0.3")),
+            history_tokens=int(os.getenv("PROMPT_HISTORY_TOKENS", "800")),
+        )
+    
+    async def warmup(self):
+        """Check Ollama is reachable and load the model so the first chat is not a cold start"""
+        if self.use_openai:
+            return
+        HEALTH.set("llm", WARMING)
         try:
-            # Build context from retrieved documents
-            context_text = ""
-            if context:
-                context_text = "\n".join([doc.get("text", "") for doc in context[:3]])
-                context_text = f"Context information:\n{context_text}\n\n"
-            
-            # Create prompt
-            prompt = f"""{context_text}User question: {query}
-
-Please provide a helpful and accurate response based on the context provided (if any) and your knowledge. Be conversational and friendly."""
+            print(f"🔄 Testing Ollama connection with model: {self.model}")
+            await self._load_model("warmup")
+            HEALTH.set("llm", READY, f"ollama:{self.model}")
+            print(f"✅ Ollama connected successfully with {self.model} model")
+        except Exception as e:
+            HEALTH.set("llm", FAILED, str(e))
+            print(f"❌ Ollama connection failed: {str(e)}")
+            print("💡 Make sure Ollama is installed and running")
+            print(f"💡 Run: ollama pull {self.model}")
+            print("💡 Or add OPENAI_API_KEY to your .env file to use OpenAI instead")
+        
+    async def _load_model(self, trigger: str):
+        """Load the model (or just extend its stay) without generating anything"""
+        # Inside business hours keep-warm holds the model at least until its next ping
+        keep_alive = self._keep_warm_hold() if self._keep_warm_due() else self.keep_alive
+        response = await self._retrying(
+            lambda: self.ollama_client.generate(model=self.model, prompt="", keep_alive=keep_alive)
+        )
+        self._observe_load(response, trigger)
+    
+    def _keep_warm_due(self) -> bool:
+        return self.keep_warm_enabled and self.keep_warm_hours.contains(datetime.now())
+    
+    def _keep_warm_hold(self):
+        """Keep-alive for keep-warm pings: long enough to outlast a missed ping, never shorter than configured"""
+        try:
+            configured = duration_seconds(self.keep_alive)
+        except ValueError:
+            configured = None
+        # Ollama's own default is 5 minutes; a negative value already keeps the model forever
+        effective = 300.0 if configured is None else configured
+        if effective < 0 or effective >= 2 * self.keep_warm_interval:
+            return self.keep_alive
+        return 2 * self.keep_warm_interval
+    
+    async def keep_warm(self):
+        """Background task: keep the model loaded during business hours.
 
-            if self.use_openai:
-                # Use OpenAI API
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are Jarvis, a helpful AI assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=500,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content
-            else:
-                # Use Ollama
-                response = ollama.generate(
+        A ping before Ollama's keep-alive runs out stops it from unloading the
+        model, so nobody pays a reload. Outside business hours the pings stop
+        and the model unloads once its last keep-alive expires.
+        """
+        print(f"🔥 Keeping {self.model} loaded {self.keep_warm_hours}")
+        while True:
+            # Warmup has just loaded the model, so the first ping is one interval away
+            await asyncio.sleep(self.keep_warm_interval)
+            if self._keep_warm_due():
+                try:
+                    await self._load_model("keep_warm")
+                    self._mark_ready()
+                except Exception as e:
+                    logger.warning("Keep-warm ping for %s failed: %s", self.model, e)
+    
+    def _observe_load(self, response, trigger: str):
+        """Count and log requests that found the model unloaded (Ollama reports the load time)"""
+        load_duration = response.get("load_duration") if response else None
+        seconds = (load_duration or 0) / 1e9
+        if seconds < self.cold_load_seconds:
+            return
+        COLD_LOADS.labels(trigger=trigger).inc()
+        MODEL_LOAD_SECONDS.observe(seconds)
+        annotate(cold_load_ms=round(seconds * 1000.0, 1))
+        logger.warning("Ollama cold-loaded %s in %.1fs (%s)", self.model, seconds, trigger)
+    
+    async def _retrying(self, call):
+        return await with_retries(call, "ollama", attempts=self.max_retries + 1, backoff=self.retry_backoff)
+    
+    async def close(self):
+        """Close the pooled connections"""
+        client = self.openai_client if self.use_openai else self.ollama_client
+        await client.close()
+    
+    def build_prompt(self, query: str, context: List[Dict] = None, history: Dict = None) -> BuiltPrompt:
+        """Pack the query, the best retrieved passages and any conversation history into the prompt token budget"""
+        with span("prompt"):
+            prompt = self.prompt_builder.build(query, context, history)
+        annotate(prompt_tokens_estimated=prompt.prompt_tokens, prompt_passages=len(prompt.passages),
+                 prompt_passages_dropped=prompt.dropped)
+        if history:
+            annotate(prompt_history_tokens=prompt.history_tokens, prompt_history_turns=prompt.history_turns)
+        return prompt
+    
+    def _openai_messages(self, prompt: BuiltPrompt) -> List[Dict]:
+        return [
+            {"role": "system", "content": prompt.system},
+            {"role": "user", "content": prompt.user}
+        ]
+    
+    def _mark_ready(self):
+        # A successful call proves the backend recovered after a failed warmup
+        if HEALTH.state("llm") != READY:
+            HEALTH.set("llm", READY, f"ollama:{self.model}")
+    
+    def error_message(self, e: Exception) -> str:
+        """Friendly reply used in place of an answer when generation fails"""
+        if isinstance(e, asyncio.TimeoutError):
+            return f"I'm sorry, generating a response took longer than {self.generation_timeout:.0f} seconds. Please try again."
+        if self.use_openai:
+            return f"I'm sorry, I encountered an error with OpenAI: {str(e)}. Please check your API key."
+        return f"I'm sorry, I encountered an error: {str(e)}. Please make sure Ollama is running with the {self.model} model, or add an OpenAI API key to use GPT instead."
+    
+    def _record_usage(self, prompt_tokens, completion_tokens):
+        """Count tokens in and out for /metrics and the request trace"""
+        if prompt_tokens:
+            LLM_TOKENS.labels(direction="in").inc(prompt_tokens)
+        if completion_tokens:
+            LLM_TOKENS.labels(direction="out").inc(completion_tokens)
+        annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    
+    async def reserve(self, priority: int = INTERACTIVE) -> Reservation:
+        """Wait for a generation slot; raises AdmissionRejected when overloaded"""
+        with span("llm_queue"):
+            return await self.admission.reserve(priority)
+    
+    async def _generate(self, prompt: BuiltPrompt) -> str:
+        if self.use_openai:
+            # Use OpenAI API
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._openai_messages(prompt),
+                max_tokens=500,
+                temperature=0.7
+            )
+            if response.usage:
+                self._record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+            return response.choices[0].message.content
+        else:
+            # Use Ollama
+            response = await self._retrying(lambda: self.ollama_client.generate(
+                model=self.model,
+                system=prompt.system,
+                prompt=prompt.user,
+                options={
+                    "temperature": 0.7,
+                    "max_tokens": 500
+                },
+                keep_alive=self.keep_alive
+            ))
+            self._mark_ready()
+            self._observe_load(response, "request")
+            self._record_usage(response.get("prompt_eval_count"), response.get("eval_count"))
+            return response['response']
+    
+    async def _stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        if self.use_openai:
+            stream = await self.openai_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._openai_messages(prompt),
+                max_tokens=500,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    self._record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            async def open_stream():
+                # The request is only sent when the first chunk is read, so that is what gets retried
+                stream = await self.ollama_client.generate(
                     model=self.model,
-                    prompt=prompt,
+                    system=prompt.system,
+                    prompt=prompt.user,
                     options={
                         "temperature": 0.7,
                         "max_tokens": 500
-                    }
+                    },
+                    stream=True,
+                    keep_alive=self.keep_alive
                 )
-                return response['response']
+                try:
+                    return stream, await stream.__anext__()
+                except StopAsyncIteration:
+                    return stream, None
+                except BaseException:
+                    await stream.aclose()
+                    raise
+            
+            stream, first = await self._retrying(open_stream)
+            self._mark_ready()
+            
+            async def chunks():
+                if first is not None:
+                    yield first
+                async for chunk in stream:
+                    yield chunk
             
+            try:
+                async for chunk in chunks():
+                    if chunk.get("done"):
+                        self._record_usage(chunk.get("prompt_eval_count"), chunk.get("eval_count"))
+                        self._observe_load(chunk, "request")
+                    if chunk['response']:
+                        yield chunk['response']
+            finally:
+                await stream.aclose()
+    
+    async def complete(self, query: str, context: List[Dict] = None, priority: int = INTERACTIVE,
+                       reservation: Reservation = None, prompt: BuiltPrompt = None) -> str:
+        """Generate a full response, raising on backend errors.
+
+        Holds a generation slot for the duration (``reservation`` if the caller
+        already reserved one) and gives up after ``generation_timeout`` seconds.
+        Pass ``prompt`` when the caller already built it (e.g. to report its sources).
+        """
+        if reservation is None:
+            reservation = await self.reserve(priority)
+        try:
+            if prompt is None:
+                prompt = self.build_prompt(query, context)
+
+            with span("generate"):
+                return await asyncio.wait_for(self._generate(prompt), self.generation_timeout)
+        finally:
+            reservation.release()
+    
+    async def stream_completion(self, query: str, context: List[Dict] = None, priority: int = INTERACTIVE,
+                                reservation: Reservation = None, prompt: BuiltPrompt = None) -> AsyncIterator[str]:
+        """Yield response tokens as the backend produces them, raising on backend errors"""
+        if reservation is None:
+            reservation = await self.reserve(priority)
+        try:
+            if prompt is None:
+                prompt = self.build_prompt(query, context)
+
+            started = time.perf_counter()
+            deadline = started + self.generation_timeout
+            first_token = True
+            with span("generate"):
+                stream = self._stream(prompt)
+                try:
+                    while True:
+                        # Bound each wait so a stalled backend cannot hold the slot forever
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        try:
+                            token = await asyncio.wait_for(stream.__anext__(), remaining)
+                        except StopAsyncIteration:
+                            break
+                        if first_token:
+                            TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+                            first_token = False
+                        yield token
+                finally:
+                    await stream.aclose()
+        finally:
+            reservation.release()
+    
+    async def generate_response(self, query: str, context: List[Dict] = None) -> str:
+        """Generate response using local LLaMA model via Ollama or OpenAI"""
+        try:
+            return await self.complete(query, context)
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            if self.use_openai:
-                return f"I'm sorry, I encountered an error with OpenAI: {str(e)}. Please check your API key."
-            else:
-                return f"I'm sorry, I encountered an error: {str(e)}. Please make sure Ollama is running with the {self.model} model, or add an OpenAI API key to use GPT instead."
\ No newline at end of file
+            return self.error_message(e)
@@ -0,0 +1,658 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from services.attribute_index import AttributeIndex
+from services.ivf import InvertedFileIndex
+from services.quantization import ProductQuantizedVectors, compact_vectors, describe, remove_unused, score_rows
+from services.record_log import RecordLog
+
+logger = logging.getLogger("jarvis.local_index")
+
+EMBEDDING_DIMENSION = 384  # all-MiniLM-L6-v2 dimension
+
+
+class IndexLockedError(OSError):
+    """Another process already has the index open for writing"""
+
+
+@dataclass
+class Match:
+    """Single query hit, shaped like a Pinecone match"""
+    id: str
+    score: float
+    metadata: Dict = field(default_factory=dict)
+
+
+@dataclass
+class QueryResult:
+    """Query response, shaped like a Pinecone query response"""
+    matches: List[Match] = field(default_factory=list)
+
+
+class LocalVectorIndex:
+    """In-process cosine index backed by a memory-mapped float32 matrix.
+
+    Exposes the subset of the Pinecone ``Index`` API that ``VectorService``
+    uses, so either backend can sit behind ``VectorService.index``.
+
+    On disk the index is a directory holding:
+
+    - ``vectors.f32``: a row-major ``(capacity, dimension)`` float32 matrix
+      of L2-normalised vectors, grown by doubling
+    - ``records.jsonl``: an append-only log of ``id -> row`` assignments,
+      metadata and deletions, replayed on open. Metadata is read back from
+      the log by offset when a match is returned, not kept in memory
+
+    With a ``storage`` mode other than ``float32`` (``float16``, ``int8`` or
+    ``pq``) queries scan a compact copy of the vectors instead (see
+    ``services.quantization``), then re-score the best ``top_k * rerank``
+    candidates exactly against the float32 rows. The float32 file stays the
+    source of truth on disk, but only the compact codes and the re-ranked
+    rows are touched per query, so that is what has to stay in memory. The
+    ``pq`` quantizer is trained in a background thread once
+    ``pq_train_size`` vectors exist; searches scan the float32 vectors
+    until every row is encoded and the codebook is swapped in.
+
+    With ``ann="ivf"`` an inverted-file index (see ``services.ivf``) narrows
+    each query to the rows in the ``nprobe`` closest lists instead of
+    scanning everything. It is trained in a background thread once
+    ``ivf_train_size`` vectors exist, and retrained the same way whenever
+    the index has grown by ``ivf_retrain_growth`` since; searches keep using
+    the previous lists (or the full scan) until the new ones are swapped in.
+
+    Metadata fields are indexed in memory as posting lists (see
+    ``services.attribute_index``), rebuilt from the records log on open, so
+    a query ``filter`` narrows the rows to score before any scoring happens.
+
+    With ``read_only`` every file is mapped read-only and nothing is
+    written, trained or re-encoded, so several processes can share one
+    writer's index through the page cache; ``refresh`` applies whatever the
+    writer has logged since (new rows, deletions, retrained IVF lists).
+    Only one process may open an index for writing: a writer holds an
+    exclusive lock on ``index.lock`` until ``close``, and a second one fails
+    with ``IndexLockedError`` instead of interleaving its writes.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    RECORDS_FILE = "records.jsonl"
+    LOCK_FILE = "index.lock"
+    MIN_CAPACITY = 1024
+    SCAN_BLOCK_ROWS = 65536
+    # k-means sample per IVF list; more barely moves the centroids
+    IVF_SAMPLE_PER_LIST = 64
+
+    def __init__(self, path: str, dimension: int = EMBEDDING_DIMENSION, storage: str = "float32",
+                 rerank: int = 10, pq_subvectors: int = 48, pq_train_size: int = 10000,
+                 ann: str = "none", ivf_lists: int = 1024, ivf_nprobe: int = 16,
+                 ivf_train_size: int = 50000, ivf_retrain_growth: float = 2.0, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.dimension = dimension
+        self.rerank = rerank
+        self.pq_train_size = max(ProductQuantizedVectors.CENTROIDS, pq_train_size)
+        if ann not in ("none", "ivf"):
+            raise ValueError(f"Unknown ANN index {ann!r}, expected 'none' or 'ivf'")
+        self.ivf = InvertedFileIndex(path, ivf_lists, ivf_nprobe, read_only) if ann == "ivf" else None
+        self.ivf_train_size = ivf_train_size
+        self.ivf_retrain_growth = ivf_retrain_growth
+        self._ivf_thread: Optional[threading.Thread] = None
+        self._ivf_dirty: set = set()
+        self._compact_thread: Optional[threading.Thread] = None
+        self._compact_dirty: set = set()
+        self._closed = False
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []
+        # Where each row's record sits in the log; a zero length means no metadata yet
+        self._meta_offsets = array("q")
+        self._meta_lengths = array("I")
+        self._id_to_row: Dict[str, int] = {}
+        self._count = 0
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._attributes = AttributeIndex()
+
+        self._writer_lock = None
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+            self._writer_lock = _lock_writer(os.path.join(path, self.LOCK_FILE))
+        self._vectors_path = os.path.join(path, self.VECTORS_FILE)
+        self.compact = compact_vectors(storage, path, dimension, pq_subvectors, read_only)
+        if not read_only:
+            remove_unused(path, self.compact)
+        self._log = RecordLog(os.path.join(path, self.RECORDS_FILE), read_only)
+        self._apply_records(self._log.read_new())
+        self._open_vectors(max(self.MIN_CAPACITY, self._count))
+        if not read_only:
+            self._log.start_appending()
+        if self.compact is not None and not read_only:
+            self._prepare_compact()
+        if self.ivf is not None:
+            self._prepare_ivf()
+
+    def _apply_records(self, records) -> Tuple[List[int], List[Dict]]:
+        """Replay logged writes into the id/row maps.
+
+        Returns the rows written and the metadata of every document that was
+        added, changed or deleted.
+        """
+        rows, touched = [], []
+        for offset, length, record in records:
+            if record.get("deleted"):
+                row = self._id_to_row.get(record["id"])
+                if row is not None:
+                    touched.append(self._metadata_at(row))
+                    self._forget(record["id"])
+                continue
+            row = record["row"]
+            while len(self._ids) <= row:
+                self._ids.append(None)
+                self._meta_offsets.append(0)
+                self._meta_lengths.append(0)
+            self._ids[row] = record["id"]
+            self._id_to_row[record["id"]] = row
+            self._count = max(self._count, row + 1)
+            self._remember(row, offset, length, record.get("metadata", {}))
+            rows.append(row)
+            touched.append(record.get("metadata", {}))
+        return rows, touched
+
+    def _remember(self, row: int, offset: int, length: int, metadata: Dict):
+        """Point ``row`` at its logged record and mark it live"""
+        previous = self._metadata_at(row) if self._meta_lengths[row] else None
+        self._attributes.update(row, previous, metadata)
+        self._meta_offsets[row] = offset
+        self._meta_lengths[row] = length
+        if row >= len(self._alive):
+            alive = np.zeros(max(row + 1, 2 * len(self._alive)), dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+        self._alive[row] = True
+
+    def _metadata_at(self, row: int) -> Dict:
+        length = self._meta_lengths[row]
+        if not length:
+            return {}
+        return self._log.read_at(self._meta_offsets[row], length).get("metadata", {})
+
+    def _forget(self, doc_id: str):
+        row = self._id_to_row.pop(doc_id, None)
+        if row is not None:
+            self._ids[row] = None
+            self._meta_lengths[row] = 0
+            if row < len(self._alive):
+                self._alive[row] = False
+
+    def _open_vectors(self, capacity: int):
+        """Map the vector file, growing it to at least ``capacity`` rows (read-only: as large as it is)"""
+        row_bytes = self.dimension * 4
+        existing_rows = 0
+        if os.path.exists(self._vectors_path):
+            existing_rows = os.path.getsize(self._vectors_path) // row_bytes
+
+        if self.read_only:
+            capacity = existing_rows
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(capacity, self.dimension)
+            )
+        else:
+            capacity = max(capacity, existing_rows)
+            if self._vectors is not None:
+                self._vectors.flush()
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension)
+            )
+        self._capacity = capacity
+
+        alive = np.zeros(max(capacity, len(self._alive)), dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+        if self.compact is not None:
+            self.compact.resize(capacity)
+        if self.ivf is not None:
+            self.ivf.resize(capacity)
+
+    def _prepare_ivf(self):
+        """Load the inverted lists, placing rows that were written without them"""
+        if self.read_only:
+            if self.ivf.ready:
+                self.ivf.load_lists(self._count, self._alive)
+            return
+        if self.ivf.ready:
+            unassigned = self.ivf.load_lists(self._count, self._alive)
+            for start in range(0, len(unassigned), self.SCAN_BLOCK_ROWS):
+                rows = unassigned[start:start + self.SCAN_BLOCK_ROWS]
+                self.ivf.assign(rows, np.asarray(self._vectors[rows]))
+        self._maybe_train_ivf()
+
+    def _maybe_train_ivf(self):
+        """Start (re)training when the index reaches the training size or has outgrown its lists; lock held"""
+        if self._ivf_thread is not None:
+            return
+        live = len(self._id_to_row)
+        if self.ivf.ready:
+            if live < self.ivf.trained_on * self.ivf_retrain_growth:
+                return
+        elif live < self.ivf_train_size:
+            return
+        self.rebuild_ann()
+
+    def rebuild_ann(self, wait: bool = False):
+        """Retrain the IVF lists in the background; searches are not blocked meanwhile"""
+        with self._lock:
+            if self.ivf is None:
+                return
+            if self._ivf_thread is None:
+                self._ivf_dirty = set()
+                self._ivf_thread = threading.Thread(target=self._train_ivf, name="ivf-train", daemon=True)
+                self._ivf_thread.start()
+            thread = self._ivf_thread
+        if wait:
+            thread.join()
+
+    def _train_ivf(self):
+        try:
+            started = time.perf_counter()
+            with self._lock:
+                count = self._count
+                vectors = self._vectors
+                alive = self._alive[:count].copy()
+            # Reads the vectors without the lock; rows rewritten meanwhile are tracked and re-placed below
+            rows = np.flatnonzero(alive)
+            sample_size = self.ivf.target_lists * self.IVF_SAMPLE_PER_LIST
+            if len(rows) > sample_size:
+                rows = np.sort(np.random.default_rng(0).choice(rows, sample_size, replace=False))
+            centroids = self.ivf.train(vectors[rows])
+            assignments = self.ivf.assign_all(vectors, count, centroids)
+            assignments[~alive] = 0
+
+            with self._lock:
+                if self._closed:
+                    return
+                self.ivf.install(centroids, assignments, self._capacity, trained_on=int(alive.sum()))
+                dirty = [row for row in sorted(self._ivf_dirty) if self._alive[row]]
+                if dirty:
+                    self.ivf.assign(dirty, np.asarray(self._vectors[dirty]))
+            logger.info("IVF index trained: %d lists over %d vectors in %.1fs",
+                        len(centroids), count, time.perf_counter() - started)
+        except Exception:
+            logger.exception("IVF training failed; searches keep using the previous lists")
+        finally:
+            with self._lock:
+                self._ivf_thread = None
+                self._ivf_dirty = set()
+
+    def _prepare_compact(self):
+        """Encode rows written before the codes existed; an untrained quantizer is trained in the background"""
+        if not self.compact.ready:
+            self._maybe_train_compact()
+            return
+        if self.compact.created:
+            for start in range(0, self._count, self.compact.SCAN_BLOCK_ROWS):
+                stop = min(start + self.compact.SCAN_BLOCK_ROWS, self._count)
+                self.compact.write(slice(start, stop), np.asarray(self._vectors[start:stop]))
+            self.compact.flush()
+            self.compact.save()
+            self.compact.created = False
+
+    def _maybe_train_compact(self):
+        """Start training the quantizer once there is enough data; lock held"""
+        if self._compact_thread is None and len(self._id_to_row) >= self.pq_train_size:
+            self.train_quantizer()
+
+    def train_quantizer(self, wait: bool = False):
+        """Train an untrained quantizer in the background; searches are not blocked meanwhile"""
+        with self._lock:
+            if self.compact is None or self.compact.ready or self.read_only:
+                return
+            if self._compact_thread is None:
+                self._compact_dirty = set()
+                self._compact_thread = threading.Thread(target=self._train_compact, name="pq-train", daemon=True)
+                self._compact_thread.start()
+            thread = self._compact_thread
+        if wait:
+            thread.join()
+
+    def _train_compact(self):
+        try:
+            started = time.perf_counter()
+            with self._lock:
+                count = self._count
+                vectors = self._vectors
+                alive = self._alive[:count].copy()
+            # Trains and encodes from the vectors without the lock; rows written meanwhile are re-encoded below
+            rows = np.flatnonzero(alive)
+            if len(rows) > 65536:
+                rows = np.sort(np.random.default_rng(0).choice(rows, 65536, replace=False))
+            codebook = self.compact.train(vectors[rows])
+            codes = np.empty((count, self.compact.width), dtype=self.compact.dtype)
+            for start in range(0, count, self.compact.SCAN_BLOCK_ROWS):
+                stop = min(start + self.compact.SCAN_BLOCK_ROWS, count)
+                codes[start:stop] = self.compact.encode(np.asarray(vectors[start:stop]), codebook)
+
+            # Catch up with rows written meanwhile, also off the lock, until few enough are left to encode under it
+            rewritten = []
+            while True:
+                with self._lock:
+                    if self._closed:
+                        return
+                    dirty = np.fromiter(sorted(self._compact_dirty), dtype=np.int64, count=len(self._compact_dirty))
+                    if len(dirty) <= self.compact.SCAN_BLOCK_ROWS:
+                        self.compact.codes[:count] = codes
+                        for rows, block in rewritten:
+                            self.compact.codes[rows] = block
+                        self.compact.install(codebook)
+                        if len(dirty):
+                            self.compact.write(dirty, np.asarray(self._vectors[dirty]))
+                        self.compact.created = False
+                        break
+                    self._compact_dirty = set()
+                    vectors = self._vectors
+                rewritten.append((dirty, self.compact.encode(np.asarray(vectors[dirty]), codebook)))
+            # The codebook is saved only once every row is on disk encoded with it, which is when followers use it
+            self.compact.flush()
+            self.compact.save()
+            logger.info("Product quantizer trained over %d vectors and %d rows encoded in %.1fs",
+                        len(rows), count, time.perf_counter() - started)
+        except Exception:
+            logger.exception("Product quantizer training failed; searches keep scanning the float32 vectors")
+        finally:
+            with self._lock:
+                self._compact_thread = None
+                self._compact_dirty = set()
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors: Iterable, **kwargs) -> Dict:
+        """Insert or overwrite ``(id, values, metadata)`` tuples or dicts"""
+        items = []
+        for item in vectors:
+            if isinstance(item, dict):
+                items.append((item["id"], item["values"], item.get("metadata") or {}))
+            else:
+                doc_id, values = item[0], item[1]
+                items.append((doc_id, values, item[2] if len(item) > 2 else {}))
+        if not items:
+            return {"upserted_count": 0}
+
+        matrix = np.stack([np.asarray(values, dtype=np.float32) for _, values, _ in items])
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dim vectors, got {matrix.shape[1]}")
+        matrix = self._normalize(matrix)
+
+        with self._lock:
+            if self.read_only:
+                raise RuntimeError("The local vector index is opened read-only")
+            rows = []
+            for doc_id, _, _ in items:
+                row = self._id_to_row.get(doc_id)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._ids.append(doc_id)
+                    self._meta_offsets.append(0)
+                    self._meta_lengths.append(0)
+                    self._id_to_row[doc_id] = row
+                rows.append(row)
+
+            if self._count > self._capacity:
+                self._open_vectors(max(self._count, self._capacity * 2))
+
+            self._vectors[rows] = matrix
+            if self.compact is not None:
+                if self.compact.ready:
+                    self.compact.write(rows, matrix)
+                elif self._compact_thread is not None:
+                    self._compact_dirty.update(rows)
+            if self.ivf is not None:
+                if self.ivf.ready:
+                    self.ivf.assign(rows, matrix)
+                if self._ivf_thread is not None:
+                    self._ivf_dirty.update(rows)
+            # Logged after the vectors, codes and lists, so a follower that sees the record finds them in place
+            positions = self._log.append(
+                [{"id": doc_id, "row": row, "metadata": metadata} for (doc_id, _, metadata), row in zip(items, rows)]
+            )
+            for (_, _, metadata), row, (offset, length) in zip(items, rows, positions):
+                self._remember(row, offset, length, metadata)
+            if self.compact is not None and not self.compact.ready:
+                self._maybe_train_compact()
+            if self.ivf is not None:
+                self._maybe_train_ivf()
+
+        return {"upserted_count": len(items)}
+
+    def delete(self, ids: List[str] = None, **kwargs):
+        """Delete vectors by id"""
+        with self._lock:
+            if self.read_only:
+                raise RuntimeError("The local vector index is opened read-only")
+            deleted = [doc_id for doc_id in dict.fromkeys(ids or []) if doc_id in self._id_to_row]
+            if deleted:
+                self._log.append([{"id": doc_id, "deleted": True} for doc_id in deleted])
+            for doc_id in deleted:
+                self._forget(doc_id)
+        return {}
+
+    def fetch(self, ids: List[str], **kwargs) -> Dict:
+        """Stored vectors and metadata by id, shaped like a Pinecone fetch response"""
+        with self._lock:
+            found = {}
+            for doc_id in ids:
+                row = self._id_to_row.get(doc_id)
+                if row is not None:
+                    found[doc_id] = {"id": doc_id, "values": np.array(self._vectors[row]),
+                                     "metadata": self._metadata_at(row)}
+        return {"vectors": found}
+
+    def refresh(self) -> List[Dict]:
+        """Apply what the writer of a read-only index logged since the last call.
+
+        Returns the metadata of every document added, changed or deleted.
+        """
+        with self._lock:
+            rows, touched = self._apply_records(self._log.read_new())
+            if self._count > self._capacity:
+                self._open_vectors(self._count)
+            if self.compact is not None and not self.compact.ready:
+                self.compact.reload()
+            if self.ivf is not None:
+                if self.ivf.reload():
+                    self.ivf.load_lists(self._count, self._alive)
+                elif self.ivf.ready and rows:
+                    self.ivf.follow(rows)
+        return touched
+
+    def query(self, vector, top_k: int = 10, include_metadata: bool = True, filter: Optional[Dict] = None,
+              nprobe: Optional[int] = None, exact: bool = False, **kwargs) -> QueryResult:
+        """Return the ``top_k`` stored vectors with the highest cosine similarity.
+
+        ``filter`` is a Pinecone-style metadata filter (see
+        ``services.attribute_index.validate_filters``); only matching vectors
+        are scored. ``nprobe`` overrides how many IVF lists are searched;
+        ``exact`` scans every vector even when an ANN index is available.
+        """
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+
+        with self._lock:
+            count = self._count
+            vectors = self._vectors
+            alive = self._alive
+            compact = self.compact if self.compact is not None and self.compact.ready else None
+            allowed = None
+            if filter and count:
+                allowed = self._attributes.select(filter, count) & alive[:count]
+            candidates = None
+            if self.ivf is not None and self.ivf.ready and not exact and count:
+                candidates = self.ivf.candidates(query, nprobe)
+        if count == 0 or top_k <= 0:
+            return QueryResult()
+
+        depth = top_k * self.rerank if compact is not None and self.rerank > 0 else top_k
+        if allowed is not None:
+            candidates, alive = self._filtered_candidates(allowed, candidates, depth)
+            if candidates is not None and len(candidates) == 0:
+                return QueryResult()
+        if candidates is not None:
+            candidates = candidates[alive[candidates]]
+            if compact is None:
+                scores = score_rows(vectors, candidates, query)
+            else:
+                scores = compact.score_rows(candidates, compact.prepare(query))
+            best_rows, best_scores = _top(candidates, scores, depth)
+        elif compact is None:
+            best_rows, best_scores = self._scan(
+                lambda start, stop: vectors[start:stop] @ query, count, alive, depth, self.SCAN_BLOCK_ROWS
+            )
+        else:
+            prepared = compact.prepare(query)
+            best_rows, best_scores = self._scan(
+                lambda start, stop: compact.scores(start, stop, prepared), count, alive, depth,
+                compact.SCAN_BLOCK_ROWS,
+            )
+        if depth > top_k and len(best_rows):
+            # Exact scores for the shortlist, reading rows in file order
+            best_rows = np.sort(best_rows[np.isfinite(best_scores)])
+            best_rows, best_scores = _top(best_rows, score_rows(vectors, best_rows, query), top_k)
+
+        order = np.argsort(-best_scores)
+        matches = []
+        for i in order:
+            if not np.isfinite(best_scores[i]):
+                continue
+            row = int(best_rows[i])
+            doc_id = self._ids[row]
+            if doc_id is None:
+                continue
+            metadata = self._metadata_at(row) if include_metadata else {}
+            matches.append(Match(id=doc_id, score=float(best_scores[i]), metadata=metadata))
+        return QueryResult(matches=matches)
+
+    def _filtered_candidates(self, allowed: np.ndarray, candidates: Optional[np.ndarray], depth: int):
+        """Pick how to search only the ``allowed`` rows; returns ``(candidates, alive)`` for the query.
+
+        Scoring a scattered row costs about twice a row of a sequential scan,
+        so a filter matching fewer than half the rows is searched exactly by
+        scoring just those rows, and a broader one by scanning with the
+        filter as the liveness mask. With IVF the probed lists are narrowed
+        to the matching rows instead, unless scoring every match is no more
+        work or the probed lists hold too few of them.
+        """
+        matching = np.flatnonzero(allowed)
+        if candidates is not None:
+            if len(matching) <= len(candidates):
+                return matching, allowed
+            probed = candidates[allowed[candidates]]
+            if len(probed) >= depth:
+                return probed, allowed
+            return matching, allowed
+        if len(matching) * 2 <= len(allowed):
+            return matching, allowed
+        return None, allowed
+
+    def _scan(self, score_block, count: int, alive: np.ndarray, top_k: int, block_rows: int):
+        """Rows and scores of the ``top_k`` best live rows, scoring ``block_rows`` at a time"""
+        # Blocks keep temporary score arrays small at millions of rows
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, count, block_rows):
+            stop = min(start + block_rows, count)
+            scores = score_block(start, stop)
+            scores[~alive[start:stop]] = -np.inf
+            k = min(top_k, stop - start)
+            top = np.argpartition(scores, -k)[-k:]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_rows) > top_k:
+                keep = np.argpartition(best_scores, -top_k)[-top_k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        return best_rows, best_scores
+
+    def iter_documents(self, batch_size: int = 4096) -> Iterator[Tuple[List[str], np.ndarray, List[Dict]]]:
+        """Every live document as ``(ids, vectors, metadatas)`` batches in row order, read sequentially"""
+        start = 0
+        while True:
+            with self._lock:
+                if start >= self._count:
+                    return
+                stop = min(start + batch_size, self._count)
+                rows = np.flatnonzero(self._alive[start:stop]) + start
+                ids = [self._ids[row] for row in rows]
+                vectors = np.array(self._vectors[rows])
+                positions = [(self._meta_offsets[row], self._meta_lengths[row]) for row in rows]
+            start = stop
+            if ids:
+                # The log is append-only, so its records can be read back without holding up writers
+                metadatas = [self._log.read_at(offset, length).get("metadata", {}) if length else {}
+                             for offset, length in positions]
+                yield ids, vectors, metadatas
+
+    def describe_index_stats(self) -> Dict:
+        """Report vector counts, like Pinecone's ``describe_index_stats``"""
+        return {
+            "dimension": self.dimension,
+            "total_vector_count": len(self._id_to_row),
+            **describe(self.compact, self.dimension),
+            "ann": self.ivf.stats() if self.ivf is not None else {"type": "none"},
+            "metadata_index": self._attributes.stats(),
+        }
+
+    def flush(self):
+        """Force vectors and records to disk"""
+        with self._lock:
+            if self.read_only:
+                return
+            self._vectors.flush()
+            if self.compact is not None:
+                self.compact.flush()
+            if self.ivf is not None:
+                self.ivf.flush()
+            self._log.fsync()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            # A training run still in progress is discarded; it restarts on the next open
+            self._closed = True
+            self._log.close()
+            if self._writer_lock is not None:
+                self._writer_lock.close()
+                self._writer_lock = None
+
+
+def _lock_writer(path: str):
+    """Take the index's writer lock without waiting; it is held until the returned file is closed"""
+    lock_file = open(path, "a+b")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.seek(0)
+        holder = lock_file.read().decode("ascii", "replace").strip() or "unknown"
+        lock_file.close()
+        raise IndexLockedError(f"{os.path.dirname(path)} is open for writing by another process (pid {holder}); "
+                               "stop it first, or add documents through its API") from None
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()).encode("ascii"))
+    lock_file.flush()
+    return lock_file
+
+
+def _top(rows: np.ndarray, scores: np.ndarray, k: int):
+    """The ``k`` highest-scoring rows (unordered) and their scores"""
+    if len(rows) > k:
+        keep = np.argpartition(scores, -k)[-k:]
+        return rows[keep], scores[keep]
+    return rows, scores
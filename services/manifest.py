@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.embedding_cache import normalize_text
+
+
+def document_id(source: str, text: str) -> str:
+    """Deterministic id for a chunk: the same text from the same source always maps to the same id"""
+    digest = hashlib.sha256(f"{source}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+    return digest[:32]
+
+
+def metadata_hash(metadata: Optional[Dict]) -> str:
+    """Fingerprint of a document's metadata, apart from the text its id already covers"""
+    fields = {key: value for key, value in (metadata or {}).items() if key != "text"}
+    encoded = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+class DocumentManifest:
+    """SQLite record of which document ids are in the vector store, by source.
+
+    Because ids are content-addressed, membership answers "is this exact
+    chunk already indexed?" without touching the vector store, and the
+    per-source listing is what an incremental sync diffs against. Each id
+    also keeps a hash of the metadata it was written with, so a re-post
+    whose tags or fields changed is rewritten rather than skipped. Without
+    a ``path`` the manifest lives in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, source TEXT NOT NULL, indexed_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_source ON documents (source)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(documents)")}
+        if "metadata_hash" not in columns:
+            try:
+                # Manifests from before metadata was tracked; their rows count as changed once
+                self._db.execute("ALTER TABLE documents ADD COLUMN metadata_hash TEXT")
+            except sqlite3.OperationalError:
+                pass  # another process added it first
+
+    def metadata_hashes(self, ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """``id -> metadata hash`` for the subset of ``ids`` that is already indexed"""
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT id, metadata_hash FROM documents WHERE id IN ({placeholders})", batch
+                )
+                found.update(rows)
+        return found
+
+    def add(self, entries: Iterable[Tuple[str, str, str]]):
+        """Record ``(id, source, metadata hash)`` triples as indexed"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO documents (id, source, indexed_at, metadata_hash) VALUES (?, ?, ?, ?)",
+                [(doc_id, source, now, digest) for doc_id, source, digest in entries],
+            )
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            self._db.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def ids_for_source(self, source: str) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT id FROM documents WHERE source = ?", (source,))}
+
+    def sources(self, prefix: str = "") -> List[str]:
+        """Every indexed source, optionally only those starting with ``prefix``"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT source FROM documents WHERE substr(source, 1, ?) = ?", (len(prefix), prefix)
+            )
+            return [row[0] for row in rows]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            documents, sources = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT source) FROM documents"
+            ).fetchone()
+        return {"documents": documents, "sources": sources}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
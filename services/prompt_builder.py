@@ -0,0 +1,279 @@
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from services.lexical_index import tokenize
+from services.metrics import REGISTRY
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "jarvis_prompt_tokens", "Tokens in each assembled prompt, as counted by the prompt builder",
+    buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192),
+)
+PASSAGES = REGISTRY.counter(
+    "jarvis_prompt_passages_total", "Retrieved passages by what the prompt builder did with them", ["outcome"]
+)
+
+SYSTEM_PROMPT = (
+    "You are Jarvis, a helpful AI assistant. Provide a helpful and accurate response based on "
+    "the context provided (if any) and your knowledge. Be conversational and friendly."
+)
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+# Scores set by the individual retrievers; under hybrid search ``score`` is the fused rank score
+RETRIEVER_SCORES = ("vector_score", "keyword_score")
+
+
+class TokenCounter:
+    """Counts tokens the way the target model does, as closely as the installed packages allow.
+
+    ``name`` is a tiktoken encoding (``cl100k_base``), a Hugging Face
+    tokenizer repo or a local ``tokenizer.json`` path. ``tiktoken`` and
+    ``tokenizers`` are optional; without them, or without a name, a
+    heuristic of roughly four characters per token is used.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = "heuristic"
+        self._encode = None
+        if name:
+            self._encode = self._load(name)
+            if self._encode is not None:
+                self.name = name
+
+    def _load(self, name: str):
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            pass
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(name) if name.endswith(".json") else Tokenizer.from_pretrained(name)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except Exception:
+            print(f"⚠️  Tokenizer {name} unavailable, estimating prompt tokens instead")
+            return None
+
+    def count(self, text: str) -> int:
+        if self._encode is not None:
+            return self._encode(text)
+        # BPE vocabularies split long words into pieces of about four characters
+        return sum(math.ceil(len(piece) / 4) for piece in TOKEN_PIECES.findall(text))
+
+
+@dataclass
+class BuiltPrompt:
+    """An assembled prompt and what went into it"""
+    system: str
+    user: str
+    passages: List[Dict] = field(default_factory=list)
+    system_tokens: int = 0
+    user_tokens: int = 0
+    dropped: Dict[str, int] = field(default_factory=dict)
+    history_tokens: int = 0
+    history_turns: int = 0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.system_tokens + self.user_tokens
+
+    @property
+    def sources(self) -> List[str]:
+        return [passage.get("source", "") for passage in self.passages]
+
+
+class PromptBuilder:
+    """Assembles the prompt from retrieved passages within a token budget.
+
+    Passages are considered best-first using maximal marginal relevance:
+    relevance is the retrieval score relative to the best passage (per
+    retriever under hybrid search, whose fused score only reflects rank), and
+    redundancy is the term overlap with passages already chosen, so near
+    duplicates lose to passages that add something new. Passages scoring
+    below ``min_relative_score`` of the best, or overlapping a chosen one by
+    ``duplicate_threshold``, are dropped. A passage that does not fit is cut
+    down to the sentences that share the most terms with the question.
+
+    Conversation history gets its own budget, ``history_tokens``: the
+    running summary of earlier turns first, then as many of the most recent
+    turns as fit, so a session's prompt stays the same size however long it
+    runs.
+
+    The system prompt is constant and comes first, so backends that cache
+    prompt prefixes can reuse it across requests.
+    """
+
+    def __init__(self, counter: TokenCounter, context_tokens: int = 1500, max_passage_tokens: int = 512,
+                 min_relative_score: float = 0.3, diversity: float = 0.3, duplicate_threshold: float = 0.8,
+                 system_prompt: str = SYSTEM_PROMPT, history_tokens: int = 800):
+        self.counter = counter
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self.max_passage_tokens = max_passage_tokens
+        self.min_relative_score = min_relative_score
+        self.diversity = diversity
+        self.duplicate_threshold = duplicate_threshold
+        self.system_prompt = system_prompt
+        self.system_tokens = counter.count(system_prompt)
+
+    def build(self, query: str, context: List[Dict] = None, history: Optional[Dict] = None) -> BuiltPrompt:
+        """``history`` is a session's ``{"summary": str, "turns": [{"user", "assistant"}, ...]}``, oldest turn first"""
+        passages, dropped = self._select(query, context or [])
+        sections = []
+        conversation, history_turns = self.conversation(history)
+        if conversation:
+            sections.append(conversation)
+        if passages:
+            blocks = [f"[{i}] ({p.get('source', 'unknown')}) {p['text']}" for i, p in enumerate(passages, start=1)]
+            sections.append("Context information:\n" + "\n\n".join(blocks))
+        sections.append(f"User question: {query}")
+        user = "\n\n".join(sections)
+
+        prompt = BuiltPrompt(
+            system=self.system_prompt,
+            user=user,
+            passages=passages,
+            system_tokens=self.system_tokens,
+            user_tokens=self.counter.count(user),
+            dropped=dropped,
+            history_tokens=self.counter.count(conversation) if conversation else 0,
+            history_turns=history_turns,
+        )
+        PROMPT_TOKENS.observe(prompt.prompt_tokens)
+        PASSAGES.labels(outcome="used").inc(len(passages))
+        for reason, count in dropped.items():
+            PASSAGES.labels(outcome=reason).inc(count)
+        return prompt
+
+    def conversation(self, history: Optional[Dict]):
+        """The conversation section of the prompt within ``history_tokens``, and how many recent turns made it in"""
+        if not history or self.history_tokens <= 0:
+            return "", 0
+        remaining = self.history_tokens
+        summary = (history.get("summary") or "").strip()
+        if summary:
+            summary = self.truncate(summary, remaining // 2)
+            remaining -= self.counter.count(summary) + 8
+        lines = []
+        # Newest first, so the turn a follow-up refers to is the last to be left out
+        for turn in reversed(history.get("turns") or []):
+            text = f"User: {turn['user']}\nJarvis: {turn['assistant']}"
+            cost = self.counter.count(text) + 1
+            if cost > remaining:
+                if not lines and remaining > 16:
+                    lines.append(self.truncate(text, remaining - 1))
+                break
+            lines.append(text)
+            remaining -= cost
+        if not summary and not lines:
+            return "", 0
+        parts = ["Conversation so far:"]
+        if summary:
+            parts.append(f"(Summary of earlier turns) {summary}")
+        parts.extend(reversed(lines))
+        return "\n".join(parts), len(lines)
+
+    def _select(self, query: str, context: List[Dict]):
+        dropped = {"low_score": 0, "duplicate": 0, "over_budget": 0}
+        candidates = [doc for doc in context if doc.get("text", "").strip()]
+        if not candidates:
+            return [], {}
+
+        relevance, terms = [], []
+        for doc, relative in zip(candidates, _relative_scores(candidates)):
+            if relative < self.min_relative_score:
+                dropped["low_score"] += 1
+                continue
+            relevance.append((relative, doc))
+            terms.append(set(tokenize(doc["text"])))
+
+        query_terms = set(tokenize(query))
+        remaining = self.context_tokens
+        chosen: List[Dict] = []
+        chosen_terms: List[set] = []
+        pending = list(range(len(relevance)))
+        while pending and remaining > 0:
+            # Maximal marginal relevance: reward score, penalise overlap with what is already in
+            scored = []
+            for i in pending:
+                overlap = max((_jaccard(terms[i], seen) for seen in chosen_terms), default=0.0)
+                scored.append(((1 - self.diversity) * relevance[i][0] - self.diversity * overlap, overlap, i))
+            _, overlap, i = max(scored, key=lambda item: (item[0], -item[2]))
+            pending.remove(i)
+            if overlap >= self.duplicate_threshold:
+                dropped["duplicate"] += 1
+                continue
+
+            doc = relevance[i][1]
+            text = self._fit(doc["text"], query_terms, min(remaining, self.max_passage_tokens))
+            if not text:
+                dropped["over_budget"] += 1
+                continue
+            # Block framing ("[n] (source) " and separators) costs a few tokens too
+            cost = self.counter.count(text) + 8
+            remaining -= cost
+            chosen.append({**doc, "text": text})
+            chosen_terms.append(terms[i])
+        dropped["over_budget"] += len(pending)
+        return chosen, {reason: count for reason, count in dropped.items() if count}
+
+    def _fit(self, text: str, query_terms: set, budget: int) -> str:
+        """The passage itself if it fits, otherwise its most relevant sentences in their original order"""
+        if budget <= 0:
+            return ""
+        text = text.strip()
+        if self.counter.count(text) <= budget:
+            return text
+
+        sentences = [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s.strip()]
+        matches = [len(query_terms.intersection(tokenize(sentence))) for sentence in sentences]
+        ranked = sorted(range(len(sentences)), key=lambda i: (-matches[i], i))
+        if any(matches):
+            # Only sentences that mention the question; otherwise fall back to the opening ones
+            ranked = [i for i in ranked if matches[i]]
+        keep, used = [], 0
+        for i in ranked:
+            cost = self.counter.count(sentences[i]) + 1
+            if used + cost > budget:
+                continue
+            keep.append(i)
+            used += cost
+        if not keep:
+            # Not even one sentence fits: keep the start of the most relevant one
+            return self.truncate(sentences[ranked[0]], budget) if sentences else ""
+        return " ".join(sentences[i] for i in sorted(keep))
+
+    def truncate(self, text: str, budget: int) -> str:
+        """The leading words of ``text`` that fit in ``budget`` tokens"""
+        if budget <= 0:
+            return ""
+        count = self.counter.count(text)
+        if count <= budget:
+            return text
+        words = text.split()
+        while words and count > budget:
+            words = words[:int(len(words) * budget / count * 0.9)]
+            count = self.counter.count(" ".join(words))
+        return " ".join(words)
+
+
+def _relative_scores(candidates: List[Dict]) -> List[float]:
+    """Each passage's score as a fraction of the best one's.
+
+    Reciprocal-rank fusion scores barely differ between a strong and a weak
+    match, so hybrid results are compared on the retrievers' own scores
+    instead, each against the best from the same retriever; a passage is as
+    relevant as its better showing.
+    """
+    fields = [field for field in RETRIEVER_SCORES if any(field in doc for doc in candidates)] or ["score"]
+    best = {field: max(doc.get(field, 0.0) for doc in candidates) or 1.0 for field in fields}
+    return [max(doc.get(field, 0.0) / best[field] for field in fields) for doc in candidates]
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,335 @@
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+STORAGE_MODES = ("float32", "float16", "int8", "pq")
+
+# Scattered rows are gathered this many at a time, so the copies stay in cache
+GATHER_ROWS = 1024
+
+
+def score_rows(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Inner products of ``query`` with scattered float32 ``rows`` of ``vectors``"""
+    scores = np.empty(len(rows), dtype=np.float32)
+    for begin in range(0, len(rows), GATHER_ROWS):
+        chunk = rows[begin:begin + GATHER_ROWS]
+        scores[begin:begin + len(chunk)] = vectors[chunk] @ query
+    return scores
+
+
+class CompactVectors:
+    """Memory-mapped ``(capacity, width)`` matrix of compressed vectors.
+
+    Subclasses decide the code type (``encode``) and how a query is scored
+    against a block of codes (``prepare`` once per query, then ``scores``
+    per block). Scores approximate the inner product with the original
+    normalised vectors, which the index keeps for exact re-ranking.
+    """
+
+    mode = ""
+    suffix = ""
+    dtype = np.float32
+    SCAN_BLOCK_ROWS = 8192
+
+    def __init__(self, path: str, dimension: int, read_only: bool = False):
+        self.path = path
+        self.dimension = dimension
+        self.read_only = read_only
+        self.codes: Optional[np.memmap] = None
+        self._codes_path = os.path.join(path, self.files()[0])
+        self.created = not os.path.exists(self._codes_path)
+
+    @classmethod
+    def files(cls):
+        return [f"codes.{cls.suffix}"]
+
+    @property
+    def width(self) -> int:
+        return self.dimension
+
+    @property
+    def ready(self) -> bool:
+        """Whether codes can be written and scanned (product quantization needs training first)"""
+        return True
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.width * np.dtype(self.dtype).itemsize
+
+    def _map(self, file_path: str, dtype, width: int, capacity: int) -> np.memmap:
+        row_bytes = width * np.dtype(dtype).itemsize
+        if self.read_only:
+            # Followers map whatever the writer has grown the file to
+            return np.memmap(file_path, dtype=dtype, mode="r", shape=(os.path.getsize(file_path) // row_bytes, width))
+        with open(file_path, "ab") as f:
+            f.truncate(capacity * row_bytes)
+        return np.memmap(file_path, dtype=dtype, mode="r+", shape=(capacity, width))
+
+    def resize(self, capacity: int):
+        if self.codes is not None and not self.read_only:
+            self.codes.flush()
+        self.codes = self._map(self._codes_path, self.dtype, self.width, capacity)
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def write(self, rows, matrix: np.ndarray):
+        self.codes[rows] = self.encode(matrix)
+
+    def prepare(self, query: np.ndarray):
+        return query
+
+    def scores(self, start: int, stop: int, prepared) -> np.ndarray:
+        raise NotImplementedError
+
+    def score_rows(self, rows: np.ndarray, prepared) -> np.ndarray:
+        """Approximate scores for arbitrary (sorted) rows, e.g. an inverted-list shortlist"""
+        raise NotImplementedError
+
+    def save(self):
+        """Persist what training produced, once every row has been encoded with it"""
+
+    def reload(self):
+        """Read-only copies: pick up training the writer has saved since"""
+
+    def flush(self):
+        if self.codes is not None and not self.read_only:
+            self.codes.flush()
+
+
+class _ScalarVectors(CompactVectors):
+    """Codes that are the vector itself in a narrower type, scored by decoding to float32"""
+
+    # Decoding goes through a small float32 buffer that stays in cache
+    DECODE_ROWS = 512
+
+    def prepare(self, query: np.ndarray):
+        return query, np.empty((self.DECODE_ROWS, self.width), dtype=np.float32)
+
+    def scores(self, start: int, stop: int, prepared) -> np.ndarray:
+        query, buffer = prepared
+        scores = np.empty(stop - start, dtype=np.float32)
+        for begin in range(start, stop, self.DECODE_ROWS):
+            end = min(begin + self.DECODE_ROWS, stop)
+            decoded = buffer[:end - begin]
+            np.copyto(decoded, self.codes[begin:end], casting="unsafe")
+            scores[begin - start:end - start] = decoded @ query
+        return scores
+
+    def score_rows(self, rows: np.ndarray, prepared) -> np.ndarray:
+        query, buffer = prepared
+        scores = np.empty(len(rows), dtype=np.float32)
+        for begin in range(0, len(rows), self.DECODE_ROWS):
+            chunk = rows[begin:begin + self.DECODE_ROWS]
+            decoded = buffer[:len(chunk)]
+            np.copyto(decoded, self.codes[chunk], casting="unsafe")
+            scores[begin:begin + len(chunk)] = decoded @ query
+        return scores
+
+
+class Float16Vectors(_ScalarVectors):
+    """Half-precision copy of each vector: 2 bytes per dimension"""
+
+    mode = "float16"
+    suffix = "f16"
+    dtype = np.float16
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        return matrix.astype(np.float16)
+
+
+class Int8Vectors(_ScalarVectors):
+    """Symmetric scalar quantization: int8 codes plus one float32 scale per vector"""
+
+    mode = "int8"
+    suffix = "i8"
+    dtype = np.int8
+
+    def __init__(self, path: str, dimension: int, read_only: bool = False):
+        super().__init__(path, dimension, read_only)
+        self.scales: Optional[np.memmap] = None
+        self._scales_path = os.path.join(path, self.files()[1])
+
+    @classmethod
+    def files(cls):
+        return [f"codes.{cls.suffix}", "scales.f32"]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.width + 4
+
+    def resize(self, capacity: int):
+        super().resize(capacity)
+        if self.scales is not None and not self.read_only:
+            self.scales.flush()
+        self.scales = self._map(self._scales_path, np.float32, 1, capacity)
+
+    def encode(self, matrix: np.ndarray):
+        scale = np.abs(matrix).max(axis=1, keepdims=True) / 127.0
+        scale[scale == 0] = 1.0
+        return np.round(matrix / scale).astype(np.int8), scale.astype(np.float32)
+
+    def write(self, rows, matrix: np.ndarray):
+        self.codes[rows], self.scales[rows] = self.encode(matrix)
+
+    def scores(self, start: int, stop: int, prepared) -> np.ndarray:
+        return super().scores(start, stop, prepared) * self.scales[start:stop, 0]
+
+    def score_rows(self, rows: np.ndarray, prepared) -> np.ndarray:
+        return super().score_rows(rows, prepared) * self.scales[rows, 0]
+
+    def flush(self):
+        super().flush()
+        if self.scales is not None and not self.read_only:
+            self.scales.flush()
+
+
+class ProductQuantizedVectors(CompactVectors):
+    """Product quantization: one byte per subvector, scored with per-query lookup tables.
+
+    The vector is split into ``subvectors`` equal slices and each slice is
+    replaced by the nearest of 256 centroids learned by k-means, so 384
+    dimensions with 48 subvectors take 48 bytes instead of 1536. The
+    codebook is trained once from the vectors stored so far and saved next
+    to the codes once every row is encoded; until then the index keeps
+    scanning the float32 vectors. Training and encoding with a new codebook
+    do not touch the installed one, so they can run while searches continue.
+    """
+
+    mode = "pq"
+    suffix = "pq"
+    dtype = np.uint8
+    CENTROIDS = 256
+    CODEBOOK_FILE = "pq_codebook.npy"
+
+    def __init__(self, path: str, dimension: int, subvectors: int = 48, read_only: bool = False):
+        if dimension % subvectors:
+            raise ValueError(f"{dimension} dimensions do not split into {subvectors} subvectors")
+        super().__init__(path, dimension, read_only)
+        self.subvectors = subvectors
+        self.subdimension = dimension // subvectors
+        self.codebook: Optional[np.ndarray] = None
+        self._codebook_path = os.path.join(path, self.files()[1])
+        # Offsets into the flattened (subvectors * 256) lookup table
+        self._offsets = np.arange(subvectors, dtype=np.intp) * self.CENTROIDS
+        self.reload()
+        if self.codebook is None and os.path.exists(self._codebook_path):
+            # Configured for a different split; retrain and re-encode
+            self.created = True
+
+    @classmethod
+    def files(cls):
+        return [f"codes.{cls.suffix}", cls.CODEBOOK_FILE]
+
+    @property
+    def width(self) -> int:
+        return self.subvectors
+
+    @property
+    def ready(self) -> bool:
+        return self.codebook is not None
+
+    def train(self, sample: np.ndarray, iterations: int = 20, seed: int = 0) -> np.ndarray:
+        """Learn a codebook with k-means on each subvector slice of ``sample``; ``install`` puts it in use"""
+        rng = np.random.default_rng(seed)
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        centroids = min(self.CENTROIDS, len(sample))
+        codebook = np.zeros((self.subvectors, self.CENTROIDS, self.subdimension), dtype=np.float32)
+        for m in range(self.subvectors):
+            points = sample[:, m * self.subdimension:(m + 1) * self.subdimension]
+            codebook[m, :centroids] = kmeans(points, centroids, iterations, rng)
+        return codebook
+
+    def install(self, codebook: np.ndarray):
+        self.codebook = codebook
+
+    def save(self):
+        with open(self._codebook_path + ".tmp", "wb") as f:
+            np.save(f, self.codebook)
+        os.replace(self._codebook_path + ".tmp", self._codebook_path)
+
+    def reload(self):
+        if self.codebook is None and os.path.exists(self._codebook_path):
+            codebook = np.load(self._codebook_path)
+            if codebook.shape == (self.subvectors, self.CENTROIDS, self.subdimension):
+                self.codebook = codebook
+
+    def encode(self, matrix: np.ndarray, codebook: Optional[np.ndarray] = None) -> np.ndarray:
+        """Codes for ``matrix`` under the installed codebook, or under ``codebook`` before it is installed"""
+        codebook = self.codebook if codebook is None else codebook
+        codes = np.empty((len(matrix), self.subvectors), dtype=np.uint8)
+        for m in range(self.subvectors):
+            points = matrix[:, m * self.subdimension:(m + 1) * self.subdimension]
+            codes[:, m] = nearest_centroid(points, codebook[m])
+        return codes
+
+    def prepare(self, query: np.ndarray) -> np.ndarray:
+        # Inner product of each query slice with every centroid of that slice
+        table = np.einsum("mkd,md->mk", self.codebook, query.reshape(self.subvectors, self.subdimension))
+        return table.ravel()
+
+    def scores(self, start: int, stop: int, table: np.ndarray) -> np.ndarray:
+        return table.take(self.codes[start:stop] + self._offsets).sum(axis=1, dtype=np.float32)
+
+    def score_rows(self, rows: np.ndarray, table: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(rows), dtype=np.float32)
+        for begin in range(0, len(rows), GATHER_ROWS):
+            chunk = rows[begin:begin + GATHER_ROWS]
+            scores[begin:begin + len(chunk)] = table.take(self.codes[chunk] + self._offsets).sum(axis=1)
+        return scores
+
+
+def nearest_centroid(points: np.ndarray, centroids: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+    """Index of the closest centroid for each point, in blocks to bound the distance matrix"""
+    squared = (centroids * centroids).sum(axis=1)
+    nearest = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), block_rows):
+        # ||p - c||^2 without the ||p||^2 term, which does not change the argmin
+        distances = squared - 2.0 * (points[start:start + block_rows] @ centroids.T)
+        nearest[start:start + block_rows] = distances.argmin(axis=1)
+    return nearest
+
+
+def kmeans(points: np.ndarray, count: int, iterations: int, rng) -> np.ndarray:
+    """Lloyd's k-means with ``count`` centroids initialised from random points"""
+    centroids = points[rng.choice(len(points), count, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(points, centroids)
+        sizes = np.bincount(assignment, minlength=count)
+        for d in range(points.shape[1]):
+            centroids[:, d] = np.bincount(assignment, weights=points[:, d], minlength=count)
+        empty = sizes == 0
+        centroids[~empty] /= sizes[~empty, None]
+        # Restart empty clusters from random points rather than leaving them unused
+        centroids[empty] = points[rng.choice(len(points), int(empty.sum()))]
+    return centroids
+
+
+def compact_vectors(mode: str, path: str, dimension: int, pq_subvectors: int = 48,
+                    read_only: bool = False) -> Optional[CompactVectors]:
+    """The compact store for a storage ``mode``; None for plain float32"""
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode {mode!r}, expected one of {', '.join(STORAGE_MODES)}")
+    if mode == "float16":
+        return Float16Vectors(path, dimension, read_only)
+    if mode == "int8":
+        return Int8Vectors(path, dimension, read_only)
+    if mode == "pq":
+        return ProductQuantizedVectors(path, dimension, pq_subvectors, read_only)
+    return None
+
+
+def remove_unused(path: str, compact: Optional[CompactVectors]):
+    """Delete codes of other storage modes; nothing kept them in step with later writes"""
+    keep = set(compact.files()) if compact is not None else set()
+    for store in (Float16Vectors, Int8Vectors, ProductQuantizedVectors):
+        for name in store.files():
+            if name not in keep and os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+
+
+def describe(compact: Optional[CompactVectors], dimension: int) -> Dict:
+    if compact is None:
+        return {"storage": "float32", "bytes_per_vector": dimension * 4}
+    return {"storage": compact.mode, "bytes_per_vector": compact.bytes_per_vector, "trained": compact.ready}
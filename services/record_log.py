@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("jarvis.record_log")
+
+
+class RecordLog:
+    """Append-only JSON-lines file whose records can be read back by byte offset.
+
+    The local and keyword indexes keep each document's metadata here
+    instead of as Python dicts, remembering only where its line starts, so
+    metadata costs a few bytes per document in memory and the text itself
+    lives in the page cache. That cache is shared, which is what lets
+    several read-only processes follow one writer's log cheaply: each calls
+    ``read_new`` to pick up the lines appended since it last looked.
+
+    A line is only consumed once it is complete, so a reader never sees a
+    half-written record. When a writer opens a log whose last line is torn
+    (a crash mid-append), that line is cut off before appending. A complete
+    line that does not parse is skipped with a warning; the records after
+    it are still read and kept.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.offset = 0
+        self._lock = threading.Lock()
+        self._append = None
+        if not read_only:
+            # Created up front so read-only followers can open it before the first write
+            open(path, "ab").close()
+        self._read = open(path, "rb")
+
+    def read_new(self) -> List[Tuple[int, int, Dict]]:
+        """``(offset, length, record)`` for every complete line after the last one read"""
+        if os.fstat(self._read.fileno()).st_size == self.offset:
+            return []
+        records = []
+        self._read.seek(self.offset)
+        for line in self._read:
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                try:
+                    records.append((self.offset, len(line), json.loads(line)))
+                except ValueError:
+                    # Complete lines are never rewritten, so this one is damaged, not half-written
+                    logger.warning("Skipping an unreadable record at byte %d of %s", self.offset, self.path)
+            self.offset += len(line)
+        return records
+
+    def start_appending(self):
+        """Drop a torn last line, then open for appends (writers only)"""
+        if os.path.getsize(self.path) > self.offset:
+            logger.warning("Discarding a torn tail after byte %d of %s", self.offset, self.path)
+            with open(self.path, "r+b") as f:
+                f.truncate(self.offset)
+        self._append = open(self.path, "ab")
+
+    def append(self, records: List[Dict]) -> List[Tuple[int, int]]:
+        """Write records and flush; returns ``(offset, length)`` of each line"""
+        if self._append is None:
+            raise RuntimeError(f"{self.path} is opened read-only")
+        positions = []
+        with self._lock:
+            lines = []
+            for record in records:
+                line = (json.dumps(record) + "\n").encode("utf-8")
+                positions.append((self.offset, len(line)))
+                self.offset += len(line)
+                lines.append(line)
+            self._append.write(b"".join(lines))
+            self._append.flush()
+        return positions
+
+    def read_at(self, offset: int, length: int) -> Dict:
+        return json.loads(os.pread(self._read.fileno(), length, offset))
+
+    def fsync(self):
+        if self._append is not None:
+            self._append.flush()
+            os.fsync(self._append.fileno())
+
+    def close(self):
+        if self._append is not None:
+            self._append.close()
+            self._append = None
+        self._read.close()
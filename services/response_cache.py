@@ -0,0 +1,189 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from services.local_index import EMBEDDING_DIMENSION
+from services.metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("jarvis_response_cache_hits_total", "Chat answers served from the semantic cache")
+CACHE_MISSES = REGISTRY.counter("jarvis_response_cache_misses_total", "Chat questions not found in the semantic cache")
+CACHE_EVICTIONS = REGISTRY.counter(
+    "jarvis_response_cache_evictions_total", "Cached answers removed", ["reason"]
+)
+CACHE_STALE = REGISTRY.counter(
+    "jarvis_response_cache_stale_total", "Answers not cached because their sources changed while they were generated"
+)
+CACHE_SIMILARITY = REGISTRY.histogram(
+    "jarvis_response_cache_similarity",
+    "Cosine similarity of the closest cached question at lookup time",
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99, 1.0),
+)
+
+
+class SemanticResponseCache:
+    """Answer cache keyed by question embedding rather than exact text.
+
+    Entries live in a fixed ``(max_entries, dimension)`` matrix of normalised
+    question embeddings, so a lookup is one matrix-vector product. A question
+    whose closest cached neighbour scores at least ``threshold`` reuses that
+    answer. Entries expire after ``ttl_seconds``, the least recently used one
+    is evicted when the cache is full, and adding knowledge invalidates every
+    answer that cited the affected sources. Answers retrieved under a
+    metadata filter carry its canonical form as ``scope`` and are only
+    reused for questions asked with the same filter.
+
+    An answer whose retrieval started before an invalidation of one of its
+    sources may be stale by the time it is stored. Callers take ``epoch()``
+    before retrieving and pass it to ``store``, which refuses such answers.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 1000,
+                 dimension: int = EMBEDDING_DIMENSION):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((self.max_entries, dimension), dtype=np.float32)
+        self._alive = np.zeros(self.max_entries, dtype=bool)
+        self._entries: List[Optional[Dict]] = [None] * self.max_entries
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        # Invalidations are numbered; each source remembers the last one that covered it
+        self._epoch = 0
+        self._source_epochs: Dict[str, int] = {}
+        self._cleared_epoch = 0
+
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, slot: int, reason: str):
+        self._alive[slot] = False
+        self._entries[slot] = None
+        self._free.append(slot)
+        CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    def lookup(self, embedding, scope: Optional[str] = None) -> Optional[Dict]:
+        """Return ``{"query", "response", "sources", "similarity"}`` for a close enough cached question"""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            candidates = self._alive.copy()
+            for slot in np.flatnonzero(candidates):
+                if self._entries[slot]["scope"] != scope:
+                    candidates[slot] = False
+            if not candidates.any():
+                CACHE_MISSES.inc()
+                return None
+            scores = self._vectors @ query
+            scores[~candidates] = -np.inf
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            CACHE_SIMILARITY.observe(max(similarity, 0.0))
+
+            entry = self._entries[slot]
+            if now - entry["created"] > self.ttl_seconds:
+                self._remove(slot, "ttl")
+                CACHE_MISSES.inc()
+                return None
+            if similarity < self.threshold:
+                CACHE_MISSES.inc()
+                return None
+
+            entry["last_used"] = now
+            CACHE_HITS.inc()
+            return {
+                "query": entry["query"],
+                "response": entry["response"],
+                "sources": list(entry["sources"]),
+                "similarity": similarity,
+            }
+
+    def epoch(self) -> int:
+        """The current invalidation epoch, to pass to ``store`` for an answer about to be generated"""
+        with self._lock:
+            return self._epoch
+
+    def _stale(self, sources: List[str], epoch: int) -> bool:
+        if self._cleared_epoch > epoch:
+            return True
+        if not sources:
+            # Answers without context are dropped by every invalidation
+            return self._epoch > epoch
+        return any(self._source_epochs.get(source, 0) > epoch for source in sources)
+
+    def store(self, query: str, embedding, response: str, sources: List[str], scope: Optional[str] = None,
+              epoch: Optional[int] = None) -> bool:
+        """Remember an answer for future near-duplicate questions.
+
+        With ``epoch`` (see ``epoch()``) the answer is not stored if its sources were invalidated since;
+        returns whether it was stored.
+        """
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if epoch is not None and self._stale(sources, epoch):
+                CACHE_STALE.inc()
+                return False
+            if not self._free:
+                self._evict_one(now)
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._alive[slot] = True
+            self._entries[slot] = {
+                "query": query,
+                "response": response,
+                "sources": list(sources),
+                "source_set": set(sources),
+                "scope": scope,
+                "created": now,
+                "last_used": now,
+            }
+        return True
+
+    def _evict_one(self, now: float):
+        """Free a slot: an expired entry if there is one, otherwise the least recently used"""
+        oldest_slot, oldest_used = None, None
+        for slot, entry in enumerate(self._entries):
+            if entry is None:
+                continue
+            if now - entry["created"] > self.ttl_seconds:
+                self._remove(slot, "ttl")
+                return
+            if oldest_used is None or entry["last_used"] < oldest_used:
+                oldest_slot, oldest_used = slot, entry["last_used"]
+        self._remove(oldest_slot, "size")
+
+    def invalidate_sources(self, sources: Iterable[str]) -> int:
+        """Drop answers that cited any of ``sources``.
+
+        Answers generated without any retrieved context are dropped too, since
+        the new knowledge may now be relevant to them.
+        """
+        sources = set(sources)
+        removed = 0
+        with self._lock:
+            self._epoch += 1
+            for source in sources:
+                self._source_epochs[source] = self._epoch
+            for slot, entry in enumerate(self._entries):
+                if entry is None:
+                    continue
+                if not entry["source_set"] or entry["source_set"] & sources:
+                    self._remove(slot, "invalidated")
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cleared_epoch = self._epoch
+            for slot, entry in enumerate(self._entries):
+                if entry is not None:
+                    self._remove(slot, "invalidated")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": int(self._alive.sum()), "max_entries": self.max_entries}
@@ -0,0 +1,439 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from services.admission import BATCH, AdmissionRejected
+from services.metrics import REGISTRY
+from services.prompt_builder import BuiltPrompt
+
+logger = logging.getLogger("jarvis.sessions")
+
+SESSIONS = REGISTRY.gauge("jarvis_sessions", "Conversation sessions in the session store")
+SESSION_BYTES = REGISTRY.gauge(
+    "jarvis_session_memory_bytes", "Bytes of conversation state (summaries and recent turns) held for all sessions"
+)
+SESSION_EVICTIONS = REGISTRY.counter("jarvis_session_evictions_total", "Sessions removed from the store", ["reason"])
+SUMMARIES = REGISTRY.counter(
+    "jarvis_session_summaries_total", "Background folds of older turns into a session summary", ["outcome"]
+)
+TURNS_DROPPED = REGISTRY.counter(
+    "jarvis_session_turns_dropped_total", "Older turns discarded unsummarized because summarization fell behind"
+)
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+# Metadata marking turns indexed for long-term recall, so knowledge retrieval can leave them out
+CONVERSATION_KIND = "conversation"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You keep a running summary of a conversation between a user and Jarvis, an AI assistant. "
+    "Rewrite the summary so it also covers the new turns. Keep names, facts, preferences, decisions "
+    "and open questions; drop greetings and filler. Reply with the summary only."
+)
+
+
+def valid_session_id(session_id: str) -> bool:
+    return bool(SESSION_ID.match(session_id or ""))
+
+
+def turn_text(turn: Dict) -> str:
+    return f"User: {turn['user']}\nJarvis: {turn['assistant']}"
+
+
+class SessionStore:
+    """SQLite store of conversation sessions: a running summary plus the turns not yet folded into it.
+
+    Turns are numbered in order; folding replaces every turn up to a number
+    with a new summary, and only applies if no other fold got there first.
+    Sessions idle for ``ttl_seconds`` expire, and past ``max_sessions`` the
+    least recently used are evicted. A file-backed store survives restarts
+    and is shared by serve.py workers, so consecutive turns of a session can
+    land on different workers. Without a ``path`` it lives in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_sessions: int = 10000, ttl_seconds: float = 86400.0):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " summary TEXT NOT NULL DEFAULT '', summarized_through INTEGER NOT NULL DEFAULT -1,"
+            " summarized_turns INTEGER NOT NULL DEFAULT 0, turns TEXT NOT NULL DEFAULT '[]',"
+            " turns_total INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+        self._refresh_gauges()
+
+    def _select(self, session_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT id, created, last_used, summary, summarized_through, summarized_turns, turns, turns_total, bytes"
+            " FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "created": row[1], "last_used": row[2], "summary": row[3],
+            "summarized_through": row[4], "summarized_turns": row[5], "turns": json.loads(row[6]),
+            "turns_total": row[7], "memory_bytes": row[8],
+        }
+
+    def _expired(self, session: Dict, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - session["last_used"] > self.ttl_seconds
+
+    def _write(self, session: Dict):
+        turns = json.dumps(session["turns"], separators=(",", ":"))
+        session["memory_bytes"] = (len(session["id"]) + len(session["summary"].encode("utf-8"))
+                                   + len(turns.encode("utf-8")))
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions"
+            " (id, created, last_used, summary, summarized_through, summarized_turns, turns, turns_total, bytes)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (session["id"], session["created"], session["last_used"], session["summary"],
+             session["summarized_through"], session["summarized_turns"], turns, session["turns_total"],
+             session["memory_bytes"]),
+        )
+
+    def _transaction(self, work):
+        """Run ``work()`` in a write transaction; BEGIN IMMEDIATE serialises writers across processes"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """The session, or None if it does not exist or has expired"""
+        with self._lock:
+            session = self._select(session_id)
+        if session and self._expired(session, time.time()):
+            return None
+        return session
+
+    def create(self, session_id: str) -> Tuple[Dict, List[str]]:
+        """Start an empty session (keeping an existing one) and return it with any sessions evicted to make room"""
+        now = time.time()
+
+        def work():
+            session = self._select(session_id)
+            if session is None or self._expired(session, now):
+                session = _new_session(session_id, now)
+                self._write(session)
+            return session
+
+        session = self._transaction(work)
+        return session, self._evict()
+
+    def append(self, session_id: str, user: str, assistant: str, max_turns: int) -> Tuple[Dict, List[str]]:
+        """Add a turn, keeping at most ``max_turns`` unsummarized ones, and return the session with any evicted ids"""
+        now = time.time()
+
+        def work():
+            session = self._select(session_id)
+            if session is None or self._expired(session, now):
+                session = _new_session(session_id, now)
+            session["turns"].append({"n": session["turns_total"], "user": user, "assistant": assistant, "at": now})
+            session["turns_total"] += 1
+            session["last_used"] = now
+            overflow = len(session["turns"]) - max_turns
+            if overflow > 0:
+                # Summarization is not keeping up; the oldest turns go rather than letting the session grow
+                session["turns"] = session["turns"][overflow:]
+                TURNS_DROPPED.inc(overflow)
+            self._write(session)
+            return session
+
+        session = self._transaction(work)
+        return session, self._evict()
+
+    def fold(self, session_id: str, summary: str, through: int, expected_through: int) -> bool:
+        """Replace turns numbered up to ``through`` with ``summary``, unless the session changed summary meanwhile"""
+        def work():
+            session = self._select(session_id)
+            if session is None or session["summarized_through"] != expected_through:
+                return False
+            folded = [turn for turn in session["turns"] if turn["n"] <= through]
+            session["turns"] = [turn for turn in session["turns"] if turn["n"] > through]
+            session["summary"] = summary
+            session["summarized_through"] = through
+            session["summarized_turns"] += len(folded)
+            self._write(session)
+            return True
+
+        return self._transaction(work)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+        if deleted:
+            SESSION_EVICTIONS.labels(reason="deleted").inc()
+            self._refresh_gauges()
+        return deleted
+
+    def expire(self) -> List[str]:
+        """Remove sessions idle for longer than the TTL and return their ids"""
+        if self.ttl_seconds <= 0:
+            return []
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            ids = [row[0] for row in self._db.execute("SELECT id FROM sessions WHERE last_used < ?", (cutoff,))]
+            self._db.executemany("DELETE FROM sessions WHERE id = ?", [(session_id,) for session_id in ids])
+        if ids:
+            SESSION_EVICTIONS.labels(reason="expired").inc(len(ids))
+        self._refresh_gauges()
+        return ids
+
+    def _evict(self) -> List[str]:
+        """Drop the least recently used sessions beyond ``max_sessions``"""
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_sessions,)
+            )]
+            self._db.executemany("DELETE FROM sessions WHERE id = ?", [(session_id,) for session_id in ids])
+        if ids:
+            SESSION_EVICTIONS.labels(reason="capacity").inc(len(ids))
+        self._refresh_gauges()
+        return ids
+
+    def _refresh_gauges(self):
+        stats = self.stats()
+        SESSIONS.set(stats["sessions"])
+        SESSION_BYTES.set(stats["memory_bytes"])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count, total = self._db.execute("SELECT count(*), coalesce(sum(bytes), 0) FROM sessions").fetchone()
+        return {"sessions": count, "memory_bytes": total, "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds, "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _new_session(session_id: str, now: float) -> Dict:
+    return {"id": session_id, "created": now, "last_used": now, "summary": "", "summarized_through": -1,
+            "summarized_turns": 0, "turns": [], "turns_total": 0, "memory_bytes": 0}
+
+
+class ConversationMemory:
+    """Server-side conversation state for chat sessions, with a bounded cost per turn.
+
+    Each session keeps its latest ``window_turns`` turns verbatim and a
+    running summary of everything older. Once ``summarize_batch`` turns have
+    left the window they are folded into the summary in the background, at
+    batch priority, from the previous summary and those turns alone, so
+    neither the prompt nor the summarization work grows with the length of
+    the conversation. With ``recall`` on, every turn is also indexed into the
+    vector store under the session's id, and later questions in the session
+    retrieve the relevant old turns next to the knowledge base.
+    """
+
+    def __init__(self, store: SessionStore, llm_service, vector_service, write_queue=None, window_turns: int = 6,
+                 summarize_batch: int = 4, summary_tokens: int = 256, recall: bool = False, recall_top_k: int = 3):
+        self.store = store
+        self.llm_service = llm_service
+        self.vector_service = vector_service
+        self.write_queue = write_queue
+        self.window_turns = max(1, window_turns)
+        self.summarize_batch = max(1, summarize_batch)
+        self.summary_tokens = summary_tokens
+        self.recall_enabled = recall
+        self.recall_top_k = recall_top_k
+        # Room for summarization to fall behind before the oldest turns are dropped
+        self.max_turns = self.window_turns + 4 * self.summarize_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        self._summarizing = set()
+        self._tasks = set()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        return await self._run(self.store.get, session_id)
+
+    async def create(self, session_id: str) -> Dict:
+        session, evicted = await self._run(self.store.create, session_id)
+        self._forget_recall(evicted)
+        return session
+
+    def history(self, session: Optional[Dict]) -> Optional[Dict]:
+        """What the prompt builder needs from a session, or None if there is nothing to remember yet"""
+        if not session or not (session["summary"] or session["turns"]):
+            return None
+        return {"summary": session["summary"], "turns": session["turns"]}
+
+    def retrieval_query(self, message: str, session: Optional[Dict]) -> str:
+        """Follow-ups ("and the second one?") say little on their own; the previous question supplies the topic"""
+        if not session or not session["turns"]:
+            return message
+        return f"{session['turns'][-1]['user']}\n{message}"
+
+    def knowledge_filters(self, filters: Optional[Dict]) -> Optional[Dict]:
+        """Filters for knowledge retrieval that leave out turns indexed for recall"""
+        if not self.recall_enabled:
+            return filters
+        exclude = {"kind": {"$ne": CONVERSATION_KIND}}
+        return {"$and": [filters, exclude]} if filters else exclude
+
+    async def recall(self, session_id: str, query: str, embedding, session: Optional[Dict] = None) -> List[Dict]:
+        """Earlier turns of this session relevant to the question, leaving out those already in the prompt"""
+        if not self.recall_enabled or not self.vector_service.index:
+            return []
+        documents = await self.vector_service.search_similar(
+            query, top_k=self.recall_top_k, query_embedding=embedding,
+            filters={"session_id": session_id, "kind": CONVERSATION_KIND},
+        )
+        verbatim = {turn_text(turn) for turn in (session or {}).get("turns", [])}
+        return [document for document in documents if document.get("text") not in verbatim]
+
+    async def record(self, session_id: str, message: str, response: str) -> Dict:
+        """Add a finished turn, starting a background summarization once enough turns have left the window"""
+        session, evicted = await self._run(self.store.append, session_id, message, response, self.max_turns)
+        self._forget_recall(evicted)
+        if len(session["turns"]) - self.window_turns >= self.summarize_batch and session_id not in self._summarizing:
+            self._summarizing.add(session_id)
+            self._spawn(self._summarize(session_id))
+        if self.recall_enabled and self.vector_service.index:
+            self._spawn(self._index_turn(session_id, session["turns"][-1]))
+        return session
+
+    async def forget(self, session_id: str) -> bool:
+        deleted = await self._run(self.store.delete, session_id)
+        self._forget_recall([session_id])
+        return deleted
+
+    async def expire(self) -> List[str]:
+        expired = await self._run(self.store.expire)
+        self._forget_recall(expired)
+        return expired
+
+    async def expire_periodically(self, interval: float = 60.0):
+        """Background task: remove sessions that have gone idle for longer than the TTL"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.expire()
+            except Exception:
+                logger.exception("Expiring sessions failed")
+
+    def describe(self, session: Dict) -> Dict:
+        """A session's state and what it costs: stored bytes and the tokens its history adds to a prompt"""
+        builder = self.llm_service.prompt_builder
+        conversation, _ = builder.conversation(self.history(session))
+        return {
+            "session_id": session["id"],
+            "created": session["created"],
+            "last_used": session["last_used"],
+            "turns": session["turns_total"],
+            "summarized_turns": session["summarized_turns"],
+            "pending_turns": len(session["turns"]),
+            "summary": session["summary"],
+            "summary_tokens": builder.counter.count(session["summary"]) if session["summary"] else 0,
+            "history_tokens": builder.counter.count(conversation) if conversation else 0,
+            "memory_bytes": session["memory_bytes"],
+            "recent": [{"user": turn["user"], "assistant": turn["assistant"], "at": turn["at"]}
+                       for turn in session["turns"][-self.window_turns:]],
+        }
+
+    def stats(self) -> Dict:
+        return {**self.store.stats(), "window_turns": self.window_turns, "summarize_batch": self.summarize_batch,
+                "summary_tokens": self.summary_tokens, "recall": self.recall_enabled}
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session_id: str):
+        """Fold the turns that have left the window into the session's running summary"""
+        try:
+            session = await self.get(session_id)
+            if session is None:
+                return
+            folding = session["turns"][:len(session["turns"]) - self.window_turns]
+            if len(folding) < self.summarize_batch:
+                return
+            try:
+                summary = await self.llm_service.complete(
+                    "", priority=BATCH, prompt=self._summary_prompt(session["summary"], folding)
+                )
+            except AdmissionRejected:
+                # The backend is busy with people waiting; the next turn tries again
+                SUMMARIES.labels(outcome="deferred").inc()
+                return
+            except Exception as e:
+                logger.warning("Summarizing session %s failed: %s", session_id, e)
+                SUMMARIES.labels(outcome="failed").inc()
+                return
+            summary = self.llm_service.prompt_builder.truncate(summary.strip(), self.summary_tokens)
+            folded = await self._run(
+                self.store.fold, session_id, summary, folding[-1]["n"], session["summarized_through"]
+            )
+            # Another worker folded these turns first
+            SUMMARIES.labels(outcome="folded" if folded else "stale").inc()
+        finally:
+            self._summarizing.discard(session_id)
+
+    def _summary_prompt(self, summary: str, turns: List[Dict]) -> BuiltPrompt:
+        builder = self.llm_service.prompt_builder
+        # A single long answer should not crowd the rest out of the summarization prompt
+        per_turn = max(64, 4 * self.summary_tokens // len(turns))
+        blocks = "\n\n".join(builder.truncate(turn_text(turn), per_turn) for turn in turns)
+        system = f"{SUMMARY_SYSTEM_PROMPT} Use at most {max(1, self.summary_tokens * 3 // 4)} words."
+        user = f"Current summary:\n{summary or '(none yet)'}\n\nNew turns:\n{blocks}"
+        return BuiltPrompt(system=system, user=user, system_tokens=builder.counter.count(system),
+                           user_tokens=builder.counter.count(user))
+
+    async def _index_turn(self, session_id: str, turn: Dict):
+        metadata = {"source": f"session:{session_id}", "session_id": session_id, "kind": CONVERSATION_KIND}
+        try:
+            if self.write_queue:
+                await self.write_queue.submit([turn_text(turn)], [metadata])
+            else:
+                await self.vector_service.add_document(turn_text(turn), metadata)
+        except Exception as e:
+            logger.warning("Indexing a turn of session %s for recall failed: %s", session_id, e)
+
+    def _forget_recall(self, session_ids: List[str]):
+        """Delete the recall documents of sessions that are gone"""
+        manifest = self.vector_service.manifest
+        if not self.recall_enabled or not session_ids or manifest is None:
+            return
+
+        async def delete():
+            ids = set()
+            for session_id in session_ids:
+                ids.update(await self.vector_service._run_in(
+                    self.vector_service.index_executor, manifest.ids_for_source, f"session:{session_id}"
+                ))
+            if ids:
+                await self.vector_service.delete_documents(list(ids))
+
+        self._spawn(delete())
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self.store.close()
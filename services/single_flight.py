@@ -0,0 +1,200 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from services.metrics import REGISTRY
+
+COALESCED = REGISTRY.counter(
+    "jarvis_coalesced_requests_total", "Requests that joined an identical request already in flight", ["flight"]
+)
+IN_FLIGHT_KEYS = REGISTRY.gauge(
+    "jarvis_single_flight_keys", "Distinct requests currently being computed", ["flight"]
+)
+
+
+class _Call:
+    """One shared execution and the number of callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts ``factory()`` as a task; callers that
+    arrive while it is running await the same task and get the same result
+    (or exception). The work is cancelled only when every caller has gone
+    away, so one impatient client does not fail the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._keys = IN_FLIGHT_KEYS.labels(flight=name)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._keys.set(len(self._calls))
+        else:
+            COALESCED.labels(flight=self.name).inc()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+            self._keys.set(len(self._calls))
+        if not call.task.cancelled():
+            call.task.exception()  # retrieved here so an unawaited failure is not logged as lost
+
+
+class TokenBroadcast:
+    """Fans one token stream out to any number of readers.
+
+    The producer calls ``open()`` once it knows the ``sources`` and any other
+    ``details`` for the final event (or ``fail()``,
+    e.g. on an admission rejection), then ``publish()`` per token and
+    ``close()`` at the end.
+    Readers that attach late replay the tokens they missed.
+    """
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.sources: List[str] = []
+        self.details: Dict[str, Any] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.opened = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    def open(self, sources: List[str], **details):
+        if not self.opened.done():
+            self.sources = list(sources)
+            self.details = details
+            self.opened.set_result(True)
+
+    def fail(self, error: BaseException):
+        """Report an error that happened before streaming started"""
+        if not self.opened.done():
+            self.opened.set_exception(error)
+            self.opened.exception()  # readers may all be gone; do not log it as unretrieved
+        self.close(error)
+
+    def cancel(self):
+        self.opened.cancel()
+        self.close(asyncio.CancelledError())
+
+    def publish(self, token: str):
+        self.tokens.append(token)
+        self._wake()
+
+    def close(self, error: Optional[BaseException] = None):
+        if not self.done:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def _wake(self):
+        # Readers hold the previous event, so setting it wakes exactly the current waiters
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self):
+        """Yield every token from the start, then new ones as they arrive"""
+        position = 0
+        while True:
+            while position < len(self.tokens):
+                yield self.tokens[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class Subscription:
+    """A reader's hold on a shared stream; release() is idempotent"""
+
+    def __init__(self, stream: "_Stream"):
+        self._stream = stream
+        self.broadcast = stream.broadcast
+        self._released = False
+
+    async def ready(self) -> TokenBroadcast:
+        """Wait until the stream has started; raises if the producer failed before its first token"""
+        await asyncio.shield(self.broadcast.opened)
+        return self.broadcast
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._stream.unsubscribe()
+
+
+class _Stream:
+    def __init__(self, broadcast: TokenBroadcast):
+        self.broadcast = broadcast
+        self.task: Optional[asyncio.Task] = None
+        self.readers = 0
+
+    def unsubscribe(self):
+        self.readers -= 1
+        if not self.readers and not self.task.done():
+            self.task.cancel()
+
+
+class StreamingSingleFlight:
+    """Single-flight for token streams: followers attach to the leader's stream.
+
+    ``subscribe(key, producer)`` starts ``producer(broadcast)`` for the first
+    caller of a key and hands later callers the same broadcast. The producer
+    keeps running while at least one subscription is held, so the leader's
+    client disconnecting does not cut off its followers.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._streams: Dict[Hashable, _Stream] = {}
+        self._keys = IN_FLIGHT_KEYS.labels(flight=name)
+
+    def subscribe(self, key: Hashable, producer: Callable[[TokenBroadcast], Awaitable[None]]) -> Subscription:
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = _Stream(TokenBroadcast())
+            stream.task = asyncio.ensure_future(self._produce(key, stream, producer))
+            self._keys.set(len(self._streams))
+        else:
+            COALESCED.labels(flight=self.name).inc()
+        stream.readers += 1
+        return Subscription(stream)
+
+    async def _produce(self, key: Hashable, stream: _Stream, producer):
+        broadcast = stream.broadcast
+        try:
+            await producer(broadcast)
+            broadcast.open([])
+            broadcast.close()
+        except asyncio.CancelledError:
+            broadcast.cancel()
+            raise
+        except Exception as e:
+            broadcast.fail(e)
+        finally:
+            # Later requests start a fresh stream (and normally hit the answer cache)
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+                self._keys.set(len(self._streams))
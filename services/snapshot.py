@@ -0,0 +1,299 @@
+import asyncio
+import json
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.metrics import REGISTRY
+
+SNAPSHOT_DOCUMENTS = REGISTRY.counter(
+    "jarvis_snapshot_documents_total", "Documents written to or restored from knowledge base snapshots", ["direction"]
+)
+
+MAGIC = b"JARVSNAP"
+FORMAT_VERSION = 1
+# Format version and the length of the JSON header that follows
+HEADER = struct.Struct("<II")
+CRC = struct.Struct("<I")
+# Tag, rows, flags, vector block bytes, record block bytes, vector block CRC32, record block CRC32
+CHUNK = struct.Struct("<4sIIQQII")
+CHUNK_TAG = b"CHNK"
+# Tag, documents, chunks: written last, so a truncated file is detected rather than half-restored
+FOOTER = struct.Struct("<4sQQ")
+FOOTER_TAG = b"DONE"
+RECORD_LENGTH = struct.Struct("<I")
+
+COMPRESSED_RECORDS = 1
+VECTOR_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+Batch = Tuple[List[str], np.ndarray, List[Dict]]
+
+
+class SnapshotError(ValueError):
+    """A snapshot that is not one, is damaged, or does not fit the target index"""
+
+
+class SnapshotWriter:
+    """Streams documents into a chunked, checksummed binary snapshot.
+
+    The file is a header (magic, format version and a JSON description:
+    dimension, vector dtype, embedding model) followed by chunks of up to
+    ``chunk_rows`` documents and a footer with the totals. Each chunk holds
+    a raw little-endian vector block, ready for ``np.frombuffer``, and a
+    block of length-prefixed JSON ``[id, metadata]`` records (the text is in
+    the metadata), zlib-compressed unless ``compress`` is off. Both blocks
+    carry a CRC32. Only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, f: BinaryIO, dimension: int, embedding_model: str, dtype: str = "float32",
+                 compress: bool = True, chunk_rows: int = 4096, source: str = ""):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+        self.f = f
+        self.dimension = dimension
+        self.dtype = VECTOR_DTYPES[dtype]
+        self.compress = compress
+        self.chunk_rows = max(1, chunk_rows)
+        self.documents = 0
+        self.chunks = 0
+        self.bytes = 0
+        self._ids: List[str] = []
+        self._vectors: List[np.ndarray] = []
+        self._metadatas: List[Dict] = []
+        self._buffered = 0
+
+        header = json.dumps({
+            "format": FORMAT_VERSION, "dimension": dimension, "dtype": dtype, "embedding_model": embedding_model,
+            "source": source, "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }).encode("utf-8")
+        self._write(MAGIC + HEADER.pack(FORMAT_VERSION, len(header)) + header + CRC.pack(zlib.crc32(header)))
+
+    def _write(self, data: bytes):
+        self.f.write(data)
+        self.bytes += len(data)
+
+    def write(self, ids: List[str], vectors: np.ndarray, metadatas: List[Dict]):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimension)
+        start = 0
+        while start < len(ids):
+            take = min(len(ids) - start, self.chunk_rows - self._buffered)
+            self._ids.extend(ids[start:start + take])
+            self._vectors.append(vectors[start:start + take])
+            self._metadatas.extend(metadatas[start:start + take])
+            self._buffered += take
+            start += take
+            if self._buffered >= self.chunk_rows:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        vectors = np.concatenate(self._vectors).astype(self.dtype, copy=False).tobytes()
+        records = b"".join(
+            RECORD_LENGTH.pack(len(record)) + record
+            for record in (json.dumps([doc_id, metadata], separators=(",", ":")).encode("utf-8")
+                           for doc_id, metadata in zip(self._ids, self._metadatas))
+        )
+        flags = 0
+        if self.compress:
+            records = zlib.compress(records, 1)
+            flags |= COMPRESSED_RECORDS
+        self._write(CHUNK.pack(CHUNK_TAG, self._buffered, flags, len(vectors), len(records),
+                               zlib.crc32(vectors), zlib.crc32(records)))
+        self._write(vectors)
+        self._write(records)
+        SNAPSHOT_DOCUMENTS.labels(direction="export").inc(self._buffered)
+        self.documents += self._buffered
+        self.chunks += 1
+        self._ids, self._vectors, self._metadatas = [], [], []
+        self._buffered = 0
+
+    def close(self) -> Dict:
+        """Write the last chunk and the footer; the file object stays open"""
+        self._flush()
+        self._write(FOOTER.pack(FOOTER_TAG, self.documents, self.chunks))
+        self.f.flush()
+        return {"documents": self.documents, "chunks": self.chunks, "bytes": self.bytes}
+
+
+class SnapshotReader:
+    """Reads a snapshot chunk by chunk, verifying every checksum and the footer totals"""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        if self._read(len(MAGIC)) != MAGIC:
+            raise SnapshotError("Not a Jarvis snapshot")
+        version, length = HEADER.unpack(self._read(HEADER.size))
+        if version > FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format {version} is newer than this version of Jarvis reads")
+        header = self._read(length)
+        if CRC.unpack(self._read(CRC.size))[0] != zlib.crc32(header):
+            raise SnapshotError("Snapshot header is corrupt")
+        self.header: Dict = json.loads(header)
+        self.dimension = self.header["dimension"]
+        if self.header.get("dtype") not in VECTOR_DTYPES:
+            raise SnapshotError(f"Unknown vector dtype {self.header.get('dtype')!r} in snapshot")
+        self.dtype = VECTOR_DTYPES[self.header["dtype"]]
+
+    def _read(self, size: int) -> bytes:
+        data = self.f.read(size)
+        if len(data) != size:
+            raise SnapshotError("Snapshot is truncated")
+        return data
+
+    def chunks(self) -> Iterator[Batch]:
+        """``(ids, float32 vectors, metadatas)`` per chunk"""
+        documents = chunks = 0
+        while True:
+            tag = self._read(4)
+            if tag == FOOTER_TAG:
+                _, expected_documents, expected_chunks = FOOTER.unpack(tag + self._read(FOOTER.size - 4))
+                if (documents, chunks) != (expected_documents, expected_chunks):
+                    raise SnapshotError(f"Snapshot footer expects {expected_documents} documents, found {documents}")
+                return
+            if tag != CHUNK_TAG:
+                raise SnapshotError(f"Unexpected block {tag!r} after {documents} documents")
+            _, rows, flags, vector_bytes, record_bytes, vector_crc, record_crc = CHUNK.unpack(
+                tag + self._read(CHUNK.size - 4)
+            )
+            vectors = self._read(vector_bytes)
+            records = self._read(record_bytes)
+            if zlib.crc32(vectors) != vector_crc or zlib.crc32(records) != record_crc:
+                raise SnapshotError(f"Checksum mismatch in chunk {chunks} (documents {documents}-{documents + rows})")
+            if vector_bytes != rows * self.dimension * self.dtype.itemsize:
+                raise SnapshotError(f"Chunk {chunks} has {vector_bytes} bytes of vectors for {rows} rows")
+            if flags & COMPRESSED_RECORDS:
+                records = zlib.decompress(records)
+            ids, metadatas = _parse_records(records, rows)
+            matrix = np.frombuffer(vectors, dtype=self.dtype).reshape(rows, self.dimension).astype(np.float32)
+            documents += rows
+            chunks += 1
+            yield ids, matrix, metadatas
+
+
+def _parse_records(block: bytes, rows: int) -> Tuple[List[str], List[Dict]]:
+    ids, metadatas = [], []
+    view = memoryview(block)
+    offset = 0
+    for _ in range(rows):
+        (length,) = RECORD_LENGTH.unpack_from(view, offset)
+        offset += RECORD_LENGTH.size
+        doc_id, metadata = json.loads(bytes(view[offset:offset + length]))
+        offset += length
+        ids.append(doc_id)
+        metadatas.append(metadata)
+    if offset != len(block):
+        raise SnapshotError("Record block length does not match its row count")
+    return ids, metadatas
+
+
+def export_snapshot(vector_service, f: BinaryIO, dtype: str = "float32", compress: bool = True,
+                    chunk_rows: int = 4096, progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Write every document in the vector store to ``f`` as a snapshot, without embedding anything"""
+    started = time.perf_counter()
+    if isinstance(vector_service.index, LocalVectorIndex):
+        source = f"local:{vector_service.index.path}"
+    else:
+        source = f"pinecone:{vector_service.index_name}"
+    writer = SnapshotWriter(f, EMBEDDING_DIMENSION, vector_service.embedding_model_name, dtype=dtype,
+                            compress=compress, chunk_rows=chunk_rows, source=source)
+    for ids, vectors, metadatas in vector_service.iter_documents(chunk_rows):
+        writer.write(ids, vectors, metadatas)
+        if progress:
+            progress(writer.documents)
+    stats = writer.close()
+    return {**stats, "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def import_snapshot(vector_service, f: BinaryIO, upsert_batch_size: int = 100, max_parallel_upserts: int = 8,
+                          skip_existing: bool = True, progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Load a snapshot into the vector store with its stored vectors: nothing is re-embedded.
+
+    Chunks are read and verified off the event loop while the previous one
+    is being upserted, in slices of ``upsert_batch_size`` with at most
+    ``max_parallel_upserts`` requests in flight. With ``skip_existing``
+    documents the manifest already lists with the same metadata are left
+    alone, so an interrupted restore can simply be run again.
+    """
+    started = time.perf_counter()
+    reader = SnapshotReader(f)
+    _check_compatible(reader.header, vector_service)
+    stats = {"documents": 0, "restored": 0, "skipped": 0}
+    slots = asyncio.Semaphore(max_parallel_upserts)
+    pending = set()
+    errors: List[Exception] = []
+    loop = asyncio.get_running_loop()
+    chunks = reader.chunks()
+
+    async def upsert(ids, vectors, metadatas):
+        try:
+            texts = [metadata.pop("text", "") for metadata in metadatas]
+            await vector_service.upsert_embeddings(texts, vectors, metadatas, ids=ids)
+            # Counted once written, so a failed restore never reports documents it lost
+            stats["restored"] += len(ids)
+            SNAPSHOT_DOCUMENTS.labels(direction="import").inc(len(ids))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, next, chunks, None)
+            if batch is None:
+                break
+            ids, vectors, metadatas = batch
+            stats["documents"] += len(ids)
+            if skip_existing:
+                # Documents stored with other metadata are rewritten; the snapshot has their vectors
+                known, _ = await vector_service.indexed_ids(ids, metadatas)
+                if known:
+                    keep = [i for i, doc_id in enumerate(ids) if doc_id not in known]
+                    ids, vectors, metadatas = [ids[i] for i in keep], vectors[keep], [metadatas[i] for i in keep]
+                    stats["skipped"] += len(known)
+            for start in range(0, len(ids), upsert_batch_size):
+                stop = start + upsert_batch_size
+                await slots.acquire()
+                task = asyncio.ensure_future(upsert(ids[start:stop], vectors[start:stop], metadatas[start:stop]))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if errors:
+                raise errors[0]
+            if progress:
+                progress(stats)
+        if pending:
+            await asyncio.gather(*pending)
+        if errors:
+            raise errors[0]
+    finally:
+        for task in pending:
+            task.cancel()
+
+    elapsed = time.perf_counter() - started
+    return {**stats, "seconds": round(elapsed, 3),
+            "documents_per_second": round(stats["documents"] / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+def _check_compatible(header: Dict, vector_service):
+    if header["dimension"] != EMBEDDING_DIMENSION:
+        raise SnapshotError(f"Snapshot vectors have {header['dimension']} dimensions, "
+                            f"the index expects {EMBEDDING_DIMENSION}")
+    if header.get("embedding_model") != vector_service.embedding_model_name:
+        raise SnapshotError(f"Snapshot was embedded with {header.get('embedding_model')}, "
+                            f"this index uses {vector_service.embedding_model_name}")
+
+
+def verify_snapshot(f: BinaryIO) -> Dict:
+    """Read a whole snapshot, checking every checksum; returns its header and totals"""
+    reader = SnapshotReader(f)
+    documents = chunks = 0
+    for ids, _, _ in reader.chunks():
+        documents += len(ids)
+        chunks += 1
+    return {**reader.header, "documents": documents, "chunks": chunks}
+
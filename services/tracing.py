@@ -0,0 +1,212 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger("jarvis.trace")
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "jarvis_stage_seconds", "Latency of each request-handling stage", ["stage"]
+)
+REQUEST_LATENCY = REGISTRY.histogram(
+    "jarvis_http_request_seconds", "End-to-end HTTP request latency, including streamed bodies", ["method", "path"]
+)
+REQUESTS = REGISTRY.counter(
+    "jarvis_http_requests_total", "HTTP requests handled", ["method", "path", "status"]
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "jarvis_http_requests_in_flight", "HTTP requests currently being handled"
+)
+PROFILES_WRITTEN = REGISTRY.counter(
+    "jarvis_profiles_written_total", "Profiles dumped for slow requests"
+)
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("jarvis_trace", default=None)
+
+
+class Trace:
+    """Spans and attributes collected while handling one request"""
+
+    def __init__(self, name: str, request_id: Optional[str] = None):
+        self.name = name
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans: List[Dict] = []
+        self.attributes: Dict = {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "duration_ms": round((self.duration or 0.0) * 1000, 2),
+            "spans": self.spans,
+            "attributes": self.attributes,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Time one stage: always feeds the stage histogram, and the request trace if there is one"""
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        if trace is not None:
+            entry = {
+                "stage": stage,
+                "start_ms": round((started - trace.started) * 1000, 2),
+                "duration_ms": round(elapsed * 1000, 2),
+            }
+            if attributes:
+                entry.update(attributes)
+            trace.spans.append(entry)
+
+
+def annotate(**attributes):
+    """Attach attributes (token counts, document counts, ...) to the current request trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+class _SlowRequestProfiler:
+    """Profiles a sample of requests and keeps the profiles of slow ones.
+
+    Uses pyinstrument when installed (it understands async code), otherwise
+    cProfile. Only one request is profiled at a time because the profilers
+    hook the whole interpreter, which also bounds the overhead.
+    """
+
+    def __init__(self, threshold_ms: float, sample_rate: float, directory: str):
+        self.threshold = threshold_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self._busy = threading.Lock()
+        try:
+            import pyinstrument  # noqa: F401
+            self.engine = "pyinstrument"
+        except ImportError:
+            self.engine = "cprofile"
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.sample_rate > 0
+
+    def start(self):
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if self.engine == "pyinstrument":
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+            else:
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            return profiler
+        except Exception:
+            self._busy.release()
+            return None
+
+    def stop(self, profiler, trace: Trace):
+        try:
+            if self.engine == "pyinstrument":
+                profiler.stop()
+            else:
+                profiler.disable()
+            if trace.duration < self.threshold:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", trace.name).strip("_") or "root"
+            base = os.path.join(
+                self.directory, f"{int(time.time())}-{slug}-{int(trace.duration * 1000)}ms-{trace.request_id}"
+            )
+            if self.engine == "pyinstrument":
+                with open(base + ".html", "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.dump_stats(base + ".prof")
+            PROFILES_WRITTEN.inc()
+            logger.warning("Slow request profiled: %s (%.0f ms) -> %s", trace.name, trace.duration * 1000, base)
+        except Exception:
+            logger.exception("Failed to write request profile")
+        finally:
+            self._busy.release()
+
+
+class RequestTracingMiddleware:
+    """ASGI middleware that traces each HTTP request end to end.
+
+    Runs until the last body chunk is sent, so streamed responses are timed in
+    full. Each request gets a trace id (echoed as ``X-Request-ID``), in-flight
+    and latency metrics, a structured log line, and an optional sampled
+    profile when it is slower than ``PROFILE_SLOW_MS``.
+    """
+
+    def __init__(self, app, excluded_paths=("/metrics", "/healthz", "/readyz")):
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+        self.slow_log_seconds = float(os.getenv("TRACE_SLOW_MS", "2000")) / 1000.0
+        self.profiler = _SlowRequestProfiler(
+            threshold_ms=float(os.getenv("PROFILE_SLOW_MS", "0")),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.05")),
+            directory=os.getenv("PROFILE_DIR", "data/profiles"),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or None
+        trace = Trace(f"{method} {path}", request_id)
+        token = _current_trace.set(trace)
+        status = {"code": 500}
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", trace.request_id.encode())]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        profiler = self.profiler.start()
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            IN_FLIGHT.dec()
+            # Label by route template so path parameters cannot explode label cardinality
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(method=method, path=route).observe(trace.duration)
+            REQUESTS.labels(method=method, path=route, status=status["code"]).inc()
+            if profiler is not None:
+                self.profiler.stop(profiler, trace)
+            trace.attributes["status"] = status["code"]
+            level = logging.INFO if trace.duration >= self.slow_log_seconds else logging.DEBUG
+            if logger.isEnabledFor(level):
+                logger.log(level, json.dumps(trace.to_dict()))
+            _current_trace.reset(token)
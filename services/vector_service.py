@@ -1,115 +1,751 @@
-from pinecone import Pinecone, ServerlessSpec
+import asyncio
+import functools
+import logging
 import os
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
-import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.embedding_batcher import EmbeddingBatcher
+from services.embedding_cache import EmbeddingCache
+from services.embedding_worker import EmbeddingWorkerClient
+from services.health import DISABLED, FAILED, HEALTH, PENDING, READY, WARMING
+from services.lexical_index import LexicalIndex
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.manifest import DocumentManifest, document_id, metadata_hash
+from services.metrics import REGISTRY
+from services.tracing import annotate, span
+
+logger = logging.getLogger("jarvis.vector")
+
+RETRIEVED_DOCUMENTS = REGISTRY.histogram(
+    "jarvis_retrieved_documents", "Documents returned per similarity search",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+)
+RETRIEVAL_SCORE = REGISTRY.histogram(
+    "jarvis_retrieval_score", "Similarity score of each retrieved document",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+RETRIEVAL_SOURCES = REGISTRY.counter(
+    "jarvis_retrieved_by_total", "Documents returned by hybrid search, by the retrievers that found them", ["retriever"]
+)
+
+# Present in the keyword index's directory while it is being backfilled from the vector store
+LEXICAL_BACKFILL_MARKER = "backfill.pending"
+
+def reciprocal_rank_fusion(rankings: Dict[str, List], k: int = 60) -> List[Dict]:
+    """Merge ranked match lists by summing ``1 / (k + rank)`` per document id"""
+    fused: Dict[str, Dict] = {}
+    for name, matches in rankings.items():
+        for rank, match in enumerate(matches, start=1):
+            entry = fused.setdefault(match.id, {"id": match.id, "metadata": match.metadata, "fusion_score": 0.0})
+            entry["fusion_score"] += 1.0 / (k + rank)
+            entry[f"{name}_score"] = match.score
+    return sorted(fused.values(), key=lambda entry: entry["fusion_score"], reverse=True)
+
+def _log_cache_write_failure(future):
+    # A write still queued at shutdown is dropped: the disk tier is only a cache
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Could not persist embeddings: %s", future.exception())
+
+def _field(item, name: str):
+    """A field of a Pinecone response object or of its plain-dict form"""
+    return item[name] if isinstance(item, dict) else getattr(item, name)
 
 class VectorService:
-    def __init__(self):
+    def __init__(self, index=None, read_only: bool = False):
+        self.backend = os.getenv("VECTOR_BACKEND", "pinecone").lower()
         self.api_key = os.getenv("PINECONE_API_KEY")
         self.index_name = os.getenv("PINECONE_INDEX_NAME", "jarvis-knowledge")
+        self.local_index_path = os.getenv("LOCAL_INDEX_PATH", "data/vector_index")
+        # float32, float16, int8 or pq: how the local index stores the vectors it scans
+        self.local_index_storage = os.getenv("LOCAL_INDEX_STORAGE", "float32").lower()
+        
+        # BM25 over the same documents catches exact identifiers that embeddings blur
+        self.hybrid_search = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+        self.lexical_index_path = os.getenv("LEXICAL_INDEX_PATH", "data/lexical_index")
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+        self.lexical_index = None
+        # Until the keyword index holds every stored document, searches are vector-only
+        self.lexical_complete = True
+        self._backfill_deleted = set()
+        self._backfill_lock = threading.Lock()
+        self._closed = False
+        
+        # Set by serve.py for API workers: the model lives in the shared embedding worker, which is
+        # also the only writer of the local stores; this process opens them read-only and follows them
+        self.embedding_worker = None
+        embedding_worker_socket = os.getenv("EMBEDDING_WORKER_SOCKET")
+        if embedding_worker_socket:
+            self.embedding_worker = EmbeddingWorkerClient(
+                embedding_worker_socket, timeout=float(os.getenv("EMBEDDING_WORKER_TIMEOUT", "120"))
+            )
+        # Readers that must not take the writer's place (e.g. a snapshot export) open them the same way
+        self.read_only = read_only or self.embedding_worker is not None
+        
+        # Which content-addressed ids are already indexed, per source; kept next to the index it describes
+        self.manifest_path = os.getenv("DOCUMENT_MANIFEST_PATH")
+        self.manifest = None
+        
+        # Bounded pools keep blocking work off the event loop. Encoding is
+        # CPU-bound but torch releases the GIL inside its kernels, so a small
+        # thread pool scales without pickling the model into other processes.
+        embedding_workers = int(os.getenv("EMBEDDING_WORKERS", "2"))
+        self.embedding_executor = ThreadPoolExecutor(
+            max_workers=embedding_workers,
+            thread_name_prefix="embedding",
+        )
+        self.io_workers = int(os.getenv("VECTOR_IO_WORKERS", "8"))
+        self.index_executor = ThreadPoolExecutor(
+            max_workers=self.io_workers,
+            thread_name_prefix="vector-io",
+        )
+        
+        self.embedding_model_name = 'all-MiniLM-L6-v2'
+        self._embedding_model = None
+        self._model_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        # A store that failed to open is retried on demand, at most this often
+        self.reconnect_interval = float(os.getenv("VECTOR_RECONNECT_SECONDS", "10"))
+        self._last_connect = 0.0
+        # A caller-supplied index (e.g. a benchmark stand-in) replaces the configured backend
+        self._connected = index is not None
+        self.index = index
+        if index is not None:
+            self.manifest = DocumentManifest()
+            if self.hybrid_search:
+                self.lexical_index = LexicalIndex()
+        HEALTH.set("embedding_model", PENDING)
+        HEALTH.set("vector_store", READY if index is not None else PENDING)
         
-        # Initialize embedding model
-        print("🔄 Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("✅ Embedding model loaded successfully")
+        # Repeated texts skip the model entirely
+        self.embedding_cache = None
+        if os.getenv("EMBEDDING_CACHE", "true").lower() == "true":
+            self.embedding_cache = EmbeddingCache(
+                self.embedding_model_name,
+                max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 1024 * 1024),
+                # API workers keep theirs in memory; the shared worker owns the persistent one
+                path=None if self.embedding_worker else (
+                    os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3") or None
+                ),
+            )
         
-        # Initialize Pinecone only if API key is provided and valid
-        if self.api_key and self.api_key != "your_pinecone_api_key_here":
+        # Coalesce concurrent single-text requests into batched encode calls
+        self.batcher = None
+        if os.getenv("EMBEDDING_BATCHING", "true").lower() == "true":
+            self.batcher = EmbeddingBatcher(
+                self._generate_embeddings,
+                self.embedding_executor,
+                max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32")),
+                max_wait_ms=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5")),
+                max_concurrent_batches=embedding_workers,
+            )
+    
+    @property
+    def embedding_model(self):
+        """The SentenceTransformer, loaded on first use"""
+        if self._embedding_model is None:
+            self.load_embedding_model()
+        return self._embedding_model
+    
+    def load_embedding_model(self):
+        """Load the embedding model once; safe to call from several threads"""
+        with self._model_lock:
+            if self._embedding_model is not None:
+                return
+            HEALTH.set("embedding_model", WARMING)
             try:
-                print("🔄 Connecting to Pinecone...")
-                self.pc = Pinecone(api_key=self.api_key)
-                
-                # Test connection by listing indexes
-                existing_indexes = [index.name for index in self.pc.list_indexes()]
-                
-                # Create index if it doesn't exist
-                if self.index_name not in existing_indexes:
-                    print(f"🔄 Creating Pinecone index: {self.index_name}")
-                    self.pc.create_index(
-                        name=self.index_name,
-                        dimension=384,  # all-MiniLM-L6-v2 dimension
-                        metric="cosine",
-                        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-                    )
-                    print(f"✅ Created Pinecone index: {self.index_name}")
-                else:
-                    print(f"✅ Using existing Pinecone index: {self.index_name}")
-                
-                self.index = self.pc.Index(self.index_name)
-                print("✅ Pinecone vector database connected successfully")
-                
+                print("🔄 Loading embedding model...")
+                # Imported here because torch alone takes seconds to import
+                from sentence_transformers import SentenceTransformer
+                self._embedding_model = SentenceTransformer(self.embedding_model_name)
+                print("✅ Embedding model loaded successfully")
             except Exception as e:
-                print(f"❌ Pinecone connection failed: {str(e)}")
-                print("💡 Tip: Check your API key in the .env file")
-                print("💡 Get a free API key at: https://www.pinecone.io/")
+                HEALTH.set("embedding_model", FAILED, str(e))
+                raise
+    
+    def connect(self):
+        """Open the configured vector store once; failures leave ``self.index`` as None"""
+        with self._connect_lock:
+            if self._connected:
+                return
+            self._connected = True
+            self._last_connect = time.monotonic()
+            HEALTH.set("vector_store", WARMING)
+            
+            if self.backend == "local":
+                self._init_local_index()
+            # Initialize Pinecone only if API key is provided and valid
+            elif self.api_key and self.api_key != "your_pinecone_api_key_here":
+                self._init_pinecone()
+            else:
                 self.index = None
-        else:
+                HEALTH.set("vector_store", DISABLED, "No vector database configured")
+                if not self.api_key:
+                    print("⚠️  No Pinecone API key found in environment")
+                else:
+                    print("⚠️  Please update PINECONE_API_KEY in your .env file")
+                print("💡 The assistant will work without Pinecone but won't remember conversations")
+                print("💡 Set VECTOR_BACKEND=local to keep memory in a local index instead")
+                print("💡 Run 'python setup_assistant.py' for guided setup")
+            
+            if self.index is not None:
+                self._init_manifest()
+                if self.hybrid_search:
+                    self._init_lexical_index()
+    
+    def _init_pinecone(self):
+        """Connect to Pinecone, creating the index if needed"""
+        try:
+            print("🔄 Connecting to Pinecone...")
+            from pinecone import Pinecone, ServerlessSpec
+            self.pc = Pinecone(api_key=self.api_key)
+            
+            # Test connection by listing indexes
+            existing_indexes = [index.name for index in self.pc.list_indexes()]
+            
+            # Create index if it doesn't exist
+            if self.index_name not in existing_indexes:
+                print(f"🔄 Creating Pinecone index: {self.index_name}")
+                self.pc.create_index(
+                    name=self.index_name,
+                    dimension=EMBEDDING_DIMENSION,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud="aws", region="us-east-1")
+                )
+                print(f"✅ Created Pinecone index: {self.index_name}")
+            else:
+                print(f"✅ Using existing Pinecone index: {self.index_name}")
+            
+            self.index = self.pc.Index(self.index_name)
+            HEALTH.set("vector_store", READY, f"pinecone:{self.index_name}")
+            print("✅ Pinecone vector database connected successfully")
+            
+        except Exception as e:
+            print(f"❌ Pinecone connection failed: {str(e)}")
+            print("💡 Tip: Check your API key in the .env file")
+            print("💡 Get a free API key at: https://www.pinecone.io/")
+            HEALTH.set("vector_store", FAILED, str(e))
+            self.index = None
+
+    def _init_local_index(self):
+        """Open (or create) the embedded on-disk index"""
+        try:
+            print(f"🔄 Opening local vector index at: {self.local_index_path}")
+            self.index = LocalVectorIndex(
+                self.local_index_path,
+                dimension=EMBEDDING_DIMENSION,
+                storage=self.local_index_storage,
+                rerank=int(os.getenv("LOCAL_INDEX_RERANK", "10")),
+                pq_subvectors=int(os.getenv("LOCAL_INDEX_PQ_SUBVECTORS", "48")),
+                pq_train_size=int(os.getenv("LOCAL_INDEX_PQ_TRAIN_SIZE", "10000")),
+                ann=os.getenv("LOCAL_INDEX_ANN", "none").lower(),
+                ivf_lists=int(os.getenv("LOCAL_INDEX_IVF_LISTS", "1024")),
+                ivf_nprobe=int(os.getenv("LOCAL_INDEX_IVF_NPROBE", "16")),
+                ivf_train_size=int(os.getenv("LOCAL_INDEX_IVF_TRAIN_SIZE", "50000")),
+                read_only=self.read_only,
+            )
+            stats = self.index.describe_index_stats()
+            count = stats["total_vector_count"]
+            HEALTH.set("vector_store", READY, f"local:{count} vectors")
+            print(f"✅ Local vector index ready ({count} vectors, {stats['storage']} storage)")
+        except Exception as e:
+            print(f"❌ Local vector index failed to open: {str(e)}")
+            HEALTH.set("vector_store", FAILED, str(e))
             self.index = None
-            if not self.api_key:
-                print("⚠️  No Pinecone API key found in environment")
+    
+    def _init_manifest(self):
+        """Open the record of indexed document ids used for dedup and incremental sync"""
+        path = self.manifest_path
+        if path is None:
+            if self.backend == "local":
+                path = os.path.join(self.local_index_path, "manifest.sqlite3")
             else:
-                print("⚠️  Please update PINECONE_API_KEY in your .env file")
-            print("💡 The assistant will work without Pinecone but won't remember conversations")
-            print("💡 Run 'python setup_assistant.py' for guided setup")
+                path = os.path.join("data", f"manifest-{self.index_name}.sqlite3")
+        try:
+            self.manifest = DocumentManifest(path or None)
+        except Exception as e:
+            print(f"⚠️  Document manifest failed to open, duplicate detection is off: {str(e)}")
+            self.manifest = None
     
-    def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text"""
-        return self.embedding_model.encode(text).tolist()
+    def _init_lexical_index(self):
+        """Open the keyword index that is searched alongside the vector store"""
+        try:
+            self.lexical_index = LexicalIndex(self.lexical_index_path or None,
+                                              read_only=self.read_only)
+            print(f"✅ Keyword index ready ({len(self.lexical_index)} documents)")
+        except Exception as e:
+            print(f"⚠️  Keyword index failed to open, using vector search only: {str(e)}")
+            self.lexical_index = None
+            return
+        if self.lexical_index.read_only:
+            # The shared worker does the backfilling; refresh() notices when it is done
+            self.lexical_complete = not self._lexical_backfill_pending()
+            return
+        
+        # Documents written before hybrid search was on (or stored in Pinecone, when the
+        # keyword index lives in memory) are missing from it: index them in the background
+        try:
+            stored = _field(self.index.describe_index_stats(), "total_vector_count")
+        except Exception as e:
+            print(f"⚠️  Could not count stored documents, not backfilling the keyword index: {str(e)}")
+            return
+        marker = self._lexical_backfill_marker()
+        if stored <= len(self.lexical_index):
+            if marker and os.path.exists(marker):
+                os.remove(marker)
+            return
+        if marker:
+            open(marker, "w").close()
+        self.lexical_complete = False
+        print(f"🔄 Backfilling the keyword index ({len(self.lexical_index)} of {stored} documents); "
+              f"vector search only until it is done")
+        threading.Thread(target=self._backfill_lexical_index, name="lexical-backfill", daemon=True).start()
     
-    async def add_document(self, text: str, metadata: Dict = None) -> str:
-        """Add document to vector database"""
-        if not self.index:
-            return "Vector database not configured"
-            
+    def _lexical_backfill_marker(self) -> Optional[str]:
+        if self.lexical_index is None or not self.lexical_index.path:
+            return None
+        return os.path.join(self.lexical_index.path, LEXICAL_BACKFILL_MARKER)
+    
+    def _lexical_backfill_pending(self) -> bool:
+        marker = self._lexical_backfill_marker()
+        return marker is not None and os.path.exists(marker)
+    
+    def _backfill_lexical_index(self):
+        """Add every stored document the keyword index lacks, then turn hybrid search on"""
+        added = 0
         try:
-            # Generate embedding
-            embedding = self._generate_embedding(text)
+            for ids, _, metadatas in self.iter_documents():
+                if self._closed:
+                    return
+                missing = [(doc_id, metadata) for doc_id, metadata in zip(ids, metadatas)
+                           if doc_id not in self.lexical_index]
+                if missing:
+                    added += self.lexical_index.add(missing)
+                # A document deleted while its page was being fetched must not come back
+                with self._backfill_lock:
+                    deleted = self._backfill_deleted.intersection(ids)
+                if deleted:
+                    self.lexical_index.delete(deleted)
+        except Exception as e:
+            if not self._closed:
+                print(f"⚠️  Keyword index backfill failed, using vector search only: {str(e)}")
+            return
+        marker = self._lexical_backfill_marker()
+        if marker and os.path.exists(marker):
+            os.remove(marker)
+        self.lexical_complete = True
+        with self._backfill_lock:
+            self._backfill_deleted.clear()
+        print(f"✅ Keyword index backfilled ({added} documents added)")
+
+    def _warm_embedding_model(self):
+        if self.embedding_worker:
+            self.embedding_worker.wait_ready(float(os.getenv("EMBEDDING_WORKER_TIMEOUT", "120")))
+            HEALTH.set("embedding_model", READY, f"worker:{self.embedding_worker.socket_path}")
+            return
+        self.load_embedding_model()
+        # One dummy encode pays the first-call allocation cost before real traffic
+        self.embedding_model.encode("warmup")
+        HEALTH.set("embedding_model", READY, self.embedding_model_name)
+    
+    async def reconnect(self) -> bool:
+        """Try again to open a vector store that failed to; True once one is available.
+
+        Attempts are at least ``reconnect_interval`` seconds apart, so
+        callers can ask on every request. A store that is still warming up
+        or is not configured is left alone.
+        """
+        if self.index is not None:
+            return True
+        if HEALTH.state("vector_store") != FAILED or time.monotonic() - self._last_connect < self.reconnect_interval:
+            return False
+        with self._connect_lock:
+            self._connected = False
+        await self._run_in(self.index_executor, self.connect)
+        return self.index is not None
+    
+    async def warmup(self):
+        """Load the model and connect the vector store concurrently, off the event loop"""
+        if self.embedding_worker:
+            # The shared worker creates the stores, so they can only be opened once it answers
+            try:
+                await self._run_in(self.embedding_executor, self._warm_embedding_model)
+                await self._run_in(self.index_executor, self.connect)
+            except Exception as e:
+                HEALTH.set("embedding_model", FAILED, str(e))
+                print(f"❌ Vector service warmup failed: {str(e)}")
+            return
+        results = await asyncio.gather(
+            self._run_in(self.embedding_executor, self._warm_embedding_model),
+            self._run_in(self.index_executor, self.connect),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ Vector service warmup failed: {str(result)}")
+    
+    def close(self):
+        """Flush local state on shutdown"""
+        self._closed = True
+        if self.index is not None and hasattr(self.index, "close"):
+            self.index.close()
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.embedding_cache:
+            self.embedding_cache.close()
+        if self.embedding_worker:
+            self.embedding_worker.close()
+        self.embedding_executor.shutdown(wait=False)
+        self.index_executor.shutdown(wait=False)
+
+    def _generate_embedding(self, text: str) -> np.ndarray:
+        """Generate embedding for text as a float32 vector"""
+        if self.embedding_worker:
+            return self.embedding_worker.encode([text])[0]
+        return np.asarray(self.embedding_model.encode(text), dtype=np.float32)
+    
+    def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for many texts in one batched encode, one float32 row per text"""
+        if self.embedding_worker:
+            return self.embedding_worker.encode(texts)
+        return np.asarray(self.embedding_model.encode(texts, batch_size=len(texts)), dtype=np.float32)
+    
+    async def _run_in(self, executor: ThreadPoolExecutor, func, *args, **kwargs):
+        """Run a blocking call on one of the service's bounded pools"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    
+    async def _cached_embeddings(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached embeddings: the memory tier on the loop, then one SQLite query for the rest on the I/O pool"""
+        found = self.embedding_cache.cached(texts)
+        missing = [i for i, embedding in enumerate(found) if embedding is None]
+        if missing and self.embedding_cache.persistent:
+            loaded = await self._run_in(self.index_executor, self.embedding_cache.load, [texts[i] for i in missing])
+            for i, embedding in zip(missing, loaded):
+                found[i] = embedding
+        return found
+    
+    def _cache_embeddings(self, texts: List[str], embeddings):
+        """Remember new embeddings now; the SQLite write happens in the background on the I/O pool"""
+        stored = self.embedding_cache.remember(texts, embeddings)
+        if self.embedding_cache.persistent:
+            future = self.index_executor.submit(self.embedding_cache.save, texts, stored)
+            future.add_done_callback(_log_cache_write_failure)
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Generate embedding for text without blocking the event loop"""
+        with span("embed"):
+            if self.embedding_cache:
+                cached = (await self._cached_embeddings([text]))[0]
+                if cached is not None:
+                    return cached
             
-            # Create unique ID
-            doc_id = str(uuid.uuid4())
+            if self.batcher:
+                embedding = await self.batcher.embed(text)
+            else:
+                embedding = await self._run_in(self.embedding_executor, self._generate_embedding, text)
             
+            if self.embedding_cache:
+                self._cache_embeddings([text], [embedding])
+            return embedding
+    
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Generate a ``(len(texts), dimension)`` matrix with one encode call for the cache misses"""
+        if not self.embedding_cache:
+            if not texts:
+                return np.zeros((0, EMBEDDING_DIMENSION), dtype=np.float32)
+            return await self._run_in(self.embedding_executor, self._generate_embeddings, texts)
+        
+        embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+        missing = []
+        for i, cached in enumerate(await self._cached_embeddings(texts)):
+            if cached is None:
+                missing.append(i)
+            else:
+                embeddings[i] = cached
+        
+        if missing:
+            computed = await self._run_in(
+                self.embedding_executor, self._generate_embeddings, [texts[i] for i in missing]
+            )
+            embeddings[missing] = computed
+            self._cache_embeddings([texts[i] for i in missing], computed)
+        return embeddings
+    
+    def _backend_vector(self, embedding):
+        """The local index takes numpy rows as they are; Pinecone's client wants plain lists"""
+        if isinstance(self.index, LocalVectorIndex):
+            return embedding
+        return np.asarray(embedding, dtype=np.float32).tolist()
+    
+    async def upsert_embeddings(self, texts: List[str], embeddings: Sequence[np.ndarray],
+                                metadatas: List[Dict] = None, ids: List[str] = None) -> List[str]:
+        """Upsert already-embedded texts in a single vector store request"""
+        if not self.index:
+            raise Exception("Vector database not configured")
+        
+        vectors = []
+        for i, (text, embedding) in enumerate(zip(texts, embeddings)):
             # Prepare metadata
-            if metadata is None:
-                metadata = {}
+            metadata = dict(metadatas[i]) if metadatas and metadatas[i] else {}
+            
+            # Content-addressed ID, so re-adding the same text overwrites instead of duplicating
+            doc_id = ids[i] if ids else document_id(metadata.get("source", ""), text)
             metadata["text"] = text
+            vectors.append((doc_id, self._backend_vector(embedding), metadata))
+        
+        await self._run_in(self.index_executor, self._upsert, vectors)
+        return [doc_id for doc_id, _, _ in vectors]
+    
+    def _upsert(self, vectors: List):
+        """Write to the vector store, then to the keyword index and the manifest"""
+        if self.embedding_worker:
+            self.embedding_worker.upsert(vectors)
+            # Read-your-writes: the caller can search what it just wrote
+            self.refresh()
+            return
+        self.index.upsert(vectors)
+        if self.lexical_index is not None:
+            self.lexical_index.add((doc_id, metadata) for doc_id, _, metadata in vectors)
+        if self.manifest is not None:
+            self.manifest.add((doc_id, metadata.get("source", ""), metadata_hash(metadata))
+                              for doc_id, _, metadata in vectors)
+    
+    async def indexed_ids(self, ids: List[str], metadatas: List[Dict]) -> Tuple[set, set]:
+        """Of distinct ``ids``, those already stored with these metadata and those stored with other metadata.
+
+        Neither needs embedding: the first need no write at all, the second are
+        rewritten with the vector already in the store (see ``embed_documents``).
+        """
+        if self.manifest is None or not ids:
+            return set(), set()
+        stored = await self._run_in(self.index_executor, self.manifest.metadata_hashes, list(ids))
+        unchanged, changed = set(), set()
+        for doc_id, metadata in zip(ids, metadatas):
+            if doc_id in stored:
+                (unchanged if stored[doc_id] == metadata_hash(metadata) else changed).add(doc_id)
+        return unchanged, changed
+    
+    async def embed_documents(self, texts: List[str], ids: List[str], stored=()) -> List[np.ndarray]:
+        """Embeddings for documents about to be written.
+
+        Ids in ``stored`` reuse the vector already in the store: an id always
+        stands for the same text, so only its metadata is being rewritten.
+        Any of them the store turns out not to have are encoded after all.
+        """
+        reuse = {}
+        if stored:
+            reuse = await self._run_in(self.index_executor, self._stored_vectors,
+                                       [doc_id for doc_id in ids if doc_id in stored])
+        embeddings = [reuse.get(doc_id) for doc_id in ids]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, await self.embed_many([texts[i] for i in missing])):
+                embeddings[i] = embedding
+        return embeddings
+    
+    def _stored_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # Pinecone accepts at most 1000 ids per fetch request
+        for start in range(0, len(ids), 1000):
+            response = self.index.fetch(ids=ids[start:start + 1000])
+            vectors = response["vectors"] if isinstance(response, dict) else response.vectors
+            for doc_id, row in vectors.items():
+                found[doc_id] = np.asarray(_field(row, "values"), dtype=np.float32)
+        return found
+    
+    async def delete_documents(self, ids: List[str]):
+        """Remove documents from the vector store, the keyword index and the manifest"""
+        if not self.index or not ids:
+            return
+        await self._run_in(self.index_executor, self._delete, list(ids))
+    
+    def _delete(self, ids: List[str]):
+        if self.embedding_worker:
+            self.embedding_worker.delete(ids)
+            self.refresh()
+            return
+        # Pinecone accepts at most 1000 ids per delete request
+        for start in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[start:start + 1000])
+        if self.lexical_index is not None:
+            if not self.lexical_complete:
+                with self._backfill_lock:
+                    self._backfill_deleted.update(ids)
+            self.lexical_index.delete(ids)
+        if self.manifest is not None:
+            self.manifest.remove(ids)
+    
+    def iter_documents(self, batch_size: int = 4096) -> Iterator[Tuple[List[str], np.ndarray, List[Dict]]]:
+        """Every stored document as ``(ids, vectors, metadatas)`` batches, the text inside the metadata.
+
+        Blocking; for snapshot export. Pinecone is paged through with
+        ``list`` and ``fetch``, several pages in flight at once.
+        """
+        if not self.index:
+            raise Exception("Vector database not configured")
+        if isinstance(self.index, LocalVectorIndex):
+            yield from self.index.iter_documents(batch_size)
+            return
+        
+        def fetch(ids: List[str]):
+            response = self.index.fetch(ids=ids)
+            found = response["vectors"] if isinstance(response, dict) else response.vectors
+            rows = [found[doc_id] for doc_id in ids if doc_id in found]
+            return ([_field(row, "id") for row in rows],
+                    np.asarray([_field(row, "values") for row in rows], dtype=np.float32),
+                    [dict(_field(row, "metadata") or {}) for row in rows])
+        
+        in_flight = deque()
+        for page in self.index.list(limit=100):
+            # Depending on the client version a page is a list of ids or a ListResponse
+            ids = [_field(item, "id") for item in page.vectors] if hasattr(page, "vectors") else list(page)
+            if ids:
+                in_flight.append(self.index_executor.submit(fetch, ids))
+            if len(in_flight) >= self.io_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    
+    def refresh(self) -> List[Dict]:
+        """Apply writes the shared embedding worker made to the local stores since the last call.
+
+        Returns the metadata of the documents added, changed or deleted.
+        """
+        touched = []
+        for store in (self.index, self.lexical_index):
+            if getattr(store, "read_only", False):
+                touched.extend(store.refresh())
+        if not self.lexical_complete:
+            self.lexical_complete = not self._lexical_backfill_pending()
+        return touched
+    
+    async def follow_writes(self, on_change, interval: float = 1.0):
+        """API workers: poll the shared stores and report writes made through other workers"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                touched = await self._run_in(self.index_executor, self.refresh)
+            except Exception:
+                logger.exception("Following index writes failed")
+                continue
+            if touched:
+                on_change(touched)
+    
+    async def add_document(self, text: str, metadata: Dict = None) -> str:
+        """Add document to vector database"""
+        if not self.index:
+            raise Exception("Vector database not configured")
+            
+        try:
+            doc_id = document_id((metadata or {}).get("source", ""), text)
+            unchanged, changed = await self.indexed_ids([doc_id], [metadata])
+            if unchanged:
+                # Unchanged content and metadata: nothing to embed or write
+                return doc_id
             
-            # Upsert to Pinecone
-            self.index.upsert([(doc_id, embedding, metadata)])
+            # Generate embedding, or reuse the stored one when only the metadata changed
+            embedding = (await self.embed_documents([text], [doc_id], changed))[0]
             
-            return doc_id
+            doc_ids = await self.upsert_embeddings([text], [embedding], [metadata], ids=[doc_id])
+            return doc_ids[0]
             
         except Exception as e:
             raise Exception(f"Error adding document: {str(e)}")
     
-    async def search_similar(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Search for similar documents"""
+    async def _hybrid_search(self, query: str, query_embedding: np.ndarray, top_k: int,
+                             filters: Dict = None) -> List[Dict]:
+        """Run vector and BM25 retrieval concurrently and merge them with reciprocal-rank fusion.
+
+        ``score`` is the fused score; ``vector_score`` and ``keyword_score``
+        are present for whichever retrievers found the document.
+        """
+        # Fusion needs more than top_k candidates from each side to reorder meaningfully
+        depth = max(top_k * 4, 20)
+        dense, keyword = await asyncio.gather(
+            self._run_in(
+                self.index_executor, self.index.query,
+                vector=self._backend_vector(query_embedding), top_k=depth, include_metadata=True,
+                **self._filter_kwargs(filters),
+            ),
+            self._run_in(self.index_executor, self.lexical_index.search, query, depth, filters),
+        )
+        fused = reciprocal_rank_fusion({"vector": dense.matches, "keyword": keyword}, self.rrf_k)[:top_k]
+        
+        documents = []
+        for entry in fused:
+            metadata = entry["metadata"] or {}
+            document = {
+                "text": metadata.get("text", ""),
+                "source": metadata.get("source", "unknown"),
+                "score": entry["fusion_score"],
+            }
+            for retriever in ("vector", "keyword"):
+                if f"{retriever}_score" in entry:
+                    document[f"{retriever}_score"] = entry[f"{retriever}_score"]
+                    RETRIEVAL_SOURCES.labels(retriever=retriever).inc()
+            documents.append(document)
+        return documents
+    
+    def _filter_kwargs(self, filters: Dict = None) -> Dict:
+        """Both backends take the same metadata filter syntax; Pinecone rejects an empty one"""
+        return {"filter": filters} if filters else {}
+    
+    async def search_similar(self, query: str, top_k: int = 3,
+                             query_embedding: np.ndarray = None, filters: Dict = None) -> List[Dict]:
+        """Search for similar documents (vector plus keyword search when hybrid search is on),
+        reusing ``query_embedding`` when the caller already has it.
+
+        ``filters`` restricts results by metadata, e.g. ``{"source": "handbook.md"}``
+        (see ``services.attribute_index.validate_filters`` for the syntax)."""
         if not self.index:
             # Return empty context if no vector DB
             return []
             
         try:
             # Generate query embedding
-            query_embedding = self._generate_embedding(query)
-            
-            # Search in Pinecone
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
+            if query_embedding is None:
+                query_embedding = await self.embed(query)
             
-            # Format results
-            documents = []
-            for match in results.matches:
-                documents.append({
-                    "text": match.metadata.get("text", ""),
-                    "source": match.metadata.get("source", "unknown"),
-                    "score": match.score
-                })
+            with span("retrieve"):
+                if self.lexical_index is not None and self.lexical_complete:
+                    documents = await self._hybrid_search(query, query_embedding, top_k, filters)
+                else:
+                    # Search the vector index
+                    results = await self._run_in(
+                        self.index_executor,
+                        self.index.query,
+                        vector=self._backend_vector(query_embedding),
+                        top_k=top_k,
+                        include_metadata=True,
+                        **self._filter_kwargs(filters)
+                    )
+                    
+                    # Format results
+                    documents = []
+                    for match in results.matches:
+                        documents.append({
+                            "text": match.metadata.get("text", ""),
+                            "source": match.metadata.get("source", "unknown"),
+                            "score": match.score,
+                            "vector_score": match.score,
+                        })
             
+            RETRIEVED_DOCUMENTS.observe(len(documents))
+            for doc in documents:
+                if "vector_score" in doc:
+                    RETRIEVAL_SCORE.observe(doc["vector_score"])
+            annotate(retrieved_documents=len(documents),
+                     retrieval_scores=[round(doc["score"], 4) for doc in documents])
             return documents
             
         except Exception as e:
-            print(f"Error searching documents: {str(e)}")
+            logger.warning("Error searching documents: %s", e)
             return []
\ No newline at end of file
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from services.manifest import document_id
+from services.metrics import REGISTRY
+
+logger = logging.getLogger("jarvis.write_queue")
+
+PENDING = "pending"
+INDEXED = "indexed"
+FAILED = "failed"
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "jarvis_write_queue_depth", "Documents accepted but not yet written to the vector store"
+)
+FLUSHES = REGISTRY.counter(
+    "jarvis_write_queue_flushes_total", "Write-behind batch flush attempts", ["outcome"]
+)
+FLUSH_SIZE = REGISTRY.histogram(
+    "jarvis_write_queue_batch_size", "Documents per write-behind flush",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+INDEXING_LAG = REGISTRY.histogram(
+    "jarvis_write_queue_lag_seconds", "Delay between accepting a document and it being searchable"
+)
+
+
+def retryable(error: Exception) -> bool:
+    """Whether a failed write may succeed if tried again.
+
+    Malformed input (a ``ValueError``/``TypeError``, or an HTTP 4xx from
+    the store other than a timeout, conflict or rate limit) fails the same
+    way every time; anything else - timeouts, 5xx, a store that is down -
+    is treated as transient.
+    """
+    if isinstance(error, (ValueError, TypeError)):
+        return False
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return status in (408, 409, 429)
+    return True
+
+
+class WriteAheadLog:
+    """Append-only JSONL log of accepted documents and their outcome.
+
+    ``put`` records carry the full document; ``done`` records list ids that
+    reached the vector store (or failed for good). Replaying the log yields
+    every document that was accepted but never finished.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def replay(self) -> List[Dict]:
+        """Documents that were put but never marked done, in arrival order"""
+        pending: "OrderedDict[str, Dict]" = OrderedDict()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final write from a crash; everything before it is intact
+                    break
+                if record["op"] == "put":
+                    pending[record["id"]] = record
+                else:
+                    for doc_id in record["ids"]:
+                        pending.pop(doc_id, None)
+        return list(pending.values())
+
+    def _append(self, records: Iterable[Dict]):
+        self._file.write("".join(json.dumps(record) + "\n" for record in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def put(self, documents: List[Dict]):
+        self._append({"op": "put", **document} for document in documents)
+
+    def done(self, ids: List[str]):
+        self._append([{"op": "done", "ids": ids}])
+
+    def rewrite(self, pending: List[Dict]):
+        """Replace the log with just the unfinished documents"""
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            for document in pending:
+                f.write(json.dumps({"op": "put", **document}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temporary, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class WriteBehindQueue:
+    """Accepts documents immediately and writes them to the vector store in the background.
+
+    ``submit`` logs documents to the write-ahead log and returns their ids.
+    A single worker embeds and upserts them in batches of up to
+    ``batch_size``, flushing early after ``flush_interval_ms``. Failed
+    batches are retried with exponential backoff and jitter, capped at
+    ``backoff_max``, for as long as it takes: an accepted document is only
+    given up on when the store rejects it outright (see ``retryable``). A
+    batch that fails ``max_retries`` times in a row, or is rejected, is
+    split in half so one bad document cannot hold back or fail the others.
+    After a crash, ``start`` re-queues whatever the log says was never
+    written.
+    """
+
+    def __init__(self, vector_service, wal_path: Optional[str] = "data/knowledge_wal.jsonl",
+                 batch_size: int = 64, flush_interval_ms: float = 200, max_retries: int = 8,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, fsync: bool = True,
+                 on_indexed: Optional[Callable[[List[Dict]], None]] = None,
+                 status_history: int = 100000):
+        self.vector_service = vector_service
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_indexed = on_indexed
+        self.status_history = status_history
+        self.wal = WriteAheadLog(wal_path, fsync=fsync) if wal_path else None
+        # One thread keeps log appends ordered and their fsyncs off the event loop
+        self._wal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wal")
+
+        self._pending: "OrderedDict[str, Dict]" = OrderedDict()
+        self._statuses: "OrderedDict[str, Dict]" = OrderedDict()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._finished_since_rewrite = 0
+
+    async def start(self):
+        """Re-queue unfinished documents from the log and start the worker"""
+        self._wakeup = asyncio.Event()
+        if self.wal:
+            recovered = await self._log(self.wal.replay)
+            for document in recovered:
+                document.pop("op", None)
+                self._track(document)
+            if recovered:
+                print(f"🔄 Re-queued {len(recovered)} unwritten documents from the write-ahead log")
+            await self._log(self.wal.rewrite, list(self._pending.values()))
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self, drain_timeout: float = 5.0):
+        """Give queued writes a moment to finish; anything left stays in the log for next start"""
+        if self._worker is None:
+            return
+        if self._pending:
+            try:
+                await asyncio.wait_for(self.wait_idle(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("%d documents still queued at shutdown; kept in the write-ahead log",
+                               len(self._pending))
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        if self.wal:
+            await self._log(self.wal.close)
+        self._wal_executor.shutdown(wait=False)
+
+    async def _log(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._wal_executor, func, *args)
+
+    def _track(self, document: Dict):
+        self._pending[document["id"]] = document
+        self._set_status(document["id"], PENDING, enqueued_at=document["enqueued_at"])
+        QUEUE_DEPTH.set(len(self._pending))
+
+    async def submit(self, texts: List[str], metadatas: List[Dict] = None) -> List[str]:
+        """Durably accept documents and return their ids; they become searchable shortly after.
+
+        Ids are content-addressed, so a document that is already indexed or
+        already queued with the same metadata is not queued again. One whose
+        metadata changed replaces the queued copy, and is rewritten with the
+        vector already in the store instead of being embedded again.
+        """
+        now = time.time()
+        ids, documents = [], {}
+        for i, text in enumerate(texts):
+            metadata = dict(metadatas[i]) if metadatas and metadatas[i] else {}
+            doc_id = document_id(metadata.get("source", ""), text)
+            ids.append(doc_id)
+            queued = self._pending.get(doc_id)
+            if queued is not None and queued["metadata"] == metadata:
+                continue
+            # The last copy wins, so its metadata are the ones written
+            documents[doc_id] = {"id": doc_id, "text": text, "metadata": metadata, "enqueued_at": now}
+
+        unchanged, changed = await self.vector_service.indexed_ids(
+            list(documents), [document["metadata"] for document in documents.values()]
+        )
+        for doc_id in unchanged:
+            if doc_id in self._pending:
+                # A queued copy with other metadata would overwrite it, so this one is queued too
+                documents[doc_id]["stored"] = True
+                continue
+            # Unchanged content: report it as indexed without embedding it again
+            del documents[doc_id]
+            self._set_status(doc_id, INDEXED, enqueued_at=now, indexed_at=now, unchanged=True)
+        for doc_id in changed:
+            documents[doc_id]["stored"] = True
+        documents = list(documents.values())
+        if not documents:
+            return ids
+
+        # Tracked before the append so a log rewrite running meanwhile keeps them;
+        # a replayed duplicate is harmless because upserts are keyed by id
+        for document in documents:
+            self._track(document)
+        self._wakeup.set()
+        if self.wal:
+            await self._log(self.wal.put, documents)
+        return ids
+
+    def status(self, doc_id: str) -> Optional[Dict]:
+        entry = self._statuses.get(doc_id)
+        return {"id": doc_id, **entry} if entry else None
+
+    async def wait(self, doc_id: str, timeout: float) -> Optional[Dict]:
+        """Wait until a document is indexed or has failed, up to ``timeout`` seconds"""
+        entry = self._statuses.get(doc_id)
+        if entry is None or entry["status"] != PENDING:
+            return self.status(doc_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(doc_id, []).append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(doc_id)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[doc_id]
+        return self.status(doc_id)
+
+    async def wait_idle(self):
+        while self._pending:
+            await self.wait(next(iter(self._pending)), timeout=1.0)
+
+    def stats(self) -> Dict:
+        return {"pending": len(self._pending), "tracked": len(self._statuses)}
+
+    def _set_status(self, doc_id: str, status: str, **fields):
+        entry = self._statuses.pop(doc_id, {})
+        if status == PENDING:
+            entry = {}  # a re-queued document starts over
+        entry.update(status=status, **fields)
+        self._statuses[doc_id] = entry
+        # Keep the status of recent documents only
+        while len(self._statuses) > self.status_history:
+            oldest, oldest_entry = next(iter(self._statuses.items()))
+            if oldest_entry["status"] == PENDING:
+                break
+            self._statuses.popitem(last=False)
+        if status != PENDING:
+            for future in self._waiters.pop(doc_id, []):
+                if not future.done():
+                    future.set_result(status)
+
+    async def _next_batch(self) -> List[Dict]:
+        """Wait for a full batch or for the flush interval to pass after the first document"""
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        deadline = time.perf_counter() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return [document for _, document in zip(range(self.batch_size), self._pending.values())]
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict]):
+        attempt = 0
+        while True:
+            if not self.vector_service.index:
+                # Still connecting, or reconnecting after a failure; waiting does not count against the batch
+                if not await self.vector_service.reconnect():
+                    self._note_attempt(batch, attempt, "Vector database unavailable")
+                    await asyncio.sleep(self.backoff_base)
+                continue
+            try:
+                texts = [document["text"] for document in batch]
+                ids = [document["id"] for document in batch]
+                embeddings = await self.vector_service.embed_documents(
+                    texts, ids, {document["id"] for document in batch if document.get("stored")}
+                )
+                await self.vector_service.upsert_embeddings(
+                    texts, embeddings, [document["metadata"] for document in batch], ids=ids,
+                )
+                FLUSHES.labels(outcome="ok").inc()
+                FLUSH_SIZE.observe(len(batch))
+                await self._finish(batch, INDEXED)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempt += 1
+                FLUSHES.labels(outcome="error").inc()
+                transient = retryable(e)
+                if len(batch) > 1 and (not transient or attempt >= self.max_retries):
+                    # Find the document to blame instead of failing or stalling the whole batch
+                    logger.warning("Write-behind flush of %d documents failed %d times, splitting it: %s",
+                                   len(batch), attempt, e)
+                    middle = len(batch) // 2
+                    await self._flush(batch[:middle])
+                    await self._flush(batch[middle:])
+                    return
+                if not transient:
+                    logger.error("Document %s rejected by the vector store: %s", batch[0]["id"], e)
+                    await self._finish(batch, FAILED, error=str(e))
+                    return
+                self._note_attempt(batch, attempt, str(e))
+                delay = min(self.backoff_max, self.backoff_base * 2 ** min(attempt - 1, 30))
+                delay *= random.uniform(0.5, 1.0)
+                log = logger.error if attempt >= self.max_retries else logger.warning
+                log("Write-behind flush failed (attempt %d), retrying in %.1fs: %s", attempt, delay, e)
+                await asyncio.sleep(delay)
+
+    def _note_attempt(self, batch: List[Dict], attempts: int, error: str):
+        """Show a stalled write in the documents' status while they stay queued"""
+        for document in batch:
+            entry = self._statuses.get(document["id"])
+            if entry is not None and entry["status"] == PENDING:
+                entry.update(attempts=attempts, last_error=error)
+
+    async def _finish(self, batch: List[Dict], status: str, error: Optional[str] = None):
+        # A copy submitted again with new metadata while this one was written is still to do
+        finished = [document for document in batch if self._pending.get(document["id"]) is document]
+        if self.wal and finished:
+            await self._log(self.wal.done, [document["id"] for document in finished])
+        now = time.time()
+        for document in finished:
+            self._pending.pop(document["id"], None)
+            fields = {"indexed_at": now} if status == INDEXED else {"error": error}
+            self._set_status(document["id"], status, **fields)
+            if status == INDEXED:
+                INDEXING_LAG.observe(now - document["enqueued_at"])
+        QUEUE_DEPTH.set(len(self._pending))
+
+        if status == INDEXED and self.on_indexed:
+            try:
+                self.on_indexed(batch)
+            except Exception:
+                logger.exception("on_indexed callback failed")
+
+        # Keep the log from growing without bound
+        self._finished_since_rewrite += len(batch)
+        if self.wal and (not self._pending or self._finished_since_rewrite >= 10000):
+            self._finished_since_rewrite = 0
+            await self._log(self.wal.rewrite, list(self._pending.values()))
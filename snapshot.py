@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Knowledge base snapshots for Jarvis AI Assistant
+
+Exports the configured vector store (ids, vectors, text and metadata) to a
+compact, chunked and checksummed binary file, and restores it into any
+store with the same embedding model - without re-embedding anything.
+
+    python snapshot.py export knowledge.jsnap --float16
+    python snapshot.py import knowledge.jsnap --parallel 16
+    python snapshot.py verify knowledge.jsnap
+
+Import skips documents that are already indexed, so an interrupted restore
+can be run again. Snapshots are read and written as streams; memory use is
+bounded by --chunk-rows, not by the size of the knowledge base.
+"""
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from services.health import FAILED, HEALTH
+from services.snapshot import SnapshotError, export_snapshot, import_snapshot, verify_snapshot
+
+# Restoring into the local index is one memory-mapped write per batch, so batches can be much larger
+LOCAL_UPSERT_BATCH_SIZE = 5000
+PINECONE_UPSERT_BATCH_SIZE = 100
+
+
+class Progress:
+    """Prints at most once per ``every`` documents"""
+
+    def __init__(self, every: int, report):
+        self.every = max(1, every)
+        self.report = report
+        self.next = self.every
+
+    def __call__(self, documents: int, *details):
+        if documents >= self.next:
+            self.report(documents, *details)
+            self.next = (documents // self.every + 1) * self.every
+
+
+def open_vector_service(read_only: bool = False):
+    from services.vector_service import VectorService
+
+    # Export only reads: a read-only local index leaves the writer lock to a running server
+    vector_service = VectorService(read_only=read_only)
+    # Snapshots carry their vectors: connect the store without loading the embedding model
+    vector_service.connect()
+    if not vector_service.index:
+        # A store that failed to open (e.g. a local index another process is writing) said why already
+        if HEALTH.state("vector_store") != FAILED:
+            print("❌ No vector database configured - set VECTOR_BACKEND or PINECONE_API_KEY in .env")
+        return None
+    return vector_service
+
+
+def run_export(args):
+    vector_service = open_vector_service(read_only=True)
+    if vector_service is None:
+        return 1
+    temporary = args.path + ".partial"
+    try:
+        with open(temporary, "wb") as f:
+            stats = export_snapshot(
+                vector_service, f,
+                dtype="float16" if args.float16 else "float32",
+                compress=not args.no_compress,
+                chunk_rows=args.chunk_rows,
+                progress=Progress(args.progress_every, lambda documents: print(f"📤 {documents} documents")),
+            )
+        # Only a complete snapshot ever appears under the requested name
+        os.replace(temporary, args.path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        vector_service.close()
+    print(f"✅ Exported {stats['documents']} documents ({stats['bytes'] / 1e6:.1f} MB, {stats['chunks']} chunks) "
+          f"to {args.path} in {stats['seconds']:.1f}s")
+    return 0
+
+
+async def run_import(args):
+    from services.local_index import LocalVectorIndex
+
+    vector_service = open_vector_service()
+    if vector_service is None:
+        return 1
+    local = isinstance(vector_service.index, LocalVectorIndex)
+    batch_size = args.upsert_batch_size or (LOCAL_UPSERT_BATCH_SIZE if local else PINECONE_UPSERT_BATCH_SIZE)
+    # The local index has a single writer; parallel upserts would only queue on its lock
+    parallel = 1 if local else args.parallel
+
+    def report_progress(documents, stats):
+        print(f"📥 {documents} documents, {stats['restored']} restored, {stats['skipped']} already indexed")
+    progress = Progress(args.progress_every, report_progress)
+
+    try:
+        with open(args.path, "rb") as f:
+            stats = await import_snapshot(
+                vector_service, f,
+                upsert_batch_size=batch_size,
+                max_parallel_upserts=parallel,
+                skip_existing=not args.overwrite,
+                progress=lambda stats: progress(stats["documents"], stats),
+            )
+        if hasattr(vector_service.index, "flush"):
+            vector_service.index.flush()
+    finally:
+        vector_service.close()
+    print(f"✅ Restored {stats['restored']} documents from {args.path} in {stats['seconds']:.1f}s "
+          f"- {stats['documents_per_second']:.1f} docs/sec")
+    print(f"   {stats['skipped']} already indexed")
+    return 0
+
+
+def run_verify(args):
+    with open(args.path, "rb") as f:
+        info = verify_snapshot(f)
+    print(f"✅ {args.path}: {info['documents']} documents in {info['chunks']} chunks, all checksums match")
+    print(f"   {info['dimension']}-dimensional {info['dtype']} vectors from {info['embedding_model']}")
+    print(f"   Exported from {info.get('source') or 'unknown'} at {info.get('created')}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, restore and verify Jarvis knowledge base snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write the whole knowledge base to a snapshot file")
+    export.add_argument("path", help="Snapshot file to write")
+    export.add_argument("--float16", action="store_true", help="Store vectors as float16, halving their size")
+    export.add_argument("--no-compress", action="store_true", help="Leave text and metadata uncompressed")
+    export.add_argument("--chunk-rows", type=int, default=4096, help="Documents per checksummed chunk")
+
+    restore = commands.add_parser("import", help="Load a snapshot into the configured vector store")
+    restore.add_argument("path", help="Snapshot file to read")
+    restore.add_argument("--parallel", type=int, default=8, help="Concurrent upsert requests (Pinecone)")
+    restore.add_argument("--upsert-batch-size", type=int, default=None,
+                         help=f"Vectors per upsert (default {PINECONE_UPSERT_BATCH_SIZE} for Pinecone, "
+                              f"{LOCAL_UPSERT_BATCH_SIZE} for the local index)")
+    restore.add_argument("--overwrite", action="store_true", help="Rewrite documents that are already indexed")
+
+    for command in (export, restore):
+        command.add_argument("--progress-every", type=int, default=100000, help="Report progress every N documents")
+
+    verify = commands.add_parser("verify", help="Check a snapshot's checksums without loading it")
+    verify.add_argument("path", help="Snapshot file to check")
+    args = parser.parse_args()
+
+    load_dotenv()
+    try:
+        if args.command == "export":
+            code = run_export(args)
+        elif args.command == "import":
+            code = asyncio.run(run_import(args))
+        else:
+            code = run_verify(args)
+    except (SnapshotError, OSError) as e:
+        print(f"❌ {e}")
+        code = 1
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Admission control: bounded, prioritized access to the LLM
+
+Callers beyond ``max_in_flight`` queue, interactive ahead of batch. A full
+queue is turned away at once with a 429 and a waiter that runs out of
+time gets a 503, both with a Retry-After, instead of hanging.
+
+    python -m pytest tests/test_admission.py
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import app as jarvis
+from services.admission import BATCH, INTERACTIVE, AdmissionController, QueueFull, QueueTimeout
+from tests.test_concurrency import install_fakes, wait_until_ready
+
+
+def test_interactive_waiters_are_served_before_batch():
+    controller = AdmissionController("test", max_in_flight=1)
+    served = []
+
+    async def generate(name, priority):
+        reservation = await controller.reserve(priority)
+        served.append(name)
+        await asyncio.sleep(0.01)
+        reservation.release()
+
+    async def run():
+        holder = await controller.reserve()
+        waiters = [asyncio.ensure_future(generate(name, priority)) for name, priority in
+                   [("batch 1", BATCH), ("batch 2", BATCH), ("interactive 1", INTERACTIVE),
+                    ("interactive 2", INTERACTIVE)]]
+        await asyncio.sleep(0.01)
+        assert controller.queue_depth == 4
+        holder.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+    assert served == ["interactive 1", "interactive 2", "batch 1", "batch 2"]
+
+
+def test_full_queue_and_timeout_are_rejected_with_retry_after():
+    controller = AdmissionController("test", max_in_flight=1, max_queue=1, queue_timeout=0.05)
+
+    async def run():
+        holder = await controller.reserve()
+        waiter = asyncio.ensure_future(controller.reserve())
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull) as full:
+            await controller.reserve()
+        assert full.value.status_code == 429 and full.value.retry_after >= 1
+        with pytest.raises(QueueTimeout) as timeout:
+            await waiter
+        assert timeout.value.status_code == 503 and timeout.value.retry_after >= 1
+
+        # The waiter that gave up does not hold a slot: the next caller gets the released one
+        holder.release()
+        (await asyncio.wait_for(controller.reserve(), 1)).release()
+        assert controller.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    controller = AdmissionController("test", max_in_flight=1)
+
+    async def run():
+        holder = await controller.reserve()
+        leaving = asyncio.ensure_future(controller.reserve())
+        staying = asyncio.ensure_future(controller.reserve())
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        holder.release()
+        (await asyncio.wait_for(staying, 1)).release()
+        assert controller.queue_depth == 0
+        # Every slot is back
+        (await asyncio.wait_for(controller.reserve(), 1)).release()
+
+    asyncio.run(run())
+
+
+async def concurrent_chats(count: int):
+    async with jarvis.app.router.lifespan_context(jarvis.app):
+        await wait_until_ready()
+        transport = httpx.ASGITransport(app=jarvis.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://jarvis.test") as client:
+            # Different questions, so none of them shares another's generation
+            return await asyncio.gather(*(client.post("/chat", json={"message": f"Question {i}"})
+                                          for i in range(count)))
+
+
+def test_chat_overload_is_a_429_with_retry_after(monkeypatch):
+    install_fakes(monkeypatch)
+    monkeypatch.setenv("LLM_MAX_IN_FLIGHT", "1")
+    monkeypatch.setenv("LLM_MAX_QUEUE", "1")
+
+    responses = asyncio.run(concurrent_chats(3))
+    assert sorted(response.status_code for response in responses) == [200, 200, 429]
+    [rejected] = [response for response in responses if response.status_code == 429]
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert "queue is full" in rejected.json()["detail"]
+
+
+def test_chat_queue_timeout_is_a_503_with_retry_after(monkeypatch):
+    install_fakes(monkeypatch)
+    monkeypatch.setenv("LLM_MAX_IN_FLIGHT", "1")
+    monkeypatch.setenv("LLM_QUEUE_TIMEOUT_SECONDS", "0.05")
+
+    responses = asyncio.run(concurrent_chats(2))
+    assert sorted(response.status_code for response in responses) == [200, 503]
+    [rejected] = [response for response in responses if response.status_code == 503]
+    assert int(rejected.headers["Retry-After"]) >= 1
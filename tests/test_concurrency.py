@@ -0,0 +1,94 @@
+"""
+Concurrent /chat requests are served concurrently
+
+Drives the real app in-process through httpx.ASGITransport, with the
+benchmark stand-ins behind it: the deterministic FakeEncoder (with a
+per-text encode cost), the in-memory Pinecone stand-in and the fake Ollama
+server (with a fixed time to first token). If anything on the request path
+blocked the event loop, N requests would take about N times as long as one.
+
+    python -m pytest tests/test_concurrency.py
+"""
+
+import asyncio
+import time
+
+import httpx
+import ollama
+
+import app as jarvis
+from benchmarks import fake_ollama
+from benchmarks.fakes import FakeEncoder, FakePineconeIndex
+from services.health import HEALTH
+from services.vector_service import VectorService
+
+CONCURRENT_REQUESTS = 8
+LLM_SECONDS = 0.3
+ENCODE_SECONDS_PER_TEXT = 0.005
+
+
+def install_fakes(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_IN_FLIGHT", str(CONCURRENT_REQUESTS))
+    monkeypatch.setenv("OLLAMA_KEEP_WARM", "false")
+    for name in ("RESPONSE_CACHE", "WRITE_QUEUE", "SESSIONS", "EMBEDDING_CACHE"):
+        monkeypatch.setenv(name, "false")
+    for name in ("OPENAI_API_KEY", "EMBEDDING_WORKER_SOCKET", "JARVIS_WORKER_ID"):
+        monkeypatch.delenv(name, raising=False)
+
+    def create_vector_service():
+        service = VectorService(index=FakePineconeIndex(latency_ms=20))
+        service._embedding_model = FakeEncoder(seconds_per_text=ENCODE_SECONDS_PER_TEXT)
+        return service
+
+    def create_llm_service():
+        service = LLMService()
+        # The fake Ollama server answers in-process instead of over the network
+        ollama_app = fake_ollama.create_app(ttft_ms=LLM_SECONDS * 1000, tokens_per_sec=0, tokens=8)
+        service.ollama_client = ollama.AsyncClient(host="http://ollama.test",
+                                                   transport=httpx.ASGITransport(app=ollama_app))
+        return service
+
+    LLMService = jarvis.LLMService
+    monkeypatch.setattr(jarvis, "VectorService", create_vector_service)
+    monkeypatch.setattr(jarvis, "LLMService", create_llm_service)
+
+
+async def wait_until_ready(timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not HEALTH.is_ready():
+        assert time.monotonic() < deadline, f"App not ready: {HEALTH.snapshot()}"
+        await asyncio.sleep(0.01)
+
+
+async def timed_chats(client: httpx.AsyncClient, messages):
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(client.post("/chat", json={"message": message}) for message in messages))
+    elapsed = time.perf_counter() - started
+    for response in responses:
+        assert response.status_code == 200, response.text
+        assert response.json()["response"].startswith("token0"), response.json()
+    return elapsed
+
+
+async def run_chats():
+    # httpx does not run the lifespan hook, so enter it the way the server would
+    async with jarvis.app.router.lifespan_context(jarvis.app):
+        await wait_until_ready()
+        await jarvis.vector_service.add_document("Jarvis keeps notes in a vector index",
+                                                 {"source": "notes.md"})
+        transport = httpx.ASGITransport(app=jarvis.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://jarvis.test") as client:
+            single = await timed_chats(client, ["What does Jarvis keep?"])
+            concurrent = await timed_chats(
+                client, [f"Question {i} about the notes" for i in range(CONCURRENT_REQUESTS)]
+            )
+    return single, concurrent
+
+
+def test_concurrent_chats_overlap(monkeypatch):
+    install_fakes(monkeypatch)
+    single, concurrent = asyncio.run(run_chats())
+
+    assert single >= LLM_SECONDS
+    # Serialized requests would take CONCURRENT_REQUESTS * single; overlapping ones about one request
+    assert concurrent < CONCURRENT_REQUESTS * single / 3, (single, concurrent)
@@ -0,0 +1,151 @@
+"""
+Content-addressed ids: unchanged documents are skipped, changed metadata is not
+
+Re-posting the same text from the same source keeps its id. When only the
+metadata differ, the document has to be rewritten with its stored vector
+so filtered searches see the new values, without encoding the text again.
+A sync ingestion deletes what its sources no longer contain, leaving the
+unchanged chunks alone.
+
+    python -m pytest tests/test_dedup.py
+"""
+
+import asyncio
+
+from benchmarks.fakes import FakeEncoder
+from services.ingestion import IngestionPipeline, iterate
+from services.local_index import LocalVectorIndex
+from services.vector_service import VectorService
+from services.write_queue import INDEXED, WriteBehindQueue
+
+TEXT = "Connect to the VPN before opening the wiki"
+
+
+class CountingEncoder(FakeEncoder):
+    """FakeEncoder that remembers every text it was asked to encode"""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        self.texts.extend([texts] if isinstance(texts, str) else texts)
+        return super().encode(texts, batch_size, **kwargs)
+
+
+def create_service(monkeypatch, tmp_path):
+    for name in ("EMBEDDING_CACHE", "EMBEDDING_BATCHING", "HYBRID_SEARCH"):
+        monkeypatch.setenv(name, "false")
+    monkeypatch.delenv("EMBEDDING_WORKER_SOCKET", raising=False)
+    service = VectorService(index=LocalVectorIndex(str(tmp_path / "index")))
+    service._embedding_model = CountingEncoder()
+    return service
+
+
+async def found(service, filters):
+    # Embedded here so the service's encoder only counts document writes
+    query_embedding = FakeEncoder().encode(TEXT)
+    results = await service.search_similar(TEXT, top_k=5, query_embedding=query_embedding, filters=filters)
+    return [result["text"] for result in results]
+
+
+def test_add_document_rewrites_changed_metadata(monkeypatch, tmp_path):
+    service = create_service(monkeypatch, tmp_path)
+
+    async def run():
+        first = await service.add_document(TEXT, {"source": "it.md", "team": "support"})
+        again = await service.add_document(TEXT, {"source": "it.md", "team": "support"})
+        moved = await service.add_document(TEXT, {"source": "it.md", "team": "platform"})
+        assert first == again == moved
+        assert await found(service, {"team": "platform"}) == [TEXT]
+        assert await found(service, {"team": "support"}) == []
+
+    try:
+        asyncio.run(run())
+        # Only the first post was encoded: the metadata change reused the stored vector
+        assert service.embedding_model.texts == [TEXT]
+        assert service.index.describe_index_stats()["total_vector_count"] == 1
+    finally:
+        service.close()
+
+
+def test_write_queue_keeps_latest_metadata(monkeypatch, tmp_path):
+    service = create_service(monkeypatch, tmp_path)
+
+    async def run():
+        queue = WriteBehindQueue(service, wal_path=str(tmp_path / "wal.jsonl"), flush_interval_ms=10, fsync=False)
+        await queue.start()
+        try:
+            # Copies in one submit that differ only in metadata: the last one wins
+            ids = await queue.submit([TEXT, TEXT], [{"source": "it.md", "team": "support"},
+                                                    {"source": "it.md", "team": "platform"}])
+            assert ids[0] == ids[1]
+            assert (await queue.wait(ids[0], timeout=5))["status"] == INDEXED
+            assert await found(service, {"team": "platform"}) == [TEXT]
+
+            [doc_id] = await queue.submit([TEXT], [{"source": "it.md", "team": "security"}])
+            status = await queue.wait(doc_id, timeout=5)
+            assert status["status"] == INDEXED and not status.get("unchanged")
+            assert await found(service, {"team": "security"}) == [TEXT]
+            assert await found(service, {"team": "platform"}) == []
+
+            [doc_id] = await queue.submit([TEXT], [{"source": "it.md", "team": "security"}])
+            assert queue.status(doc_id)["unchanged"] is True
+        finally:
+            await queue.close()
+
+    try:
+        asyncio.run(run())
+        assert service.embedding_model.texts == [TEXT]
+    finally:
+        service.close()
+
+
+def test_ingestion_rewrites_changed_metadata(monkeypatch, tmp_path):
+    service = create_service(monkeypatch, tmp_path)
+
+    async def ingest(team):
+        pipeline = IngestionPipeline(service, chunk_size=1000, chunk_overlap=0)
+        return await pipeline.run(iterate([{"text": TEXT, "metadata": {"source": "it.md", "team": team}}]))
+
+    async def run():
+        await ingest("support")
+        unchanged = await ingest("support")
+        assert (unchanged.chunks, unchanged.unchanged) == (0, 1)
+        retagged = await ingest("platform")
+        assert (retagged.chunks, retagged.unchanged) == (1, 0)
+        assert await found(service, {"team": "platform"}) == [TEXT]
+
+    try:
+        asyncio.run(run())
+        assert service.embedding_model.texts == [TEXT]
+    finally:
+        service.close()
+
+
+def test_sync_deletes_what_sources_no_longer_contain(monkeypatch, tmp_path):
+    service = create_service(monkeypatch, tmp_path)
+
+    def record(source, text):
+        return {"text": text, "metadata": {"source": source}}
+
+    async def run():
+        pipeline = IngestionPipeline(service, chunk_size=1000, chunk_overlap=0)
+        await pipeline.run(iterate([record("docs/a.md", "Old page A"), record("docs/a.md", "Page A footer"),
+                                    record("docs/b.md", "Page B"), record("other/c.md", "Page C")]))
+        # docs/a.md lost a chunk and gained one, docs/b.md is gone, other/ is outside the prune prefix
+        stats = await pipeline.run(
+            iterate([record("docs/a.md", "New page A"), record("docs/a.md", "Page A footer")]),
+            sync=True, prune_prefixes=["docs/"],
+        )
+        assert (stats.chunks, stats.unchanged, stats.deleted) == (1, 1, 2)
+        assert {"docs/a.md", "docs/b.md"} <= pipeline.sources
+
+    try:
+        asyncio.run(run())
+        remaining = {metadata["text"] for _, _, metadatas in service.iter_documents() for metadata in metadatas}
+        assert remaining == {"New page A", "Page A footer", "Page C"}
+        assert service.manifest.ids_for_source("docs/b.md") == set()
+        assert service.embedding_model.texts == ["Old page A", "Page A footer", "Page B", "Page C", "New page A"]
+    finally:
+        service.close()
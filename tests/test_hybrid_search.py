@@ -0,0 +1,84 @@
+"""
+Hybrid retrieval: vector and BM25 results merged by reciprocal-rank fusion
+
+Exact identifiers that embeddings blur are still found through the
+keyword index, a document both retrievers rank highly comes first, and
+metadata filters and deletes apply to both sides.
+
+    python -m pytest tests/test_hybrid_search.py
+"""
+
+import asyncio
+
+import pytest
+
+from benchmarks.fakes import FakeEncoder
+from services.local_index import LocalVectorIndex, Match
+from services.manifest import document_id
+from services.vector_service import VectorService, reciprocal_rank_fusion
+
+TARGET = "Error ERR-4512 means the disk quota of the build agent is exceeded"
+RRF_K = 60
+
+
+def test_fusion_favours_documents_both_retrievers_found():
+    fused = reciprocal_rank_fusion({
+        "vector": [Match("a", 0.9, {}), Match("b", 0.8, {}), Match("c", 0.7, {})],
+        "keyword": [Match("c", 12.0, {}), Match("d", 9.0, {})],
+    }, RRF_K)
+    # Third on one list and first on the other beats first on one list alone
+    assert [entry["id"] for entry in fused][:2] == ["c", "a"]
+    assert {entry["id"] for entry in fused} == {"a", "b", "c", "d"}
+    assert fused[0]["fusion_score"] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 1))
+    assert (fused[0]["vector_score"], fused[0]["keyword_score"]) == (0.7, 12.0)
+    by_id = {entry["id"]: entry for entry in fused}
+    assert "keyword_score" not in by_id["a"] and "vector_score" not in by_id["d"]
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    for name in ("EMBEDDING_CACHE", "EMBEDDING_BATCHING"):
+        monkeypatch.setenv(name, "false")
+    monkeypatch.setenv("HYBRID_SEARCH", "true")
+    monkeypatch.setenv("HYBRID_RRF_K", str(RRF_K))
+    monkeypatch.delenv("EMBEDDING_WORKER_SOCKET", raising=False)
+    service = VectorService(index=LocalVectorIndex(str(tmp_path / "index")))
+    service._embedding_model = FakeEncoder()
+    texts = [f"Runbook page {i} about deployments, dashboards and on-call rotations" for i in range(40)] + [TARGET]
+    metadatas = [{"source": f"runbook/{i}.md", "team": "platform"} for i in range(40)] + [
+        {"source": "errors.md", "team": "build"}
+    ]
+    try:
+        asyncio.run(service.upsert_embeddings(texts, service.embedding_model.encode(texts), metadatas))
+        yield service
+    finally:
+        service.close()
+
+
+def search(service, query, embedding_of=None, **options):
+    # The fake encoder's vectors carry no meaning; pick which text the query "looks like" to the vector side
+    embedding = FakeEncoder().encode(embedding_of or query)
+    return asyncio.run(service.search_similar(query, top_k=5, query_embedding=embedding, **options))
+
+
+def test_exact_identifier_is_found_by_keyword(service):
+    results = search(service, "What does ERR-4512 mean?")
+    [found] = [result for result in results if result["text"] == TARGET]
+    assert found["keyword_score"] > 0
+    assert results.index(found) < 3
+
+
+def test_document_ranked_first_by_both_comes_first(service):
+    [first, *_] = search(service, "ERR-4512 disk quota", embedding_of=TARGET)
+    assert first["text"] == TARGET
+    assert first["score"] == pytest.approx(2 / (RRF_K + 1))
+    assert first["vector_score"] == pytest.approx(1.0, abs=1e-5) and first["keyword_score"] > 0
+
+
+def test_filters_and_deletes_apply_to_both_retrievers(service):
+    results = search(service, "ERR-4512 disk quota", embedding_of=TARGET, filters={"team": "platform"})
+    assert results and all(result["source"].startswith("runbook/") for result in results)
+
+    asyncio.run(service.delete_documents([document_id("errors.md", TARGET)]))
+    assert TARGET not in [result["text"] for result in search(service, "ERR-4512", embedding_of=TARGET)]
+    assert service.lexical_index.search("ERR-4512") == []
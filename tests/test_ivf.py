@@ -0,0 +1,111 @@
+"""
+IVF search over the local index
+
+Once trained, a query scores only the rows in its ``nprobe`` closest
+lists. Probing every list must give the exact answer, a few lists must
+keep recall high, and rows written or deleted after training must be
+found or dropped without retraining.
+
+    python -m pytest tests/test_ivf.py
+"""
+
+import numpy as np
+import pytest
+
+from benchmarks.quantbench import clustered_vectors, recall
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+
+DOCUMENTS = 3000
+LISTS = 32
+TOP_K = 10
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((20, EMBEDDING_DIMENSION)).astype(np.float32)
+    vectors = clustered_vectors(rng, centres, DOCUMENTS)
+    queries = clustered_vectors(np.random.default_rng(1), centres, 30)
+    return vectors, queries
+
+
+def open_index(path, **options) -> LocalVectorIndex:
+    # Trained explicitly by each test, never by the size threshold
+    return LocalVectorIndex(str(path), ann="ivf", ivf_lists=LISTS, ivf_nprobe=8,
+                            ivf_train_size=DOCUMENTS * 10, **options)
+
+
+@pytest.fixture
+def index(tmp_path, corpus):
+    vectors, _ = corpus
+    index = open_index(tmp_path / "index")
+    index.upsert([(f"doc-{i}", vector, {"group": i % 4}) for i, vector in enumerate(vectors)])
+    index.rebuild_ann(wait=True)
+    yield index
+    index.close()
+
+
+def search(index: LocalVectorIndex, queries: np.ndarray, **options):
+    return [[match.id for match in index.query(query, top_k=TOP_K, include_metadata=False, **options).matches]
+            for query in queries]
+
+
+def test_probing_every_list_is_exact(index, corpus):
+    _, queries = corpus
+    assert index.describe_index_stats()["ann"]["trained"]
+    assert search(index, queries, nprobe=LISTS) == search(index, queries, exact=True)
+
+
+def test_few_lists_keep_recall(index, corpus):
+    _, queries = corpus
+    truth = search(index, queries, exact=True)
+    assert recall(search(index, queries), truth, TOP_K) >= 0.9
+
+
+def test_writes_after_training_are_followed(index, corpus):
+    vectors, _ = corpus
+    index.upsert([("late", vectors[5] * 3, {"group": 9})])
+    index.delete(ids=["doc-5"])
+    ids = [match.id for match in index.query(vectors[5], top_k=3).matches]
+    assert ids[0] == "late" and "doc-5" not in ids
+    assert [match.id for match in index.query(vectors[5], top_k=1, filter={"group": 9}).matches] == ["late"]
+
+
+def test_filters_narrow_the_probed_lists(index, corpus):
+    _, queries = corpus
+    for ids in search(index, queries, filter={"group": 2}):
+        assert len(ids) == TOP_K
+        assert all(int(doc_id.split("-")[1]) % 4 == 2 for doc_id in ids)
+
+
+def test_lists_survive_reopen(tmp_path, index, corpus):
+    _, queries = corpus
+    before = search(index, queries)
+    index.close()
+    reopened = open_index(tmp_path / "index")
+    try:
+        assert reopened.describe_index_stats()["ann"]["trained"]
+        assert search(reopened, queries) == before
+    finally:
+        reopened.close()
+
+
+def test_read_only_follower_picks_up_retrained_lists(tmp_path, corpus):
+    vectors, queries = corpus
+    writer = open_index(tmp_path / "index")
+    follower = None
+    try:
+        writer.upsert([(f"doc-{i}", vector, {}) for i, vector in enumerate(vectors)])
+        writer.flush()
+        follower = open_index(tmp_path / "index", read_only=True)
+        assert not follower.describe_index_stats()["ann"]["trained"]
+
+        writer.rebuild_ann(wait=True)
+        writer.flush()
+        follower.refresh()
+        assert follower.describe_index_stats()["ann"]["trained"]
+        assert search(follower, queries) == search(writer, queries)
+    finally:
+        if follower is not None:
+            follower.close()
+        writer.close()
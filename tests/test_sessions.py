@@ -0,0 +1,120 @@
+"""
+Conversation sessions: bounded storage and background summarization
+
+The store keeps a running summary plus the turns not yet folded into it,
+expires idle sessions and evicts the least recently used past its limit.
+Turns that leave the window are folded into the summary by the LLM in
+the background, so a session's state stays the same size however long
+the conversation runs.
+
+    python -m pytest tests/test_sessions.py
+"""
+
+import asyncio
+import time
+
+import httpx
+
+import app as jarvis
+from services.sessions import SessionStore
+from tests.test_concurrency import install_fakes, wait_until_ready
+
+
+def test_turns_survive_a_restart(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    store = SessionStore(path)
+    store.append("alice", "Where is the wiki?", "On the intranet.", max_turns=10)
+    store.append("alice", "And the VPN?", "Connect first.", max_turns=10)
+    store.close()
+
+    reopened = SessionStore(path)
+    try:
+        session = reopened.get("alice")
+        assert [turn["user"] for turn in session["turns"]] == ["Where is the wiki?", "And the VPN?"]
+        assert [turn["n"] for turn in session["turns"]] == [0, 1]
+        assert reopened.stats()["memory_bytes"] == session["memory_bytes"] > 0
+    finally:
+        reopened.close()
+
+
+def test_oldest_turns_are_dropped_past_the_limit():
+    store = SessionStore()
+    try:
+        for i in range(5):
+            session, _ = store.append("alice", f"question {i}", f"answer {i}", max_turns=3)
+        assert [turn["n"] for turn in session["turns"]] == [2, 3, 4]
+        assert session["turns_total"] == 5
+    finally:
+        store.close()
+
+
+def test_fold_replaces_turns_unless_another_fold_got_there_first():
+    store = SessionStore()
+    try:
+        for i in range(4):
+            store.append("alice", f"question {i}", f"answer {i}", max_turns=10)
+        assert store.fold("alice", "Asked about 0 and 1.", through=1, expected_through=-1)
+        # A second fold started from the same state is stale now
+        assert not store.fold("alice", "Asked about 0.", through=0, expected_through=-1)
+
+        session = store.get("alice")
+        assert session["summary"] == "Asked about 0 and 1."
+        assert (session["summarized_through"], session["summarized_turns"]) == (1, 2)
+        assert [turn["n"] for turn in session["turns"]] == [2, 3]
+    finally:
+        store.close()
+
+
+def test_idle_sessions_expire_and_least_recently_used_are_evicted():
+    store = SessionStore(max_sessions=2, ttl_seconds=0.05)
+    try:
+        store.create("old")
+        time.sleep(0.1)
+        assert store.get("old") is None
+        assert store.expire() == ["old"]
+
+        store.create("first")
+        store.create("second")
+        store.append("first", "still here?", "yes", max_turns=10)
+        _, evicted = store.create("third")
+        assert evicted == ["second"]
+        assert store.stats()["sessions"] == 2
+    finally:
+        store.close()
+
+
+def test_chat_session_summarizes_older_turns(monkeypatch):
+    install_fakes(monkeypatch)
+    monkeypatch.setenv("SESSIONS", "true")
+    monkeypatch.setenv("SESSION_STORE_PATH", "")
+    monkeypatch.setenv("SESSION_WINDOW_TURNS", "2")
+    monkeypatch.setenv("SESSION_SUMMARIZE_BATCH", "2")
+
+    async def run():
+        async with jarvis.app.router.lifespan_context(jarvis.app):
+            await wait_until_ready()
+            transport = httpx.ASGITransport(app=jarvis.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://jarvis.test") as client:
+                session_id = (await client.post("/sessions")).json()["session_id"]
+                for i in range(4):
+                    response = await client.post("/chat", json={"message": f"Question {i}", "session_id": session_id})
+                    assert response.status_code == 200, response.text
+                    assert response.json()["session_id"] == session_id
+
+                # The two turns that left the window are folded in the background
+                deadline = time.monotonic() + 5
+                while True:
+                    session = (await client.get(f"/sessions/{session_id}")).json()
+                    if session["summarized_turns"] or time.monotonic() > deadline:
+                        break
+                    await asyncio.sleep(0.05)
+                assert session["turns"] == 4
+                assert (session["summarized_turns"], session["pending_turns"]) == (2, 2)
+                assert session["summary"].startswith("token0")
+                assert [turn["user"] for turn in session["recent"]] == ["Question 2", "Question 3"]
+                assert session["history_tokens"] > session["summary_tokens"] > 0
+
+                assert (await client.delete(f"/sessions/{session_id}")).status_code == 200
+                assert (await client.get(f"/sessions/{session_id}")).status_code == 404
+
+    asyncio.run(run())
@@ -0,0 +1,171 @@
+"""
+Single-flight: identical questions in flight share one generation
+
+Concurrent callers with the same key get the leader's result, or error;
+the work is cancelled only once every caller has gone. Streaming
+followers replay the tokens they missed and keep receiving after the
+leader's client leaves. Through the app, identical /chat and /chat/stream
+requests cost one generation between them.
+
+    python -m pytest tests/test_single_flight.py
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import app as jarvis
+from benchmarks import fake_ollama
+from services.single_flight import SingleFlight, StreamingSingleFlight
+from tests.test_concurrency import install_fakes, wait_until_ready
+
+CALLERS = 5
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(CALLERS)))
+        assert results == ["answer"] * CALLERS
+        assert len(flight) == 0
+        # Nothing is cached: the next call runs again
+        assert await flight.do("key", work) == "answer"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_failure_reaches_every_caller():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("no answer")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(CALLERS)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(run())
+
+
+def test_work_is_cancelled_only_when_every_caller_leaves():
+    flight = SingleFlight("test")
+    finished, cancelled = [], []
+
+    async def work():
+        try:
+            await asyncio.sleep(0.1)
+            finished.append(1)
+            return "answer"
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "answer"
+
+        alone = asyncio.ensure_future(flight.do("other", work))
+        await asyncio.sleep(0.01)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert (finished, cancelled) == ([1], [1])
+
+
+def test_stream_followers_replay_and_outlive_the_leader():
+    flights = StreamingSingleFlight("test")
+    producers = []
+
+    async def produce(broadcast):
+        producers.append(1)
+        broadcast.open(["notes.md"])
+        for i in range(4):
+            broadcast.publish(f"token{i} ")
+            await asyncio.sleep(0.01)
+
+    async def read(subscription):
+        broadcast = await subscription.ready()
+        try:
+            return broadcast.sources, [token async for token in broadcast.read()]
+        finally:
+            subscription.release()
+
+    async def run():
+        leader = flights.subscribe("key", produce)
+        await (await leader.ready()).read().__anext__()
+        await asyncio.sleep(0.015)
+        # Joins after the first tokens, then the leader's client goes away
+        follower = flights.subscribe("key", produce)
+        leader.release()
+        return await read(follower)
+
+    sources, tokens = asyncio.run(run())
+    assert sources == ["notes.md"]
+    assert tokens == [f"token{i} " for i in range(4)]
+    assert producers == [1]
+
+
+def test_stream_failure_before_opening_reaches_every_reader():
+    flights = StreamingSingleFlight("test")
+
+    async def produce(broadcast):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("over capacity")
+
+    async def run():
+        subscriptions = [flights.subscribe("key", produce) for _ in range(CALLERS)]
+        for subscription in subscriptions:
+            with pytest.raises(RuntimeError):
+                await subscription.ready()
+            subscription.release()
+
+    asyncio.run(run())
+
+
+def test_identical_requests_cost_one_generation(monkeypatch):
+    install_fakes(monkeypatch)
+    servers = []
+    create_app = fake_ollama.create_app
+
+    def record_server(**kwargs):
+        servers.append(create_app(**kwargs))
+        return servers[-1]
+
+    monkeypatch.setattr(fake_ollama, "create_app", record_server)
+
+    async def run():
+        async with jarvis.app.router.lifespan_context(jarvis.app):
+            await wait_until_ready()
+            [server] = servers
+            # The startup connection check generates too
+            before = server.state.generations
+            transport = httpx.ASGITransport(app=jarvis.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://jarvis.test") as client:
+                body = {"message": "What does Jarvis keep?"}
+                responses = await asyncio.gather(*(client.post("/chat", json=body) for _ in range(CALLERS)))
+                assert {response.status_code for response in responses} == {200}
+                assert len({response.json()["response"] for response in responses}) == 1
+                assert server.state.generations == before + 1
+
+                body = {"message": "Where are the notes?"}
+                streams = await asyncio.gather(*(client.post("/chat/stream", json=body) for _ in range(CALLERS)))
+                assert {response.status_code for response in streams} == {200}
+                assert len({response.text for response in streams}) == 1
+                assert "token7" in streams[0].text
+                assert server.state.generations == before + 2
+
+    asyncio.run(run())
@@ -0,0 +1,139 @@
+"""
+Knowledge base snapshots: round trip, resumable restore, damaged files
+
+A snapshot carries the stored vectors, so restoring one, into either
+backend, brings back every document and its metadata without embedding
+anything. Restoring it again skips what is already there, and a flipped
+or missing byte fails the restore instead of being reported as complete.
+
+    python -m pytest tests/test_snapshot.py
+"""
+
+import asyncio
+import io
+
+import numpy as np
+import pytest
+
+from benchmarks.fakes import FakeEncoder, FakePineconeIndex
+from services.local_index import EMBEDDING_DIMENSION, LocalVectorIndex
+from services.snapshot import SnapshotError, export_snapshot, import_snapshot, verify_snapshot
+from services.vector_service import VectorService
+
+DOCUMENTS = 250
+CHUNK_ROWS = 100
+
+
+class NoEncoder(FakeEncoder):
+    """Fails the test if anything asks for an embedding"""
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        raise AssertionError("a snapshot restore must not embed anything")
+
+
+def create_service(monkeypatch, index) -> VectorService:
+    for name in ("EMBEDDING_CACHE", "EMBEDDING_BATCHING", "HYBRID_SEARCH"):
+        monkeypatch.setenv(name, "false")
+    monkeypatch.delenv("EMBEDDING_WORKER_SOCKET", raising=False)
+    service = VectorService(index=index)
+    service._embedding_model = NoEncoder()
+    return service
+
+
+def documents(service: VectorService):
+    found = {}
+    for ids, vectors, metadatas in service.iter_documents(CHUNK_ROWS):
+        found.update((doc_id, (vector, metadata)) for doc_id, vector, metadata in zip(ids, vectors, metadatas))
+    return found
+
+
+@pytest.fixture
+def source(monkeypatch, tmp_path):
+    """A local index of ``DOCUMENTS`` documents"""
+    service = create_service(monkeypatch, LocalVectorIndex(str(tmp_path / "index")))
+    vectors = np.random.default_rng(0).standard_normal((DOCUMENTS, EMBEDDING_DIMENSION)).astype(np.float32)
+    texts = [f"note {i}" for i in range(DOCUMENTS)]
+    metadatas = [{"source": f"notes/{i % 7}.md", "team": ["support", "platform"][i % 2]} for i in range(DOCUMENTS)]
+    try:
+        asyncio.run(service.upsert_embeddings(texts, vectors, metadatas))
+        yield service
+    finally:
+        service.close()
+
+
+@pytest.fixture
+def snapshot(source):
+    """The source index's snapshot and its documents"""
+    f = io.BytesIO()
+    stats = export_snapshot(source, f, chunk_rows=CHUNK_ROWS)
+    assert (stats["documents"], stats["chunks"], stats["bytes"]) == (DOCUMENTS, 3, len(f.getvalue()))
+    return f.getvalue(), documents(source)
+
+
+def test_round_trip_restores_every_document(monkeypatch, snapshot):
+    data, expected = snapshot
+    assert verify_snapshot(io.BytesIO(data))["documents"] == DOCUMENTS
+
+    service = create_service(monkeypatch, FakePineconeIndex())
+    try:
+        stats = asyncio.run(import_snapshot(service, io.BytesIO(data), upsert_batch_size=40))
+        assert (stats["documents"], stats["restored"], stats["skipped"]) == (DOCUMENTS, DOCUMENTS, 0)
+        restored = documents(service)
+        assert restored.keys() == expected.keys()
+        for doc_id, (vector, metadata) in expected.items():
+            assert np.allclose(restored[doc_id][0], vector)
+            assert restored[doc_id][1] == metadata
+
+        # Run again, as after an interrupted restore: everything is already there
+        again = asyncio.run(import_snapshot(service, io.BytesIO(data)))
+        assert (again["restored"], again["skipped"]) == (0, DOCUMENTS)
+    finally:
+        service.close()
+
+
+def test_float16_snapshot_is_smaller_and_close(monkeypatch, source, snapshot):
+    data, expected = snapshot
+    f = io.BytesIO()
+    export_snapshot(source, f, dtype="float16", chunk_rows=CHUNK_ROWS)
+    assert len(f.getvalue()) < len(data)
+
+    service = create_service(monkeypatch, FakePineconeIndex())
+    try:
+        asyncio.run(import_snapshot(service, io.BytesIO(f.getvalue())))
+        restored = documents(service)
+        for doc_id, (vector, _) in expected.items():
+            assert np.allclose(restored[doc_id][0], vector, atol=1e-2)
+    finally:
+        service.close()
+
+
+@pytest.mark.parametrize("damage", ["flipped byte", "truncated"])
+def test_damaged_snapshot_is_refused(monkeypatch, snapshot, damage):
+    data, _ = snapshot
+    if damage == "flipped byte":
+        # Inside the last chunk, so the earlier chunks read fine first
+        position = len(data) - 100
+        data = data[:position] + bytes([data[position] ^ 0xFF]) + data[position + 1:]
+    else:
+        data = data[:-10]
+
+    with pytest.raises(SnapshotError):
+        verify_snapshot(io.BytesIO(data))
+    service = create_service(monkeypatch, FakePineconeIndex())
+    try:
+        with pytest.raises(SnapshotError):
+            asyncio.run(import_snapshot(service, io.BytesIO(data)))
+    finally:
+        service.close()
+
+
+def test_snapshot_from_another_model_is_refused(monkeypatch, snapshot):
+    data, _ = snapshot
+    service = create_service(monkeypatch, FakePineconeIndex())
+    service.embedding_model_name = "another-model"
+    try:
+        with pytest.raises(SnapshotError, match="embedded with"):
+            asyncio.run(import_snapshot(service, io.BytesIO(data)))
+        assert documents(service) == {}
+    finally:
+        service.close()
@@ -0,0 +1,145 @@
+"""
+Write-behind queue: durable acceptance, retries and crash recovery
+
+Accepted documents are in the write-ahead log before ``submit`` returns,
+so a process that dies before writing them re-queues them on the next
+start. Transient store failures are retried; a document the store rejects
+outright fails alone instead of taking its batch down with it.
+
+    python -m pytest tests/test_write_queue.py
+"""
+
+import asyncio
+
+from benchmarks.fakes import FakeEncoder, FakePineconeIndex
+from services.vector_service import VectorService
+from services.write_queue import FAILED, INDEXED, WriteAheadLog, WriteBehindQueue
+
+
+class FlakyIndex(FakePineconeIndex):
+    """Pinecone stand-in that fails the next ``failures`` upserts, and rejects texts containing ``reject``"""
+
+    def __init__(self, failures: int = 0, reject: str = None):
+        super().__init__()
+        self.failures = failures
+        self.reject = reject
+        self.upserts = 0
+
+    def upsert(self, vectors, **kwargs):
+        self.upserts += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("store unavailable")
+        if self.reject and any(self.reject in metadata["text"] for _, _, metadata in vectors):
+            raise ValueError("malformed document")
+        return super().upsert(vectors, **kwargs)
+
+
+def create_service(monkeypatch, index) -> VectorService:
+    for name in ("EMBEDDING_CACHE", "EMBEDDING_BATCHING"):
+        monkeypatch.setenv(name, "false")
+    monkeypatch.delenv("EMBEDDING_WORKER_SOCKET", raising=False)
+    service = VectorService(index=index)
+    service._embedding_model = FakeEncoder()
+    return service
+
+
+def create_queue(service, wal_path) -> WriteBehindQueue:
+    return WriteBehindQueue(service, wal_path=str(wal_path), flush_interval_ms=10,
+                            backoff_base=0.01, backoff_max=0.05, max_retries=3, fsync=False)
+
+
+def stored_ids(index: FakePineconeIndex):
+    return {doc_id for page in index.list() for doc_id in page}
+
+
+def test_unwritten_documents_survive_a_crash(monkeypatch, tmp_path):
+    wal_path = tmp_path / "wal.jsonl"
+    down = create_service(monkeypatch, FlakyIndex(failures=10 ** 6))
+
+    async def accept_then_crash():
+        queue = create_queue(down, wal_path)
+        await queue.start()
+        ids = await queue.submit(["first note", "second note"], [{"source": "a.md"}, {"source": "a.md"}])
+        # Re-posted with new metadata before it was ever written: the later copy is the one to recover
+        await queue.submit(["second note"], [{"source": "a.md", "team": "support"}])
+        await asyncio.sleep(0.05)
+        assert {queue.status(doc_id)["status"] for doc_id in ids} == {"pending"}
+        return ids
+
+    # Leaving asyncio.run without closing the queue is as abrupt as the process dying
+    ids = asyncio.run(accept_then_crash())
+    with open(wal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "id": "torn')
+
+    index = FlakyIndex()
+    service = create_service(monkeypatch, index)
+
+    async def restart():
+        queue = create_queue(service, wal_path)
+        await queue.start()
+        try:
+            await asyncio.wait_for(queue.wait_idle(), 5)
+            assert [queue.status(doc_id)["status"] for doc_id in ids] == [INDEXED, INDEXED]
+        finally:
+            await queue.close()
+
+    asyncio.run(restart())
+    assert stored_ids(index) == set(ids)
+    assert index.fetch([ids[1]])["vectors"][ids[1]]["metadata"]["team"] == "support"
+    # Everything was written, so nothing is left to replay
+    assert WriteAheadLog(str(wal_path)).replay() == []
+
+
+def test_finished_documents_are_not_replayed(monkeypatch, tmp_path):
+    wal_path = tmp_path / "wal.jsonl"
+    index = FlakyIndex()
+    service = create_service(monkeypatch, index)
+
+    async def run():
+        queue = create_queue(service, wal_path)
+        await queue.start()
+        [doc_id] = await queue.submit(["a note"], [{"source": "a.md"}])
+        assert (await queue.wait(doc_id, timeout=5))["status"] == INDEXED
+        return doc_id
+
+    # Not closed: the "done" record alone has to keep it from coming back
+    asyncio.run(run())
+    assert WriteAheadLog(str(wal_path)).replay() == []
+
+
+def test_transient_failures_are_retried(monkeypatch, tmp_path):
+    index = FlakyIndex(failures=2)
+    service = create_service(monkeypatch, index)
+
+    async def run():
+        queue = create_queue(service, tmp_path / "wal.jsonl")
+        await queue.start()
+        try:
+            [doc_id] = await queue.submit(["a note"], [{"source": "a.md"}])
+            return await queue.wait(doc_id, timeout=5)
+        finally:
+            await queue.close()
+
+    status = asyncio.run(run())
+    assert status["status"] == INDEXED
+    assert index.upserts == 3
+
+
+def test_a_rejected_document_fails_alone(monkeypatch, tmp_path):
+    index = FlakyIndex(reject="bad")
+    service = create_service(monkeypatch, index)
+
+    async def run():
+        queue = create_queue(service, tmp_path / "wal.jsonl")
+        await queue.start()
+        try:
+            ids = await queue.submit(["good one", "bad one", "good two", "good three"],
+                                     [{"source": "a.md"}] * 4)
+            return ids, [(await queue.wait(doc_id, timeout=5))["status"] for doc_id in ids]
+        finally:
+            await queue.close()
+
+    ids, statuses = asyncio.run(run())
+    assert statuses == [INDEXED, FAILED, INDEXED, INDEXED]
+    assert stored_ids(index) == {ids[0], ids[2], ids[3]}